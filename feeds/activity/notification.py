@@ -1,7 +1,9 @@
 from .base import BaseActivity
-import uuid
 import json
-from ..util import epoch_ms
+from ..util import (
+    epoch_ms,
+    sortable_id
+)
 from .. import verbs
 from .. import notification_level
 from feeds.exceptions import (
@@ -73,7 +75,6 @@ class Notification(BaseActivity):
         assert users is None or isinstance(users, list), "users must be either a list or None"
         assert context is None or isinstance(context, dict), "context must be either a dict or None"
 
-        self.id = str(uuid.uuid4())
         self.actor = actor
         self.verb = verbs.translate_verb(verb)
         self.object = note_object
@@ -82,6 +83,9 @@ class Notification(BaseActivity):
         self.context = context
         self.level = notification_level.translate_level(level)
         self.created = epoch_ms()  # int timestamp down to millisecond
+        # time-sortable, so notes sort the same by id as by (created, id). Older notes have
+        # UUIDs for ids.
+        self.id = sortable_id(self.created)
         if expires is None:
             expires = self._default_lifespan() + self.created
         self.validate_expiration(expires, self.created)
@@ -256,16 +260,16 @@ class Notification(BaseActivity):
         if missing_keys:
             raise InvalidNotificationError('Missing keys: {}'.format(missing_keys))
         deserial = cls(
-            Entity.from_dict(serial['actor'], token=token),
+            Entity.from_stored(serial['actor'], token=token),
             str(serial['verb']),
-            Entity.from_dict(serial['object'], token=token),
+            Entity.from_stored(serial['object'], token=token),
             serial['source'],
             level=str(serial['level']),
-            target=[Entity.from_dict(t, token=token) for t in serial.get('target', [])],
+            target=[Entity.from_stored(t, token=token) for t in serial.get('target', [])],
             context=serial.get('context'),
             external_key=serial.get('external_key'),
             seen=serial.get('seen', False),
-            users=[Entity.from_dict(u, token=token) for u in serial.get('users', [])]
+            users=[Entity.from_stored(u, token=token) for u in serial.get('users', [])]
         )
         deserial.created = serial['created']
         deserial.expires = serial['expires']
@@ -2,8 +2,14 @@ import flask
 from flask import request
 from flask_cors import cross_origin
 import json
+import queue
+import time
+from typing import (
+    List,
+    Optional,
+    Tuple
+)
 
-from feeds.activity.notification import Notification
 from feeds.managers.notification_manager import NotificationManager
 from feeds.feeds.notification.notification_feed import NotificationFeed
 from feeds.external_api.auth import (
@@ -12,24 +18,38 @@ from feeds.external_api.auth import (
     get_auth_token,
     is_feeds_admin
 )
-from feeds.external_api.groups import (
-    get_user_groups
-)
 from feeds.exceptions import (
     InvalidTokenError,
     IllegalParameterError,
     MissingParameterError,
-    NotificationNotFoundError
+    NotificationNotFoundError,
+    EntityValidationError,
+    MissingVerbError,
+    MissingLevelError,
+    InvalidExpirationError
 )
 from feeds.config import get_config
 from feeds.logger import log
 from feeds.notification_level import translate_level
 from feeds.verbs import translate_verb
+from feeds.util import decode_cursor
 from .util import (
     parse_notification_params,
+    make_notification,
+    parse_bulk_notification_params,
     parse_expire_notifications_params,
     fetch_global_notifications,
-    get_global_feed
+    get_global_feed,
+    get_feed_etag,
+    get_cached_user_groups,
+    format_stream_event,
+    stream_note_view,
+    STREAM_KEEPALIVE,
+    STREAM_RECOUNT_WAIT
+)
+from feeds.storage.factory import (
+    get_notification_hub,
+    get_global_seen_storage
 )
 
 cfg = get_config()
@@ -42,11 +62,14 @@ def root():
         'routes': {
             'root': 'GET /',
             'add_notification': 'POST /notification',
+            'add_notifications': 'POST /notifications/bulk',
             'get_notifications': 'GET /notifications',
             'get_global_notifications': 'GET /notifications/global',
             'get_specific_notification': 'GET /notification/<note_id>',
             'mark_notifications_seen': 'POST /notifications/see',
-            'mark_notifications_unseen': 'POST /notifications/unsee'
+            'mark_notifications_unseen': 'POST /notifications/unsee',
+            'mark_all_notifications_seen': 'POST /notifications/see_all',
+            'stream_notifications': 'GET /notifications/stream'
         }
     }
     return flask.jsonify(resp)
@@ -59,7 +82,9 @@ def get_notifications():
     General flow should be:
     1. validate/authenticate user
     2. make user feed object
-    3. query user feed for most recent, based on params
+    3. if the client's ETag still matches the feeds, stop with a 304 (the user's groups are
+       cached for a bit, so this doesn't need any service calls)
+    4. query user feed for most recent, based on params
     """
     max_notes = request.args.get('n', default=cfg.default_max_notes, type=int)
 
@@ -78,37 +103,46 @@ def get_notifications():
 
     include_seen = request.args.get('seen', default=0, type=int)
     include_seen = False if include_seen == 0 else True
+
+    before = _get_cursor_arg('before')
+    after = _get_cursor_arg('after')
+
     user_token = get_auth_token(request)
     user_id = validate_user_token(user_token)
     log(__name__, 'Getting feed for {}'.format(user_id))
 
     feed = NotificationFeed(user_id, "user", token=user_token)
+    # temporary until sometime after the GSP meeting when we work out
+    # how to properly support following various channels and posting to
+    # them and such.
+    user_groups = get_cached_user_groups(user_token)
+    # group feeds are filtered out of the user's feed, so the user and global versions
+    # cover them too.
+    etag = get_feed_etag(
+        [feed.user, get_global_feed().user], request.full_path, user_groups
+    )
+    if request.if_none_match.contains(etag):
+        return _not_modified(etag)
+
     user_notes = feed.get_notifications(
         count=max_notes, include_seen=include_seen, level=level_filter,
-        verb=verb_filter, reverse=rev_sort, user_view=True
+        verb=verb_filter, reverse=rev_sort, user_view=True,
+        before=before, after=after
     )
 
     return_vals = {
         "user": user_notes,
-        "global": fetch_global_notifications(count=max_notes)
+        "global": fetch_global_notifications(count=max_notes, user=feed.user)
     }
 
-    user_groups = get_user_groups(user_token)
-    for g in user_groups:
-        # temporary until sometime after the GSP meeting when we work out
-        # how to properly support following various channels and posting to
-        # them and such.
-        return_vals[g["id"]] = feed.get_group_notifications(
-            g, count=max_notes, include_seen=include_seen, level=level_filter,
-            verb=verb_filter, reverse=rev_sort
-        )
-        # feed = NotificationFeed(g["id"], "group")
-        # return_vals[g["id"]] = feed.get_notifications(
-        #     count=max_notes, include_seen=include_seen, level=level_filter,
-        #     verb=verb_filter, reverse=rev_sort, user_view=True
-        # )
+    return_vals.update(feed.get_groups_notifications(
+        user_groups, count=max_notes, include_seen=include_seen, level=level_filter,
+        verb=verb_filter, reverse=rev_sort
+    ))
 
-    return (flask.jsonify(return_vals), 200)
+    response = flask.jsonify(return_vals)
+    response.set_etag(etag)
+    return (response, 200)
 
 
 @api_v1.route('/notification', methods=['POST'])
@@ -134,31 +168,11 @@ def add_notification():
 
     This also requires a service token as an Authorization header.
     """
-    token = get_auth_token(request)
-    try:
-        validate_service_token(token)
-    except InvalidTokenError:
-        if cfg.debug:
-            if not is_feeds_admin(token):
-                raise InvalidTokenError('Auth token must be either a Service token '
-                                        'or from a user with the FEEDS_ADMIN role!')
-        else:
-            raise
+    _validate_poster_token(get_auth_token(request))
     log(__name__, request.get_data())
     params = parse_notification_params(json.loads(request.get_data()))
     # create a Notification from params.
-    new_note = Notification(
-        params.get('actor'),
-        params.get('verb'),
-        params.get('object'),
-        params.get('source'),
-        level=params.get('level'),
-        target=params.get('target', []),
-        context=params.get('context'),
-        expires=params.get('expires'),
-        external_key=params.get('external_key'),
-        users=params.get('users', [])
-    )
+    new_note = make_notification(params)
     # pass it to the NotificationManager to dole out to its audience feeds.
     manager = NotificationManager()
     manager.add_notification(new_note)
@@ -166,10 +180,71 @@ def add_notification():
     return (flask.jsonify({'id': new_note.id}), 200)
 
 
+@api_v1.route('/notifications/bulk', methods=['POST'])
+@cross_origin()
+def add_notifications():
+    """
+    Adds several new notifications at once. Expects JSON in the body formatted like this:
+    {
+        "notifications": [notification]
+    }
+    where each notification has the same fields as in add_notification. Up to
+    MAX_BULK_NOTIFICATIONS can be added at a time.
+
+    Each notification is handled separately - any that are malformed or can't be stored are
+    left out, and the rest are added. This returns a result for each one, in order:
+    {
+        "notifications": [{
+            "id": the new notification id, or None if it wasn't added,
+            "error": None, or why it wasn't added
+        }]
+    }
+
+    This requires the same token as add_notification.
+    """
+    _validate_poster_token(get_auth_token(request))
+    notes_params = parse_bulk_notification_params(json.loads(request.get_data()))
+    results = list()
+    new_notes = list()
+    for params in notes_params:
+        try:
+            new_notes.append(make_notification(parse_notification_params(params)))
+            results.append({'id': None, 'error': None})
+        except (MissingParameterError, IllegalParameterError, EntityValidationError,
+                MissingVerbError, MissingLevelError, InvalidExpirationError) as e:
+            results.append({'id': None, 'error': str(e)})
+        except (AssertionError, TypeError, ValueError) as e:
+            # the Notification and Entity constructors assert on their argument types
+            results.append({'id': None, 'error': "Invalid notification: {}".format(e)})
+    errors = NotificationManager().add_notifications(new_notes)
+    added = iter(zip(new_notes, errors))
+    for result in results:
+        if result['error'] is None:
+            (note, error) = next(added)
+            if error is None:
+                result['id'] = note.id
+            else:
+                result['error'] = error
+    log(__name__, "Added {} of {} notifications".format(
+        len([r for r in results if r['id'] is not None]), len(results)
+    ))
+    return (flask.jsonify({'notifications': results}), 200)
+
+
 @api_v1.route('/notifications/global', methods=['GET'])
 @cross_origin()
 def get_global_notifications():
-    return (flask.jsonify(fetch_global_notifications()), 200)
+    """
+    Returns the global feed. Takes the same n, rev, before, and after parameters as
+    get_notifications, so the global cursor returned there can be used to page through it.
+    """
+    max_notes = request.args.get('n', default=0, type=int)
+    rev_sort = request.args.get('rev', default=0, type=int) != 0
+    global_notes = fetch_global_notifications(
+        count=max_notes, reverse=rev_sort, before=_get_cursor_arg('before'),
+        after=_get_cursor_arg('after')
+    )
+    return (flask.jsonify(global_notes), 200)
 
 
 @api_v1.route('/notifications/unseen_count', methods=['GET'])
@@ -178,16 +253,88 @@ def get_unseen_notification_count():
     user_token = get_auth_token(request)
     user_id = validate_user_token(user_token)
     feed = NotificationFeed(user_id, "user", token=user_token)
+    etag = get_feed_etag([feed.user, get_global_feed().user], request.path)
+    if request.if_none_match.contains(etag):
+        return _not_modified(etag)
     user_count = feed.get_unseen_count()
-    global_feed = get_global_feed()
-    global_count = global_feed.get_unseen_count()
+    global_count = get_global_seen_storage().get_unseen_count(feed.user)
     ret_value = {
         "unseen": {
             "user": user_count,
             "global": global_count
         }
     }
-    return (flask.jsonify(ret_value), 200)
+    response = flask.jsonify(ret_value)
+    response.set_etag(etag)
+    return (response, 200)
+
+
+@api_v1.route('/notifications/stream', methods=['GET'])
+@cross_origin()
+def stream_notifications():
+    """
+    Streams updates to the user's feed as Server-Sent Events, instead of polling.
+    Starts with an "unseen" event with the same structure as GET /notifications/unseen_count,
+    then sends a "notification" event with the user view of each new notification in the
+    user's (or the global) feed, and another "unseen" event whenever either count changes.
+    A comment gets sent every STREAM_KEEPALIVE seconds to keep the connection open.
+    The counts are only looked up at the start. A new notification just adds one to its
+    count. Other changes don't say how the count changed, so it gets looked up again once
+    STREAM_RECOUNT_WAIT seconds have passed, which covers any others that come in meanwhile.
+    """
+    user_token = get_auth_token(request)
+    user_id = validate_user_token(user_token)
+    feed = NotificationFeed(user_id, "user", token=user_token)
+    global_seen = get_global_seen_storage()
+    recounts = {
+        "user": feed.get_unseen_count,
+        "global": lambda: global_seen.get_unseen_count(feed.user)
+    }
+
+    def events():
+        hub = get_notification_hub()
+        changes = hub.subscribe(feed.user)
+        try:
+            counts = {key: recount() for key, recount in recounts.items()}
+            yield format_stream_event("unseen", {"unseen": counts})
+            stale = set()
+            recount_at = None
+            while True:
+                new_counts = dict(counts)
+                if recount_at is not None and time.time() >= recount_at:
+                    for key in stale:
+                        new_counts[key] = recounts[key]()
+                    stale = set()
+                    recount_at = None
+                else:
+                    timeout = STREAM_KEEPALIVE
+                    if recount_at is not None:
+                        timeout = max(0, recount_at - time.time())
+                    try:
+                        event = changes.get(timeout=timeout)
+                    except queue.Empty:
+                        if recount_at is None:
+                            yield ": keepalive\n\n"
+                        continue
+                    key = "global" if event.is_global else "user"
+                    if event.change == "insert":
+                        yield format_stream_event("notification", event.shared(stream_note_view))
+                        new_counts[key] += 1
+                    else:
+                        stale.add(key)
+                        if recount_at is None:
+                            recount_at = time.time() + STREAM_RECOUNT_WAIT
+                if new_counts != counts:
+                    counts = new_counts
+                    yield format_stream_event("unseen", {"unseen": counts})
+        finally:
+            hub.unsubscribe(feed.user, changes)
+
+    return flask.Response(
+        flask.stream_with_context(events()),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
 
 
 @api_v1.route('/notification/external_key/<ext_key>/source/<source>', methods=['GET'])
@@ -197,7 +344,9 @@ def get_notification_by_ext_key(ext_key, source):
     Intended for debugging, this returns the notification by
     external key for a service token. The service must match the
     source of the notification.
+    If the archived parameter is 1, archived notifications are included.
     """
+    include_archived = request.args.get('archived', default=0, type=int)
     token = get_auth_token(request)
     try:
         validate_service_token(token)
@@ -206,7 +355,8 @@ def get_notification_by_ext_key(ext_key, source):
             raise InvalidTokenError('Auth token must be either a Service token '
                                     'or from a user with the FEEDS_ADMIN role!')
     manager = NotificationManager()
-    notes = manager.get_notifications_by_ext_keys([ext_key], source)
+    notes = manager.get_notifications_by_ext_keys([ext_key], source,
+                                                  include_archived=bool(include_archived))
     note = notes.get(ext_key)
     if note is None:
         raise NotificationNotFoundError(
@@ -229,7 +379,10 @@ def get_single_notification(note_id):
     try:
         note = feed.get_notification(note_id)
     except NotificationNotFoundError:
-        note = NotificationFeed(cfg.global_feed, cfg.global_feed_type).get_notification(note_id)
+        note = get_global_feed().get_notification(note_id)
+        note.seen = get_global_seen_storage().get_seen(
+            feed.user, [(note.id, note.created)]
+        )[note.id]
     return (flask.jsonify({'notification': note.user_view()}), 200)
 
 
@@ -240,23 +393,14 @@ def mark_notifications_unseen():
     Form data should have a list of notification ids to mark as unseen.
     If any of these do not have the user's id (from the token) on the list,
     raise an error.
-    Any of these ids that are global, do nothing... for now.
+    Ids of global notifications are marked as unseen for this user only.
     """
     user_id = validate_user_token(get_auth_token(request))
 
     params = _get_mark_notification_params(json.loads(request.get_data()))
     note_ids = params.get('note_ids')
 
-    feed = NotificationFeed(user_id, "user")
-    unauthorized_notes = list()
-    for note_id in note_ids:
-        try:
-            feed.get_notification(note_id)
-        except NotificationNotFoundError:
-            unauthorized_notes.append(note_id)
-
-    unseen_notes = list(set(note_ids) - set(unauthorized_notes))
-    feed.mark_activities(unseen_notes, seen=False)
+    (unseen_notes, unauthorized_notes) = _mark_notifications(user_id, note_ids, False)
 
     return (flask.jsonify({'unseen_notes': unseen_notes,
                            'unauthorized_notes': unauthorized_notes}), 200)
@@ -269,28 +413,41 @@ def mark_notifications_seen():
     Form data should have a list of notification ids to mark as seen.
     If any of these do not have the user's id (from the token) on the list,
     raise an error.
-    Any of these ids that are global, do nothing... for now.
+    Ids of global notifications are marked as seen for this user only.
     """
     user_id = validate_user_token(get_auth_token(request))
 
     params = _get_mark_notification_params(json.loads(request.get_data()))
     note_ids = params.get('note_ids')
 
-    feed = NotificationFeed(user_id, "user")
-    unauthorized_notes = list()
-    for note_id in note_ids:
-        try:
-            feed.get_notification(note_id)
-        except NotificationNotFoundError:
-            unauthorized_notes.append(note_id)
-
-    seen_notes = list(set(note_ids) - set(unauthorized_notes))
-    feed.mark_activities(seen_notes, seen=True)
+    (seen_notes, unauthorized_notes) = _mark_notifications(user_id, note_ids, True)
 
     return (flask.jsonify({'seen_notes': seen_notes,
                            'unauthorized_notes': unauthorized_notes}), 200)
 
 
+@api_v1.route('/notifications/see_all', methods=['POST'])
+@cross_origin()
+def mark_all_notifications_seen():
+    """
+    Marks everything in the user's feed as seen, along with the global notifications for this
+    user only. The optional level, verb, source, and before (epoch ms) parameters in the body
+    narrow that down to just the matching notifications.
+    This doesn't look at the notifications first, so it's a single update in storage no
+    matter how many get marked.
+    """
+    user_id = validate_user_token(get_auth_token(request))
+
+    data = request.get_data()
+    params = _get_mark_all_seen_params(json.loads(data) if data else {})
+
+    feed = NotificationFeed(user_id, "user")
+    seen_count = feed.mark_all_seen(**params)
+    get_global_seen_storage().set_all_seen(feed.user, **params)
+
+    return (flask.jsonify({'seen_count': seen_count}), 200)
+
+
 @api_v1.route('/notifications/expire', methods=['POST'])
 @cross_origin()
 def expire_notifications():
@@ -333,6 +490,99 @@ def expire_notifications():
     return (flask.jsonify(result), 200)
 
 
+def _validate_poster_token(token: str) -> None:
+    """
+    Notifications can be added with a service token, or, in debug mode, by a user with the
+    FEEDS_ADMIN role. Raises an InvalidTokenError otherwise.
+    """
+    try:
+        validate_service_token(token)
+    except InvalidTokenError:
+        if cfg.debug:
+            if not is_feeds_admin(token):
+                raise InvalidTokenError('Auth token must be either a Service token '
+                                        'or from a user with the FEEDS_ADMIN role!')
+        else:
+            raise
+
+
+def _get_cursor_arg(name: str) -> Optional[Tuple[int, str]]:
+    """
+    Decodes the cursor in the named URL parameter, if there is one (see
+    feeds.util.decode_cursor).
+    """
+    cursor = request.args.get(name, default=None, type=str)
+    if cursor is None:
+        return None
+    return decode_cursor(cursor)
+
+
+def _not_modified(etag: str) -> flask.Response:
+    response = flask.make_response('', 304)
+    response.set_etag(etag)
+    return response
+
+
+def _mark_notifications(user_id: str, note_ids: List[str], seen: bool
+                        ) -> Tuple[List[str], List[str]]:
+    """
+    Marks the notifications as seen or unseen for the user. The ones in the user's feed are
+    found with one lookup, and any that aren't are looked for in the global feed with
+    another. Global ones are only marked for this user.
+    Returns a tuple of (marked ids, unauthorized ids) - unauthorized ones aren't in either feed,
+    and are left alone.
+    """
+    feed = NotificationFeed(user_id, "user")
+    note_ids = list(dict.fromkeys(note_ids))
+    user_notes = set(feed.find_notification_ids(note_ids))
+    others = [n for n in note_ids if n not in user_notes]
+    global_notes = set(get_global_feed().find_notification_ids(others))
+    unauthorized_notes = [n for n in others if n not in global_notes]
+
+    marked_notes = [n for n in note_ids if n in user_notes]
+    if marked_notes:
+        feed.mark_activities(marked_notes, seen=seen)
+    global_notes = [n for n in others if n in global_notes]
+    if global_notes:
+        if seen:
+            get_global_seen_storage().set_seen(global_notes, feed.user)
+        else:
+            get_global_seen_storage().set_unseen(global_notes, feed.user)
+    return (marked_notes + global_notes, unauthorized_notes)
+
+
+def _get_mark_all_seen_params(params) -> dict:
+    """
+    Validates the filters for marking everything as seen, and returns them as keyword
+    arguments for NotificationFeed.mark_all_seen.
+    """
+    if not isinstance(params, dict):
+        raise IllegalParameterError('Expected a JSON object as an input.')
+
+    filters = {'level': None, 'verb': None, 'source': None, 'before': None}
+    try:
+        if params.get('level') is not None:
+            filters['level'] = translate_level(params['level'])
+        if params.get('verb') is not None:
+            filters['verb'] = translate_verb(params['verb'])
+    except (MissingLevelError, MissingVerbError, TypeError) as e:
+        raise IllegalParameterError(str(e))
+
+    source = params.get('source')
+    if source is not None:
+        if not isinstance(source, str):
+            raise IllegalParameterError('Expected a string as source.')
+        filters['source'] = source
+
+    before = params.get('before')
+    if before is not None:
+        if not isinstance(before, int) or isinstance(before, bool) or before < 0:
+            raise IllegalParameterError('Expected a timestamp in epoch milliseconds as before.')
+        filters['before'] = before
+
+    return filters
+
+
 def _get_mark_notification_params(params):
     if not isinstance(params, dict):
         raise IllegalParameterError('Expected a JSON object as an input.')
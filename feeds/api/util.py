@@ -1,10 +1,33 @@
+import hashlib
+import json
+from typing import (
+    List,
+    Tuple
+)
 from feeds.exceptions import (
     IllegalParameterError,
     MissingParameterError
 )
 from feeds.entity.entity import Entity
+from feeds.activity.notification import Notification
 from feeds.feeds.notification.notification_feed import NotificationFeed
+from feeds.storage.factory import (
+    get_global_seen_storage,
+    get_feed_version_storage
+)
+from feeds.external_api.groups import get_user_groups
 from feeds.config import get_config
+from feeds.util import epoch_ms
+from cachetools import TTLCache
+
+GLOBAL_CACHE_TIME = 300  # seconds
+USER_GROUPS_CACHE_TIME = 60  # seconds
+ETAG_WINDOW = 300  # seconds
+STREAM_KEEPALIVE = 30  # seconds
+STREAM_RECOUNT_WAIT = 1  # seconds
+MAX_BULK_NOTIFICATIONS = 1000
+_global_feed_cache = TTLCache(100, GLOBAL_CACHE_TIME)
+_user_groups_cache = TTLCache(1000, USER_GROUPS_CACHE_TIME)
 
 
 def parse_notification_params(params: dict, is_global: bool=False) -> dict:
@@ -61,6 +84,47 @@ def parse_notification_params(params: dict, is_global: bool=False) -> dict:
     return params
 
 
+def make_notification(params: dict) -> Notification:
+    """
+    Makes a new Notification from the output of parse_notification_params.
+    """
+    return Notification(
+        params.get('actor'),
+        params.get('verb'),
+        params.get('object'),
+        params.get('source'),
+        level=params.get('level'),
+        target=params.get('target', []),
+        context=params.get('context'),
+        expires=params.get('expires'),
+        external_key=params.get('external_key'),
+        users=params.get('users', [])
+    )
+
+
+def parse_bulk_notification_params(params: dict) -> list:
+    """
+    Checks the body of a bulk notification post, which looks like:
+    {
+        "notifications": [notification params]
+    }
+    with up to MAX_BULK_NOTIFICATIONS of them. Returns the list of notification params, which
+    still each need to go through parse_notification_params.
+    """
+    if not isinstance(params, dict):
+        raise IllegalParameterError('Expected a JSON object as an input.')
+    if params.get('notifications') is None:
+        raise MissingParameterError('Missing parameter "notifications"')
+    notes = params['notifications']
+    if not isinstance(notes, list):
+        raise IllegalParameterError('Expected notifications to be a list.')
+    if len(notes) > MAX_BULK_NOTIFICATIONS:
+        raise IllegalParameterError(
+            'Can only add up to {} notifications at a time.'.format(MAX_BULK_NOTIFICATIONS)
+        )
+    return notes
+
+
 def parse_expire_notifications_params(params: dict, is_admin: bool=False) -> dict:
     """
     Here's the parsing rules.
@@ -107,16 +171,110 @@ def parse_expire_notifications_params(params: dict, is_admin: bool=False) -> dic
     return params
 
 
-def fetch_global_notifications(count=0) -> dict:
+def fetch_global_notifications(count=0, user: Entity=None, reverse: bool=False,
+                               before: Tuple[int, str]=None,
+                               after: Tuple[int, str]=None) -> dict:
     """
     Always returns notifications in user view.
+    If user is given, the seen flags and unseen count are set for that user (see
+    get_global_seen_storage), otherwise they're as stored on the global feed.
+    reverse, before, and after page through the feed the same way as they do for a user's
+    feed (see NotificationFeed.get_notifications).
+
+    The global feed only changes when a global notification gets added or expired, so the
+    rendered first page is cached in this process for each count. A cached feed is used as
+    long as the global feed version (bumped by storage on each write) hasn't changed, none of
+    its notifications have expired, and it's less than GLOBAL_CACHE_TIME seconds old.
+    Without a user, the returned dict may be shared with other requests, so it shouldn't be
+    modified.
     """
     cfg = get_config()
     if count == 0:
         count = cfg.default_max_notes
     global_feed = get_global_feed()
-    global_notes = global_feed.get_notifications(count=count, user_view=True)
-    return global_notes
+    if reverse or before is not None or after is not None:
+        global_notes = global_feed.get_notifications(
+            count=count, user_view=True, reverse=reverse, before=before, after=after
+        )
+        if user is None:
+            return global_notes
+        return _apply_global_seen(global_notes, user)
+    version = get_feed_version_storage().get_versions([global_feed.user])[0]
+    cached = _global_feed_cache.get(count)
+    if cached is not None and cached["version"] == version and cached["expires"] > epoch_ms():
+        global_notes = cached["notes"]
+    else:
+        global_notes = global_feed.get_notifications(count=count, user_view=True)
+        expires = [n["expires"] for n in global_notes["feed"]]
+        _global_feed_cache[count] = {
+            "version": version,
+            "expires": min(expires) if expires else float("inf"),
+            "notes": global_notes
+        }
+    if user is None:
+        return global_notes
+    return _apply_global_seen(global_notes, user)
+
+
+def _apply_global_seen(global_notes: dict, user: Entity) -> dict:
+    """
+    Returns a copy of the global notes in user view with the seen flags and unseen count set
+    for the given user. The given dict isn't modified.
+    """
+    seen_storage = get_global_seen_storage()
+    seen = seen_storage.get_seen(user, [(n["id"], n["created"]) for n in global_notes["feed"]])
+    user_notes = dict(global_notes)
+    user_notes["feed"] = [dict(n, seen=seen[n["id"]]) for n in global_notes["feed"]]
+    user_notes["unseen"] = seen_storage.get_unseen_count(user)
+    return user_notes
+
+
+def get_feed_etag(users: List[Entity], *keys) -> str:
+    """
+    Builds an ETag for a response made out of the feeds of the given users.
+    It changes whenever any of their feed versions change, along with anything else passed in
+    keys (e.g. the query params), and at least every ETAG_WINDOW seconds, so notifications that
+    quietly reach the end of their lifespan drop out of the response eventually.
+    Costs a single lookup of the feed versions.
+    """
+    versions = get_feed_version_storage().get_versions(users)
+    window = epoch_ms() // (ETAG_WINDOW * 1000)
+    key = json.dumps([[str(u) for u in users], versions, window, list(keys)])
+    return hashlib.sha1(key.encode("utf-8")).hexdigest()
+
+
+def format_stream_event(event: str, data: dict) -> str:
+    """
+    Formats a Server-Sent Event with the given name and JSON data.
+    """
+    return "event: {}\ndata: {}\n\n".format(event, json.dumps(data))
+
+
+def stream_note_view(doc: dict) -> dict:
+    """
+    The user view of a new notification, for streaming to everyone who got it (see
+    ChangeEvent.shared). It's the same for all of them, so entity names are looked up with the
+    service's own token, and the recipients are left off.
+    """
+    token = get_config().auth_token
+    note = Notification.from_dict(dict(doc, users=[]), token=token)
+    Notification.update_entity_names([note], token=token)
+    note.seen = False
+    return note.user_view()
+
+
+def get_cached_user_groups(user_token: str) -> list:
+    """
+    Returns the groups the user is in (see get_user_groups), cached by token for
+    USER_GROUPS_CACHE_TIME seconds. The groups go into the feed ETag, so this keeps clients
+    polling a feed that hasn't changed from calling the Groups service every time. Joining or
+    leaving a group shows up in the feed within that long.
+    """
+    groups = _user_groups_cache.get(user_token)
+    if groups is None:
+        groups = get_user_groups(user_token)
+        _user_groups_cache[user_token] = groups
+    return groups
 
 
 def get_global_feed() -> NotificationFeed:
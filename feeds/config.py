@@ -9,6 +9,19 @@ ENV_AUTH_TOKEN = "AUTH_TOKEN"
 
 INI_SECTION = "feeds"
 
+DEFAULT_ARCHIVE_GRACE = 30  # days
+DEFAULT_MAINTENANCE_INTERVAL = 30  # seconds
+DB_ENGINES = ["mongodb", "mongodb-inbox", "redis"]
+ENTITY_ENCODINGS = ["document", "compact"]
+CONSUMER_BROKERS = ["kafka", "file"]
+WRITE_BEHIND_MODES = ["off", "async", "durable"]
+DEFAULT_WRITE_BATCH_SIZE = 100
+DEFAULT_WRITE_BATCH_WAIT = 10  # ms
+DEFAULT_WRITE_QUEUE_SIZE = 10000
+DEFAULT_CONSUMER_TOPIC = "feeds"
+DEFAULT_CONSUMER_GROUP = "feeds"
+DEFAULT_CONSUMER_BATCH_SIZE = 500
+
 KEY_DB_HOST = "db-host"
 KEY_DB_PORT = "db-port"
 KEY_DB_USER = "db-user"
@@ -16,9 +29,21 @@ KEY_DB_PW = "db-pw"
 KEY_DB_NAME = "db-name"
 KEY_DB_ENGINE = "db-engine"
 KEY_DB_RETRYWRITES = "db-retrywrites"
+KEY_ENTITY_ENCODING = "entity-encoding"
+KEY_IDEMPOTENT_WRITES = "idempotent-writes"
+KEY_WRITE_BEHIND = "write-behind"
+KEY_WRITE_BATCH_SIZE = "write-batch-size"
+KEY_WRITE_BATCH_WAIT = "write-batch-wait"
+KEY_WRITE_QUEUE_SIZE = "write-queue-size"
+KEY_CACHE_HOST = "cache-host"
+KEY_CACHE_PORT = "cache-port"
+KEY_CACHE_PW = "cache-pw"
 KEY_GLOBAL_FEED = "global-feed"
 KEY_DEBUG = "debug"
 KEY_LIFESPAN = "lifespan"
+KEY_ARCHIVE_GRACE = "archive-grace"
+KEY_ARCHIVE_INTERVAL = "archive-interval"
+KEY_MAINTENANCE_INTERVAL = "maintenance-interval"
 KEY_AUTH_URL = "auth-url"
 KEY_NJS_URL = "njs-url"
 KEY_GROUPS_URL = "groups-url"
@@ -30,6 +55,12 @@ KEY_SERVICE_WORKSPACE = "service-workspace"
 KEY_SERVICE_NARRATIVE = "service-narrative"
 KEY_SERVICE_JOBS = "service-jobs"
 KEY_SERVICE_KBASE = "service-kbase"
+KEY_CONSUMER_BROKER = "consumer-broker"
+KEY_CONSUMER_SERVERS = "consumer-servers"
+KEY_CONSUMER_TOPIC = "consumer-topic"
+KEY_CONSUMER_GROUP = "consumer-group"
+KEY_CONSUMER_FILE = "consumer-file"
+KEY_CONSUMER_BATCH_SIZE = "consumer-batch-size"
 
 
 class FeedsConfig(object):
@@ -50,7 +81,12 @@ class FeedsConfig(object):
             raise ConfigError(
                 "Error parsing config file: section {} not found!".format(INI_SECTION)
             )
+        # see feeds/storage/factory.py
         self.db_engine = self._get_line(cfg, KEY_DB_ENGINE)
+        if self.db_engine not in DB_ENGINES:
+            raise ConfigError("{} must be one of {}! Got {}".format(
+                KEY_DB_ENGINE, ", ".join(DB_ENGINES), self.db_engine
+            ))
         self.db_host = self._get_line(cfg, KEY_DB_HOST)
         try:
             self.db_port = self._get_line(cfg, KEY_DB_PORT)
@@ -62,6 +98,58 @@ class FeedsConfig(object):
         self.db_pw = self._get_line(cfg, KEY_DB_PW, required=False)
         self.db_name = self._get_line(cfg, KEY_DB_NAME, required=False)
         self.db_retrywrites = self._get_line(cfg, KEY_DB_RETRYWRITES, required=False) == "true"
+        # Whether new notes with an external key are only stored once per source - see
+        # MongoActivityStorage.add_to_storage
+        self.idempotent_writes = \
+            self._get_line(cfg, KEY_IDEMPOTENT_WRITES, required=False) == "true"
+        # Buffering new notes into batched writes - see feeds/storage/write_behind.py
+        self.write_behind = self._get_line(cfg, KEY_WRITE_BEHIND, required=False)
+        if not self.write_behind:
+            self.write_behind = WRITE_BEHIND_MODES[0]
+        if self.write_behind not in WRITE_BEHIND_MODES:
+            raise ConfigError("{} must be one of {}! Got {}".format(
+                KEY_WRITE_BEHIND, ", ".join(WRITE_BEHIND_MODES), self.write_behind
+            ))
+        self.write_batch_size = self._get_optional_int(
+            cfg, KEY_WRITE_BATCH_SIZE, DEFAULT_WRITE_BATCH_SIZE
+        )
+        self.write_batch_wait = self._get_optional_int(
+            cfg, KEY_WRITE_BATCH_WAIT, DEFAULT_WRITE_BATCH_WAIT
+        )
+        self.write_queue_size = self._get_optional_int(
+            cfg, KEY_WRITE_QUEUE_SIZE, DEFAULT_WRITE_QUEUE_SIZE
+        )
+        for key, val in [(KEY_WRITE_BATCH_SIZE, self.write_batch_size),
+                         (KEY_WRITE_QUEUE_SIZE, self.write_queue_size)]:
+            if val == 0:
+                raise ConfigError("{} must be an int > 0! Got 0".format(key))
+        # async writes can't tell the client which stored note a retry matched up with
+        if self.write_behind == "async" and self.idempotent_writes:
+            raise ConfigError("{}=async can't be used with {}! Use durable instead".format(
+                KEY_WRITE_BEHIND, KEY_IDEMPOTENT_WRITES
+            ))
+        # How the MongoDB engines store Entities - see feeds/storage/mongodb/util.py
+        self.entity_encoding = self._get_line(cfg, KEY_ENTITY_ENCODING, required=False)
+        if not self.entity_encoding:
+            self.entity_encoding = ENTITY_ENCODINGS[0]
+        if self.entity_encoding not in ENTITY_ENCODINGS:
+            raise ConfigError("{} must be one of {}! Got {}".format(
+                KEY_ENTITY_ENCODING, ", ".join(ENTITY_ENCODINGS), self.entity_encoding
+            ))
+        # An optional Redis server for caching timelines in front of MongoDB.
+        self.cache_host = self._get_line(cfg, KEY_CACHE_HOST, required=False)
+        self.cache_port = None
+        self.cache_pw = None
+        if self.cache_host:
+            try:
+                self.cache_port = self._get_line(cfg, KEY_CACHE_PORT)
+                self.cache_port = int(self.cache_port)
+                assert self.cache_port > 0
+            except (ValueError, AssertionError):
+                raise ConfigError(
+                    "{} must be an int > 0! Got {}".format(KEY_CACHE_PORT, self.cache_port)
+                )
+            self.cache_pw = self._get_line(cfg, KEY_CACHE_PW, required=False)
         self.global_feed = self._get_line(cfg, KEY_GLOBAL_FEED)
         self.global_feed_type = "user"  # doesn't matter, need a valid Entity type...
         try:
@@ -70,6 +158,11 @@ class FeedsConfig(object):
             assert self.lifespan > 0
         except (ValueError, AssertionError):
             raise ConfigError("{} must be an int > 0! Got {}".format(KEY_LIFESPAN, self.lifespan))
+        self.archive_grace = self._get_optional_int(cfg, KEY_ARCHIVE_GRACE, DEFAULT_ARCHIVE_GRACE)
+        self.archive_interval = self._get_optional_int(cfg, KEY_ARCHIVE_INTERVAL, 0)
+        self.maintenance_interval = self._get_optional_int(
+            cfg, KEY_MAINTENANCE_INTERVAL, DEFAULT_MAINTENANCE_INTERVAL
+        )
         self.debug = self._get_line(cfg, KEY_DEBUG, required=False)
         if not self.debug or self.debug.lower() != "true":
             self.debug = False
@@ -100,6 +193,26 @@ class FeedsConfig(object):
                 "{} must be an int > 0! Got {}".format(KEY_DEFAULT_COUNT, self.default_max_notes)
             )
 
+        # The ingestion consumer - see feeds/ingest
+        self.consumer_broker = self._get_line(cfg, KEY_CONSUMER_BROKER, required=False)
+        if not self.consumer_broker:
+            self.consumer_broker = CONSUMER_BROKERS[0]
+        if self.consumer_broker not in CONSUMER_BROKERS:
+            raise ConfigError("{} must be one of {}! Got {}".format(
+                KEY_CONSUMER_BROKER, ", ".join(CONSUMER_BROKERS), self.consumer_broker
+            ))
+        self.consumer_servers = self._get_line(cfg, KEY_CONSUMER_SERVERS, required=False)
+        self.consumer_topic = self._get_line(cfg, KEY_CONSUMER_TOPIC, required=False) or \
+            DEFAULT_CONSUMER_TOPIC
+        self.consumer_group = self._get_line(cfg, KEY_CONSUMER_GROUP, required=False) or \
+            DEFAULT_CONSUMER_GROUP
+        self.consumer_file = self._get_line(cfg, KEY_CONSUMER_FILE, required=False)
+        self.consumer_batch_size = self._get_optional_int(
+            cfg, KEY_CONSUMER_BATCH_SIZE, DEFAULT_CONSUMER_BATCH_SIZE
+        )
+        if self.consumer_batch_size == 0:
+            raise ConfigError("{} must be an int > 0! Got 0".format(KEY_CONSUMER_BATCH_SIZE))
+
     def _find_config_path(self):
         """
         A little helper to test whether a given file path, or one given by an
@@ -132,6 +245,21 @@ class FeedsConfig(object):
                 raise ConfigError("Error parsing config file {}: {}".format(cfg_file, e))
         return config
 
+    def _get_optional_int(self, config, key, default):
+        """
+        Returns the value of an optional key that has to be an int >= 0, or default if it's
+        not there.
+        """
+        val = self._get_line(config, key, required=False)
+        if not val:
+            return default
+        try:
+            val = int(val)
+            assert val >= 0
+        except (ValueError, AssertionError):
+            raise ConfigError("{} must be an int >= 0! Got {}".format(key, val))
+        return val
+
     def _get_line(self, config, key, required=True):
         """
         A little wrapper that raises a ConfigError if a required key isn't present.
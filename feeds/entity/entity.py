@@ -27,7 +27,8 @@ from .types import (
 from typing import (
     List,
     Dict,
-    TypeVar
+    TypeVar,
+    Union
 )
 from feeds.logger import log_error
 
@@ -159,6 +160,16 @@ class Entity(object):
             raise EntityValidationError("'{}' could not be resolved into an Entity".format(s))
         return cls(i, t, token=token)
 
+    @classmethod
+    def from_stored(cls, stored: Union[str, Dict[str, str]], token: str=None) -> E:
+        """
+        Builds an Entity from either of the forms it gets stored in - its to_dict() form, or
+        its compact, __str__() form.
+        """
+        if isinstance(stored, str):
+            return cls.from_str(stored, token=token)
+        return cls.from_dict(stored, token=token)
+
     @staticmethod
     def fetch_entity_names(entities: List[E], token: str) -> None:
         """
@@ -2,10 +2,12 @@ from ..config import get_config
 import requests
 from typing import (
     List,
-    Dict
+    Dict,
+    Optional
 )
 from feeds.exceptions import GroupsError
 from requests import HTTPError
+from requests.exceptions import RequestException
 
 config = get_config()
 GROUPS_URL = config.groups_url
@@ -55,6 +57,34 @@ def validate_group_id(group_id: str) -> bool:
         )
 
 
+def get_group_members(group_ids: List[str], token: str=None) -> Dict[str, Optional[List[str]]]:
+    """
+    Returns a mapping from each group id to the user names of everyone in the group - its
+    owner, admins, and members. Groups that don't exist map to None.
+    The Groups service can only look up one group at a time, so this makes a request for each
+    group, over a single connection.
+    Raises a GroupsError if a group can't be looked up.
+    """
+    if token is None:
+        token = config.auth_token
+    headers = {"Authorization": token}
+    members = dict()
+    with requests.Session() as session:
+        for g_id in group_ids:
+            try:
+                r = session.get("{}/group/{}".format(GROUPS_URL, g_id), headers=headers)
+                if r.status_code == 404:
+                    members[g_id] = None
+                    continue
+                r.raise_for_status()
+            except RequestException as e:
+                raise GroupsError("Unable to fetch group information: {}".format(str(e)))
+            group = r.json()
+            names = [group.get("owner")] + group.get("admins", []) + group.get("members", [])
+            members[g_id] = [n for n in dict.fromkeys(names) if n]
+    return members
+
+
 def __groups_request(path: str, token: str=None) -> Response:
     headers = {"Authorization": token}
     try:
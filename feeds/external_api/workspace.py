@@ -2,6 +2,8 @@ from ..config import get_config
 from ..exceptions import WorkspaceError
 from ..biokbase.workspace.client import Workspace
 from ..biokbase.workspace.baseclient import ServerError
+from cachetools import TTLCache
+from requests.exceptions import RequestException
 from typing import (
     List,
     Dict,
@@ -9,6 +11,10 @@ from typing import (
 )
 
 config = get_config()
+ACL_CACHE_TIME = 300  # seconds
+MAX_PERMISSIONS_MASS = 1000  # the most workspaces get_permissions_mass takes at once
+
+__acl_cache = TTLCache(10000, ACL_CACHE_TIME)
 
 
 def validate_narrative_id(ws_id: Union[int, str], token: str) -> bool:
@@ -122,6 +128,71 @@ def get_narrative_names(ws_ids: List[Union[int, str]], token: str) -> Dict[str,
     return names
 
 
+def get_workspace_acls(ws_ids: List[Union[int, str]],
+                       token: str=None) -> Dict[str, Dict[str, str]]:
+    """
+    Returns a dict mapping from each workspace id (as a string) to its permissions, a dict
+    from user name to permission ('a', 'w', or 'r'). Users without any permissions, and the
+    public "*" user, are left out. Workspaces that don't exist or are deleted have none.
+    Permissions are cached by workspace id for ACL_CACHE_TIME seconds. Any that aren't cached
+    are fetched with the getPermissionsMass admin command, MAX_PERMISSIONS_MASS workspaces at
+    a time. The Workspace only shows everyone's permissions to admins, so the token (the
+    service's own, by default) needs to be a Workspace admin.
+    Raises a WorkspaceError if the Workspace can't be reached, or fails for any other reason
+    than a missing workspace. Nothing from that batch gets cached.
+    """
+    acls = dict()
+    missing = list()
+    for ws_id in ws_ids:
+        key = str(ws_id)
+        if key in __acl_cache:
+            acls[key] = __acl_cache[key]
+        elif key not in acls:
+            acls[key] = None
+            missing.append(key)
+    if not missing:
+        return acls
+    ws = __ws_client(token)
+    for i in range(0, len(missing), MAX_PERMISSIONS_MASS):
+        batch = missing[i:i + MAX_PERMISSIONS_MASS]
+        for key, perms in zip(batch, __get_permissions(ws, batch)):
+            acl = {user: perm for user, perm in perms.items() if user != "*" and perm != "n"}
+            __acl_cache[key] = acl
+            acls[key] = acl
+    return acls
+
+
+def __get_permissions(ws: Workspace, ws_ids: List[str]) -> List[Dict[str, str]]:
+    """
+    A single missing or deleted workspace makes getPermissionsMass fail for all of them, so
+    if that happens, the batch gets split in half, and each half tried again, until the
+    missing ones are found. Those get no permissions.
+    """
+    try:
+        return __get_permissions_mass(ws, ws_ids)
+    except ServerError as e:
+        if not __is_missing(e):
+            raise WorkspaceError("Unable to fetch workspace permissions: {}".format(e.message))
+        if len(ws_ids) == 1:
+            return [{}]
+    half = len(ws_ids) // 2
+    return __get_permissions(ws, ws_ids[:half]) + __get_permissions(ws, ws_ids[half:])
+
+
+def __is_missing(e: ServerError) -> bool:
+    return "No workspace with id" in e.message or "is deleted" in e.message
+
+
+def __get_permissions_mass(ws: Workspace, ws_ids: List[str]) -> List[Dict[str, str]]:
+    try:
+        return ws.administer({
+            "command": "getPermissionsMass",
+            "params": {"workspaces": [{"id": int(ws_id)} for ws_id in ws_ids]}
+        })["perms"]
+    except RequestException as e:
+        raise WorkspaceError("Unable to fetch workspace permissions: {}".format(str(e)))
+
+
 def __ws_client(token: str) -> Workspace:
     if token is None:
         token = config.auth_token
@@ -1,14 +1,18 @@
 from ..base import BaseFeed
 from feeds.activity.notification import Notification
-from feeds.storage.mongodb.activity_storage import MongoActivityStorage
-from feeds.storage.mongodb.timeline_storage import MongoTimelineStorage
+from feeds.storage.factory import (
+    get_activity_storage,
+    get_timeline_storage
+)
 from cachetools import TTLCache
 import logging
 from feeds.exceptions import NotificationNotFoundError
 from feeds.entity.entity import Entity
+from feeds.util import encode_cursor
 from typing import (
     List,
-    Dict
+    Dict,
+    Tuple
 )
 
 
@@ -16,8 +20,8 @@ class NotificationFeed(BaseFeed):
     def __init__(self, user_id: str, user_type: str, token: str=None):
         self.user = Entity(user_id, user_type, token=token)
         self.token = token
-        self.timeline_storage = MongoTimelineStorage(user_id, user_type)
-        self.activity_storage = MongoActivityStorage()
+        self.timeline_storage = get_timeline_storage(user_id, user_type)
+        self.activity_storage = get_activity_storage()
         self.timeline = None
         self.cache = TTLCache(1000, 600)
 
@@ -38,35 +42,64 @@ class NotificationFeed(BaseFeed):
                                 include_seen: bool=False, level=None,
                                 verb=None, reverse: bool=False) -> dict:
         """
-        Returns all notifications (using the get_notifications fn.) for a user, filtered down to
-        those that reference an Entity of type group with the given id.
+        Returns the notifications in the user's feed that reference an Entity of type group
+        with the given id, as its actor, object, or one of its targets. These come in user
+        view, along with the number of them that are unseen. The filtering is done in storage,
+        so this returns up to count notifications even if the group's notes are far down the
+        user's feed.
         """
-        notes = self.get_notifications(count=count, include_seen=include_seen, level=level,
-                                       verb=verb, reverse=reverse)
-        # group has id and name keys
-        group_notes = {
-            "unseen": 0,
+        if count < 1 or not isinstance(count, int):
+            raise ValueError("Count must be an integer > 0")
+        (serial_notes, unseen) = self.timeline_storage.get_timeline_and_unseen_count(
+            count=count, include_seen=include_seen, level=level,
+            verb=verb, reverse=reverse, entity=Entity(group["id"], "group")
+        )
+        notes_list = self._to_notifications(serial_notes)
+        Notification.update_entity_names(notes_list, token=self.token)
+        return {
+            "unseen": unseen,
             "name": group.get("name"),
-            "feed": list()
+            "cursor": self._page_cursor(notes_list),
+            "feed": [n.user_view() for n in notes_list]
         }
-        gid = group["id"]
 
-        def is_group(e: Entity) -> bool:
-            return e.id == gid and e.type == "group"
+    def get_groups_notifications(self, groups: List[Dict[str, str]], count: int=10,
+                                 include_seen: bool=False, level=None, verb=None,
+                                 reverse: bool=False) -> Dict[str, dict]:
+        """
+        Returns the notifications in the user's feed that reference each of the given groups,
+        as a dict mapping from group id to a feed structure (with the user view of each
+        Notification). Each group is a dict with id and name keys.
 
-        notes_list = list()
-        for n in notes["feed"]:
-            if is_group(n.actor) or is_group(n.object) or any([is_group(t) for t in n.target]):
-                notes_list.append(n)
-                if not n.seen:
-                    group_notes["unseen"] += 1
-        Notification.update_entity_names(notes_list, token=self.token)
-        for n in notes_list:
-            group_notes["feed"].append(n.user_view())
+        This fetches every group's feed from storage at once, and then looks up the names of
+        all referenced Entities together, no matter how many groups there are.
+        """
+        if count < 1 or not isinstance(count, int):
+            raise ValueError("Count must be an integer > 0")
+        timelines = self.timeline_storage.get_group_timelines(
+            [g["id"] for g in groups], count=count, include_seen=include_seen,
+            level=level, verb=verb, reverse=reverse
+        )
+        group_notes = dict()
+        all_notes = list()
+        for g in groups:
+            (serial_notes, unseen) = timelines[g["id"]]
+            notes_list = self._to_notifications(serial_notes)
+            all_notes = all_notes + notes_list
+            group_notes[g["id"]] = {
+                "unseen": unseen,
+                "name": g.get("name"),
+                "cursor": self._page_cursor(notes_list),
+                "feed": notes_list
+            }
+        Notification.update_entity_names(all_notes, token=self.token)
+        for g_id in group_notes:
+            group_notes[g_id]["feed"] = [n.user_view() for n in group_notes[g_id]["feed"]]
         return group_notes
 
     def get_notifications(self, count: int=10, include_seen: bool=False, level=None, verb=None,
-                          reverse: bool=False, user_view: bool=False) -> dict:
+                          reverse: bool=False, user_view: bool=False,
+                          before: Tuple[int, str]=None, after: Tuple[int, str]=None) -> dict:
         """
         Fetches all activities matching the requested inputs.
         :param count: max number of most recent notifications to return. default=10
@@ -79,18 +112,28 @@ class NotificationFeed(BaseFeed):
         :param reverse: if True, will reverse the order of the result (default False)
         :param user_view: if True, will return the user_view dict version of each Notification
             object. If False, will return a list of Notification objects instead. default False
-        :return: a dict with the requested notifications, and a key with the total number in the
-            feed that are marked unseen
+        :param before: if not None, a (created, id) tuple (see feeds.util.decode_cursor). Only
+            notifications older than that position are returned. default = None
+        :param after: if not None, a (created, id) tuple. Only notifications newer than that
+            position are returned. default = None
+        :return: a dict with the requested notifications, a key with the total number in the
+            feed that are marked unseen, and a cursor pointing at the last notification in the
+            returned page (or None if the page is empty)
         :rtype: dict
         :raises ValueError: if count <= 0
         """
-        activities = self.get_activities(
-            count=count, include_seen=include_seen, verb=verb,
-            level=level, reverse=reverse, user_view=user_view
+        if count < 1 or not isinstance(count, int):
+            raise ValueError("Count must be an integer > 0")
+        (serial_notes, unseen) = self.timeline_storage.get_timeline_and_unseen_count(
+            count=count, include_seen=include_seen,
+            level=level, verb=verb, reverse=reverse,
+            before=before, after=after
         )
+        activities = self._to_notifications(serial_notes)
         ret_struct = {
-            "unseen": self.get_unseen_count(),
-            "name": self.user.name
+            "unseen": unseen,
+            "name": self.user.name,
+            "cursor": self._page_cursor(activities)
         }
         if user_view:
             ret_struct["feed"] = list()
@@ -113,11 +156,21 @@ class NotificationFeed(BaseFeed):
         else:
             return Notification.from_dict(note, self.token)
 
+    def find_notification_ids(self, note_ids: List[str]) -> List[str]:
+        """
+        Returns the ones of the given notification ids that are in this feed, without fetching
+        the notifications themselves.
+        """
+        return self.timeline_storage.get_ids_in_timeline(note_ids)
+
     def get_activities(self, count=10, include_seen=False, level=None, verb=None,
-                       reverse=False, user_view=False) -> List[Notification]:
+                       reverse=False, user_view=False, before=None,
+                       after=None) -> List[Notification]:
         """
         Returns a selection of activities.
         :param count: Maximum number of Notifications to return (default 10)
+        :param before: (created, id) tuple, only return activities older than this (default None)
+        :param after: (created, id) tuple, only return activities newer than this (default None)
         """
         # steps.
         # 0. If in cache, return them.  <-- later
@@ -129,17 +182,27 @@ class NotificationFeed(BaseFeed):
             raise ValueError("Count must be an integer > 0")
         serial_notes = self.timeline_storage.get_timeline(
             count=count, include_seen=include_seen,
-            level=level, verb=verb, reverse=reverse
+            level=level, verb=verb, reverse=reverse,
+            before=before, after=after
         )
-        note_list = list()
-        user_dict = self.user.to_dict()
-        for note in serial_notes:
-            if user_dict in note["unseen"]:
-                note["seen"] = False
-            else:
-                note["seen"] = True
-            note_list.append(Notification.from_dict(note, self.token))
-        return note_list
+        return self._to_notifications(serial_notes)
+
+    def _to_notifications(self, serial_notes: List[dict]) -> List[Notification]:
+        """
+        Converts stored notes into Notification objects. Timeline storage has already set
+        whether each has been seen by the owner of this feed.
+        """
+        return [Notification.from_dict(note, self.token) for note in serial_notes]
+
+    def _page_cursor(self, notes: List[Notification]) -> str:
+        """
+        Returns the cursor for the last Notification in a page of them, or None if the page
+        is empty. Passing this back as the "before" cursor fetches the next page of a newest-first
+        feed, and as the "after" cursor for the next page of a reversed feed.
+        """
+        if not notes:
+            return None
+        return encode_cursor(notes[-1].created, notes[-1].id)
 
     def mark_activities(self, activity_ids: List[str], seen=False) -> None:
         """
@@ -152,6 +215,16 @@ class NotificationFeed(BaseFeed):
         else:
             self.activity_storage.set_unseen(activity_ids, self.user)
 
+    def mark_all_seen(self, level=None, verb=None, source=None, before: int=None) -> int:
+        """
+        Marks every unseen notification in this feed that has the given level, verb, and
+        source, and was created before the given time (in epoch ms), as seen. Filters that are
+        None are left out. This is done in storage, without fetching the notifications.
+        Returns the number of notifications that got marked.
+        """
+        return self.activity_storage.set_all_seen(self.user, level=level, verb=verb,
+                                                  source=source, before=before)
+
     def add_notification(self, note) -> None:
         return self.add_activity(note)
 
@@ -166,3 +239,10 @@ class NotificationFeed(BaseFeed):
         Returns the number of unread / unexpired notifications in this feed.
         """
         return self.timeline_storage.get_unseen_count()
+
+    def get_unseen_counts(self, others: List[Entity]) -> List[int]:
+        """
+        Returns the number of unread / unexpired notifications in this feed, followed by
+        the same for the feeds of each of the others, using a single storage lookup.
+        """
+        return self.timeline_storage.get_unseen_counts(others)
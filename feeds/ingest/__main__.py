@@ -0,0 +1,26 @@
+"""
+Runs the ingestion consumer, with the broker set in the config:
+    python -m feeds.ingest [--until-idle]
+With --until-idle, it stops once there's nothing left to read, which is handy for loading (or
+timing the load of) a file with the file broker.
+"""
+
+import argparse
+import logging
+from .brokers import get_broker
+from .consumer import consume
+from feeds.logger import log
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Consumes notification operations.")
+    parser.add_argument("--until-idle", action="store_true",
+                        help="stop once there are no more messages to read")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    count = consume(get_broker(), until_idle=args.until_idle)
+    log(__name__, "Consumed %s messages", count)
+
+
+if __name__ == "__main__":
+    main()
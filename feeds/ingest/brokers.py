@@ -0,0 +1,190 @@
+"""
+Brokers hand messages to the NotificationConsumer, and keep track of how far it's got.
+
+A Broker is read in batches with poll, and commit marks everything up to the end of a batch as
+done. rewind goes back to the last commit, so anything polled after it gets delivered again -
+the consumer does that when it fails to store a batch.
+
+* KafkaBroker - reads a Kafka topic as part of a consumer group. Needs the kafka-python
+  package.
+* FileBroker - reads a file with a JSON message on each line, and keeps its committed
+  position in a file next to it. For running locally, and for benchmarking without Kafka.
+* MemoryBroker - reads a list of messages. For tests.
+"""
+
+import os
+import time
+from typing import (
+    List,
+    Optional
+)
+from feeds.config import get_config
+from feeds.exceptions import ConfigError
+
+POLL_TIMEOUT = 1.0  # seconds
+
+
+class Message(object):
+    def __init__(self, value: str, position=None):
+        """
+        :param value: the message body, a JSON string
+        :param position: where the message came from, which only means something to the
+            Broker that delivered it
+        """
+        self.value = value
+        self.position = position
+
+
+class Broker(object):
+    def poll(self, max_messages: int, timeout: float=POLL_TIMEOUT) -> List[Message]:
+        """
+        Returns up to max_messages of the next messages, in order. Waits up to timeout
+        seconds for some to come in, and returns an empty list if none do.
+        """
+        raise NotImplementedError()
+
+    def commit(self, messages: List[Message]) -> None:
+        """
+        Marks everything up to and including the given messages as done, so they won't be
+        delivered again.
+        """
+        raise NotImplementedError()
+
+    def rewind(self) -> None:
+        """
+        Goes back to the last commit.
+        """
+        raise NotImplementedError()
+
+    def close(self) -> None:
+        pass
+
+
+class MemoryBroker(Broker):
+    def __init__(self, values: Optional[List[str]]=None):
+        self.values = list(values or [])
+        self.position = 0
+        self.committed = 0
+
+    def send(self, value: str) -> None:
+        self.values.append(value)
+
+    def poll(self, max_messages: int, timeout: float=POLL_TIMEOUT) -> List[Message]:
+        end = min(self.position + max_messages, len(self.values))
+        messages = [Message(self.values[i], i) for i in range(self.position, end)]
+        self.position = end
+        return messages
+
+    def commit(self, messages: List[Message]) -> None:
+        if messages:
+            self.committed = max(self.committed, messages[-1].position + 1)
+
+    def rewind(self) -> None:
+        self.position = self.committed
+
+
+class FileBroker(Broker):
+    """
+    Only whole lines are read, so the file can be appended to while this is reading it. The
+    committed position is the byte offset of the next line, in <path>.offset.
+    """
+    def __init__(self, path: str):
+        self.path = path
+        self.offset_path = path + ".offset"
+        self.committed = 0
+        if os.path.isfile(self.offset_path):
+            with open(self.offset_path, "r") as f:
+                self.committed = int(f.read().strip() or 0)
+        self.position = self.committed
+
+    def poll(self, max_messages: int, timeout: float=POLL_TIMEOUT) -> List[Message]:
+        messages = self._read(max_messages)
+        if not messages and timeout:
+            time.sleep(timeout)
+            messages = self._read(max_messages)
+        return messages
+
+    def _read(self, max_messages: int) -> List[Message]:
+        messages = list()
+        with open(self.path, "rb") as f:
+            f.seek(self.position)
+            while len(messages) < max_messages:
+                line = f.readline()
+                if not line.endswith(b"\n"):
+                    break
+                self.position += len(line)
+                line = line.strip()
+                if line:
+                    messages.append(Message(line.decode("utf-8"), self.position))
+        return messages
+
+    def commit(self, messages: List[Message]) -> None:
+        if not messages:
+            return
+        self.committed = messages[-1].position
+        temp_path = self.offset_path + ".tmp"
+        with open(temp_path, "w") as f:
+            f.write(str(self.committed))
+        os.replace(temp_path, self.offset_path)
+
+    def rewind(self) -> None:
+        self.position = self.committed
+
+
+class KafkaBroker(Broker):
+    """
+    Offsets are only committed by commit, never automatically. A consumer that starts up with
+    nothing committed for its group starts at the beginning of the topic.
+    """
+    def __init__(self, servers: str, topic: str, group: str):
+        try:
+            from kafka import KafkaConsumer
+        except ImportError:
+            raise ConfigError("The kafka consumer-broker needs the kafka-python package")
+        self.consumer = KafkaConsumer(
+            topic,
+            bootstrap_servers=servers.split(","),
+            group_id=group,
+            enable_auto_commit=False,
+            auto_offset_reset="earliest"
+        )
+
+    def poll(self, max_messages: int, timeout: float=POLL_TIMEOUT) -> List[Message]:
+        records = self.consumer.poll(timeout_ms=int(timeout * 1000), max_records=max_messages)
+        messages = list()
+        for partition, batch in records.items():
+            for record in batch:
+                messages.append(Message(record.value.decode("utf-8"),
+                                        (partition, record.offset)))
+        return messages
+
+    def commit(self, messages: List[Message]) -> None:
+        # everything that's been polled has been handed to the consumer, which only commits
+        # once it's done with all of it. So this commits the current positions.
+        if messages:
+            self.consumer.commit()
+
+    def rewind(self) -> None:
+        for partition in self.consumer.assignment():
+            committed = self.consumer.committed(partition)
+            if committed is None:
+                self.consumer.seek_to_beginning(partition)
+            else:
+                self.consumer.seek(partition, committed)
+
+    def close(self) -> None:
+        self.consumer.close(autocommit=False)
+
+
+def get_broker() -> Broker:
+    """
+    Makes the Broker set by consumer-broker in the config.
+    """
+    cfg = get_config()
+    if cfg.consumer_broker == "file":
+        if not cfg.consumer_file:
+            raise ConfigError("consumer-file must be set to use the file consumer-broker")
+        return FileBroker(cfg.consumer_file)
+    if not cfg.consumer_servers:
+        raise ConfigError("consumer-servers must be set to use the kafka consumer-broker")
+    return KafkaBroker(cfg.consumer_servers, cfg.consumer_topic, cfg.consumer_group)
@@ -0,0 +1,200 @@
+"""
+The NotificationConsumer reads notification operations from a Broker (see brokers.py), and
+applies them. Each message is a JSON object with an operation:
+
+* notify - adds a notification. Its other keys are the same as for POST /api/V1/notification,
+  except that Entities can also be given as strings. "type::id" strings are parsed as usual.
+  Bare ids are users, except for the object, which gets the type that goes with its source
+  (a group for the groups service, a workspace for the workspace service, and so on).
+* cancel - expires notifications from a source, by external key:
+  {"operation": "cancel", "source": source, "external_ids": [external keys]}
+
+Messages are read in batches, and applied in order. Each run of notifies gets added together
+(see NotificationManager.add_notifications), up to the next cancel, which gets applied after
+them. Once everything's applied, the batch is committed. If anything fails, the batch isn't
+committed - the broker rewinds, and the whole batch gets read again. That's why the consumer
+needs idempotent-writes on: the notifies that did get stored are recognized by their
+external_key, and not stored twice. Notifies without one might get stored again.
+Messages that can't be parsed, or notifications that fail validation, are logged and skipped,
+since reading them again won't help. A notification that can't be stored fails the batch, so
+it gets read again.
+"""
+
+import json
+import time
+from typing import (
+    List,
+    Optional
+)
+from .brokers import (
+    Broker,
+    Message,
+    POLL_TIMEOUT
+)
+from feeds.api.util import (
+    parse_notification_params,
+    make_notification
+)
+from feeds.activity.notification import Notification
+from feeds.entity.entity import (
+    Entity,
+    STR_SEPARATOR
+)
+from feeds.managers.notification_manager import NotificationManager
+from feeds.config import get_config
+from feeds.exceptions import (
+    IllegalParameterError,
+    ConfigError
+)
+from feeds.logger import (
+    log,
+    log_error
+)
+
+RETRY_WAIT = 5  # seconds
+
+
+class NotificationConsumer(object):
+    def __init__(self, broker: Broker, batch_size: Optional[int]=None,
+                 poll_timeout: float=POLL_TIMEOUT):
+        """
+        :param broker: where the messages come from
+        :param batch_size: the most messages to handle at once. Defaults to
+            consumer-batch-size in the config.
+        :param poll_timeout: how long to wait for messages before giving up, in seconds
+        Raises a ConfigError if idempotent-writes isn't on.
+        """
+        cfg = get_config()
+        if not cfg.idempotent_writes:
+            raise ConfigError("The consumer needs idempotent-writes=true, so replayed batches "
+                              "aren't stored twice")
+        if batch_size is None:
+            batch_size = cfg.consumer_batch_size
+        self.broker = broker
+        self.batch_size = batch_size
+        self.poll_timeout = poll_timeout
+        self.manager = NotificationManager()
+
+    def consume_batch(self) -> int:
+        """
+        Reads and applies the next batch of messages, then commits it. If that fails, the
+        broker gets rewound to before the batch, and the error is raised.
+        Returns the number of messages in the batch, which is 0 if there weren't any.
+        """
+        messages = self.broker.poll(self.batch_size, self.poll_timeout)
+        if not messages:
+            return 0
+        try:
+            notes = list()
+            for message in messages:
+                try:
+                    op = self._parse(message)
+                except Exception as e:
+                    # anything wrong with a single message will be wrong every time it's read
+                    log(__name__, "Skipping message at %s: %s", message.position, e)
+                    continue
+                if isinstance(op, Notification):
+                    notes.append(op)
+                    continue
+                # the notifies before a cancel might be what it cancels
+                self._add_notifications(notes)
+                notes = list()
+                self.manager.expire_notifications([], op[1], source=op[0])
+            self._add_notifications(notes)
+        except Exception:
+            self.broker.rewind()
+            raise
+        self.broker.commit(messages)
+        return len(messages)
+
+    def _add_notifications(self, notes: List[Notification]) -> None:
+        if not notes:
+            return
+        errors = self.manager.add_notifications(notes, raise_store_errors=True)
+        for note, error in zip(notes, errors):
+            if error is not None:
+                log(__name__, "Skipping notification %s: %s", note.external_key, error)
+
+    def run(self, until_idle: bool=False) -> int:
+        """
+        Consumes batches until there's nothing left to read, if until_idle is True, or
+        forever otherwise. Failed batches are logged, and tried again after RETRY_WAIT seconds.
+        Returns the number of messages consumed.
+        """
+        total = 0
+        while True:
+            start = time.time()
+            try:
+                count = self.consume_batch()
+            except Exception as e:
+                log_error(__name__, e)
+                time.sleep(RETRY_WAIT)
+                continue
+            if count:
+                total += count
+                elapsed = time.time() - start
+                log(__name__, "Consumed %s messages in %.3fs (%.0f/s)",
+                    count, elapsed, count / max(elapsed, 0.001))
+            elif until_idle:
+                return total
+
+    def _parse(self, message: Message):
+        """
+        Returns a Notification for a notify message, or a (source, external keys) tuple for
+        a cancel message.
+        """
+        params = json.loads(message.value)
+        if not isinstance(params, dict):
+            raise IllegalParameterError("Expected a JSON object")
+        operation = params.pop("operation", None)
+        if operation == "notify":
+            return make_notification(parse_notification_params(self._entity_params(params)))
+        if operation == "cancel":
+            source = params.get("source")
+            external_keys = params.get("external_ids")
+            if not isinstance(source, str) or not isinstance(external_keys, list):
+                raise IllegalParameterError("A cancel needs a source and a list of external_ids")
+            return (source, [str(k) for k in external_keys])
+        raise IllegalParameterError("Unknown operation {}".format(operation))
+
+    def _entity_params(self, params: dict) -> dict:
+        """
+        Turns any bare ids in the notify params into Entity structures.
+        """
+        object_type = _object_types().get(params.get("source"))
+        if "actor" in params:
+            params["actor"] = _entity(params["actor"], "user")
+        if "object" in params and object_type is not None:
+            params["object"] = _entity(params["object"], object_type)
+        for key in ["users", "target"]:
+            if isinstance(params.get(key), list):
+                params[key] = [_entity(e, "user") for e in params[key]]
+        return params
+
+
+def _entity(value, default_type: str):
+    if isinstance(value, str):
+        if STR_SEPARATOR not in value:
+            return {"id": value, "type": default_type}
+        return Entity.from_str(value).to_dict()
+    return value
+
+
+def _object_types() -> dict:
+    cfg = get_config()
+    return {
+        cfg.service_groups: "group",
+        cfg.service_workspace: "workspace",
+        cfg.service_narrative: "narrative",
+        cfg.service_jobs: "job"
+    }
+
+
+def consume(broker: Broker, until_idle: bool=False) -> int:
+    """
+    Runs a NotificationConsumer on the broker, and closes the broker when it's done.
+    """
+    try:
+        return NotificationConsumer(broker).run(until_idle=until_idle)
+    finally:
+        broker.close()
@@ -0,0 +1,150 @@
+"""
+An ArchiveManager moves expired notifications out of the live storage, and into the archive,
+once they've been expired for longer than the archive-grace period in the config. Archived
+notifications are no longer in anyone's feed, but can still be looked up by id or external
+key, if asked for.
+
+This can be run on a schedule in the background of each server process (see start_archiver).
+The same background thread also does the upkeep that the storage needs more often than that
+(see maintain_storage). Every process starts one, but they share a
+lease in the storage, so only one of them does any of that at a time. If that process goes
+away, another takes over once its lease runs out.
+"""
+
+import threading
+import time
+import uuid
+from typing import (
+    Callable,
+    List,
+    Optional,
+    Tuple
+)
+from .base import BaseManager
+from ..storage.factory import (
+    get_activity_storage,
+    get_unseen_count_storage,
+    get_lease_storage
+)
+from feeds.config import get_config
+from feeds.util import epoch_ms
+from feeds.logger import (
+    log,
+    log_error
+)
+
+ARCHIVE_BATCH_SIZE = 1000
+RECONCILE_BATCH_SIZE = 1000
+DAY_MS = 24 * 60 * 60 * 1000
+ARCHIVER_LEASE = "archiver"
+
+_archiver = None
+_archiver_lock = threading.Lock()
+
+
+class ArchiveManager(BaseManager):
+    def __init__(self, grace_days: Optional[int]=None):
+        """
+        :param grace_days: how long notifications stay in the live storage after they
+            expire. Defaults to archive-grace in the config.
+        """
+        if grace_days is None:
+            grace_days = get_config().archive_grace
+        self.grace_days = grace_days
+
+    def archive_expired(self) -> int:
+        """
+        Archives every notification that expired more than grace_days ago, in batches.
+        Returns the number of archived notifications.
+        """
+        storage = get_activity_storage()
+        before = epoch_ms() - self.grace_days * DAY_MS
+        total = 0
+        while True:
+            archived = storage.archive_expired(before, ARCHIVE_BATCH_SIZE)
+            total += len(archived)
+            if len(archived) < ARCHIVE_BATCH_SIZE:
+                return total
+
+
+def maintain_storage() -> int:
+    """
+    Sweeps expired notifications out of the storage (see ActivityStorage.sweep_expired), then
+    reconciles unseen counts. Returns the number of reconciled counts.
+    """
+    get_activity_storage().sweep_expired()
+    return reconcile_unseen_counts()
+
+
+def reconcile_unseen_counts() -> int:
+    """
+    Reconciles every unseen count that's due for it (see UnseenCountStorage.reconcile_stale),
+    in batches. Returns the number of reconciled counts.
+    """
+    storage = get_unseen_count_storage()
+    total = 0
+    while True:
+        count = storage.reconcile_stale(RECONCILE_BATCH_SIZE)
+        total += count
+        if count < RECONCILE_BATCH_SIZE:
+            return total
+
+
+def start_archiver() -> None:
+    """
+    Starts a background thread that archives expired notifications every archive-interval
+    seconds, and maintains the storage (see maintain_storage) every maintenance-interval
+    seconds, whenever this process holds the archiver lease. Either one is left out if its
+    interval is 0. Does nothing if they both are, or if it's already running in this process.
+    """
+    global _archiver
+    cfg = get_config()
+    jobs = [
+        (job, interval) for job, interval in [
+            (_archive, cfg.archive_interval),
+            (_maintain, cfg.maintenance_interval)
+        ] if interval
+    ]
+    if not jobs:
+        return
+    with _archiver_lock:
+        if _archiver is not None:
+            return
+        owner = str(uuid.uuid4())
+        _archiver = threading.Thread(target=_run_archiver, args=(jobs, owner), daemon=True)
+        _archiver.start()
+
+
+def _run_archiver(jobs: List[Tuple[Callable[[], None], int]], owner: str) -> None:
+    tick = min(interval for job, interval in jobs)
+    # the lease outlives a round, so the owner keeps it as long as it keeps running.
+    lease_time = 2 * tick * 1000
+    last_run = {job: time.time() for job, interval in jobs}
+    while True:
+        time.sleep(tick)
+        try:
+            if not get_lease_storage().acquire(ARCHIVER_LEASE, owner, lease_time):
+                continue
+        except Exception as e:
+            log_error(__name__, e)
+            continue
+        for job, interval in jobs:
+            if time.time() - last_run[job] < interval:
+                continue
+            last_run[job] = time.time()
+            try:
+                job()
+            except Exception as e:
+                log_error(__name__, e)
+
+
+def _archive() -> None:
+    count = ArchiveManager().archive_expired()
+    if count:
+        log(__name__, "Archived %s expired notifications", count)
+
+
+def _maintain() -> None:
+    count = maintain_storage()
+    if count:
+        log(__name__, "Reconciled %s unseen counts", count)
@@ -20,3 +20,13 @@ class FanoutModule(object):
         Ideally, it'll be a list of users that should see the notification.
         """
         pass
+
+    @classmethod
+    def get_all_target_users(cls, notes: List[Notification]) -> List[List[Entity]]:
+        """
+        Returns the target users for each of several notifications from this module's source,
+        in order. By default this just fans out each one separately - modules that have to ask
+        another service who gets a notification should override this, to ask about all of them
+        at once.
+        """
+        return [cls(note).get_target_users() for note in notes]
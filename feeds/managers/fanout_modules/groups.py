@@ -1,6 +1,89 @@
+from typing import (
+    List,
+    Dict,
+    Optional
+)
+from cachetools import TTLCache
 from .base import FanoutModule
+from feeds.activity.notification import Notification
+from feeds.entity.entity import Entity
+from feeds.exceptions import GroupsError
+from feeds.external_api.groups import get_group_members
+from feeds.storage.redis import group_cache
+from feeds.logger import log_error
+
+MEMBER_CACHE_TIME = 60  # seconds
+MEMBERSHIP_VERBS = ["accept", "join", "leave"]
+
+_member_cache = TTLCache(10000, MEMBER_CACHE_TIME)
 
 
 class GroupsFanout(FanoutModule):
-    def get_target_users(self):
-        return list(set(self.note.users))
+    """
+    Any groups in a notification's users get expanded to everyone in them, except for the
+    actor. The groups stay on as users too.
+    Members come from a cache in this process, then the shared cache (see
+    feeds/storage/redis/group_cache.py), then the Groups service. A notification about someone
+    accepting, joining, or leaving a group means its members changed, so that group gets
+    dropped from both caches first (see invalidate_group_members).
+    If the Groups service can't be reached, groups don't get expanded.
+    """
+    def get_target_users(self) -> List[Entity]:
+        return self.get_all_target_users([self.note])[0]
+
+    @classmethod
+    def get_all_target_users(cls, notes: List[Notification]) -> List[List[Entity]]:
+        """
+        Looks up the members of every group in the notifications' users at once.
+        """
+        changed = [n.object.id for n in notes if _changes_membership(n)]
+        if changed:
+            invalidate_group_members(changed)
+        group_ids = list(dict.fromkeys(
+            u.id for note in notes for u in note.users if u.type == "group"
+        ))
+        members = dict()
+        if group_ids:
+            try:
+                members = _get_members(group_ids)
+            except GroupsError as e:
+                log_error(__name__, e)
+        targets = list()
+        for note in notes:
+            users = set(note.users)
+            for group in [u for u in note.users if u.type == "group"]:
+                for name in members.get(group.id) or []:
+                    member = Entity(name, "user")
+                    if member != note.actor:
+                        users.add(member)
+            targets.append(list(users))
+        return targets
+
+
+def invalidate_group_members(group_ids: List[str]) -> None:
+    """
+    Drops the cached members of the groups, here and in the shared cache. Other processes
+    might keep using theirs for up to MEMBER_CACHE_TIME seconds.
+    """
+    for g_id in group_ids:
+        _member_cache.pop(g_id, None)
+    group_cache.invalidate_group_members(group_ids)
+
+
+def _get_members(group_ids: List[str]) -> Dict[str, Optional[List[str]]]:
+    members = {g_id: _member_cache[g_id] for g_id in group_ids if g_id in _member_cache}
+    missing = [g_id for g_id in group_ids if g_id not in members]
+    if missing:
+        cached = group_cache.get_cached_group_members(missing)
+        fetched = get_group_members([g_id for g_id in missing if g_id not in cached])
+        group_cache.cache_group_members(fetched)
+        for g_id, names in list(cached.items()) + list(fetched.items()):
+            _member_cache[g_id] = names
+            members[g_id] = names
+    return members
+
+
+def _changes_membership(note: Notification) -> bool:
+    if note.object is None or note.object.type != "group":
+        return False
+    return note.verb.infinitive in MEMBERSHIP_VERBS
@@ -1,11 +1,56 @@
+from typing import (
+    List,
+    Optional
+)
 from .base import FanoutModule
-from feeds.biokbase.workspace.client import Workspace
-from feeds.config import get_config
+from feeds.activity.notification import Notification
+from feeds.entity.entity import Entity
+from feeds.exceptions import WorkspaceError
+from feeds.external_api.workspace import get_workspace_acls
+from feeds.logger import log_error
+
+WORKSPACE_TYPES = ["workspace", "narrative"]
+
 
-# flake8: noqa
 class WorkspaceFanout(FanoutModule):
-    def get_target_users(self):
-        cfg = get_config()
-        ws = Workspace(url=cfg.ws_url)
+    """
+    Notifications about a workspace or narrative go to everyone who has access to it, along
+    with the users and targets they're addressed to. The actor isn't told about what they did
+    just because they have access, though.
+    If the Workspace can't be reached, notifications only go to their users and targets.
+    """
+    def get_target_users(self) -> List[Entity]:
+        return self.get_all_target_users([self.note])[0]
+
+    @classmethod
+    def get_all_target_users(cls, notes: List[Notification]) -> List[List[Entity]]:
+        """
+        Looks up the permissions on every workspace the notifications are about at once (see
+        get_workspace_acls).
+        """
+        ws_ids = [_workspace_id(note) for note in notes]
+        acls = dict()
+        if any(ws_id is not None for ws_id in ws_ids):
+            try:
+                acls = get_workspace_acls([ws_id for ws_id in ws_ids if ws_id is not None])
+            except WorkspaceError as e:
+                log_error(__name__, e)
+        targets = list()
+        for note, ws_id in zip(notes, ws_ids):
+            users = set(note.users + note.target)
+            for user in acls.get(ws_id) or {}:
+                entity = Entity(user, "user")
+                if entity != note.actor:
+                    users.add(entity)
+            targets.append(list(users))
+        return targets
+
 
-        return list(set(self.note.users + self.note.target))
+def _workspace_id(note: Notification) -> Optional[str]:
+    """
+    Returns the id of the workspace the notification is about, or None if it isn't about one.
+    """
+    obj = note.object
+    if obj is None or obj.type not in WORKSPACE_TYPES or not str(obj.id).isdigit():
+        return None
+    return str(obj.id)
@@ -8,17 +8,23 @@ See also the docs in NotificationFeed.
 
 from typing import (
     List,
-    Dict
+    Dict,
+    Optional
 )
 from .base import BaseManager
 from ..activity.notification import Notification
-from ..storage.mongodb.activity_storage import MongoActivityStorage
+from ..storage.factory import get_activity_storage
+from ..storage.write_behind import get_write_queue
 from .fanout_modules.groups import GroupsFanout
 from .fanout_modules.workspace import WorkspaceFanout
 from .fanout_modules.jobs import JobsFanout
 from .fanout_modules.kbase import KBaseFanout
 from feeds.entity.entity import Entity
 from feeds.config import get_config
+from feeds.exceptions import (
+    ActivityStorageError,
+    InvalidExpirationError
+)
 
 
 class NotificationManager(BaseManager):
@@ -30,13 +36,65 @@ class NotificationManager(BaseManager):
         """
         Adds a new notification.
         Triggers validation first.
+        If write-behind is on, the notification gets queued to be stored with others (see
+        feeds/storage/write_behind.py).
         """
         note.validate()  # any errors get raised to be caught by the server.
         target_users = self.get_target_users(note)
         # add the notification to the database.
-        activity_storage = MongoActivityStorage()
+        write_queue = get_write_queue()
+        if write_queue is not None:
+            write_queue.add(note, target_users)
+            return
+        activity_storage = get_activity_storage()
         activity_storage.add_to_storage(note, target_users)
 
+    def add_notifications(self, notes: List[Notification],
+                          raise_store_errors: bool=False) -> List[Optional[str]]:
+        """
+        Adds several new notifications at once.
+        Each one gets validated, then the target users are found for all the notifications
+        from each source together, and they all get stored together.
+        Unlike add_notification, a notification that fails validation or can't be stored doesn't
+        raise an error - the rest get added anyway. Returns a list with an error message for
+        each notification that didn't get added, or None for the ones that did, in order.
+        If raise_store_errors is True, only validation errors are returned that way - if any
+        notification can't be stored, an ActivityStorageError gets raised after the rest are
+        stored, since trying again might work.
+        """
+        errors = [None] * len(notes)
+        by_fanout = dict()
+        for idx, note in enumerate(notes):
+            try:
+                note.validate()
+            except InvalidExpirationError as e:
+                errors[idx] = str(e)
+                continue
+            by_fanout.setdefault(self._get_fanout(note.source), list()).append(idx)
+        to_store = list()
+        for fanout, idxs in by_fanout.items():
+            group = [notes[idx] for idx in idxs]
+            if fanout is not None:
+                targets = fanout.get_all_target_users(group)
+            else:
+                targets = [list(note.users) for note in group]
+            to_store.extend(zip(idxs, group, targets))
+        to_store.sort(key=lambda s: s[0])
+        if to_store:
+            store_errors = get_activity_storage().add_many_to_storage(
+                [(note, target_users) for (idx, note, target_users) in to_store]
+            )
+            for (idx, note, target_users), error in zip(to_store, store_errors):
+                errors[idx] = error
+            failed = [error for error in store_errors if error is not None]
+            if raise_store_errors and failed:
+                raise ActivityStorageError(
+                    "Failed to store {} of {} notifications: {}".format(
+                        len(failed), len(store_errors), failed[0]
+                    )
+                )
+        return errors
+
     def get_target_users(self, note: Notification) -> List[Entity]:
         """
         This is gonna get complex.
@@ -46,24 +104,30 @@ class NotificationManager(BaseManager):
         - everyone, if it's global - mark as _global_ feed.
         TODO: add adapters, maybe subclass notifications to handle each source?
         """
-        fanout = None
-        cfg = get_config()
-        if note.source == cfg.service_workspace:
-            fanout = WorkspaceFanout(note)
-        elif note.source == cfg.service_groups:
-            fanout = GroupsFanout(note)
-        elif note.source == cfg.service_jobs:
-            fanout = JobsFanout(note)
-        elif note.source == cfg.service_kbase:
-            fanout = KBaseFanout(note)
-
+        fanout = self._get_fanout(note.source)
         if fanout is not None:
-            user_list = fanout.get_target_users()
+            user_list = fanout(note).get_target_users()
         else:
             user_list = list(note.users)
 
         return user_list
 
+    def _get_fanout(self, source: str) -> Optional[type]:
+        """
+        Returns the FanoutModule class for notifications from the given source, or None if
+        there isn't one.
+        """
+        cfg = get_config()
+        if source == cfg.service_workspace:
+            return WorkspaceFanout
+        elif source == cfg.service_groups:
+            return GroupsFanout
+        elif source == cfg.service_jobs:
+            return JobsFanout
+        elif source == cfg.service_kbase:
+            return KBaseFanout
+        return None
+
     def expire_notifications(self, note_ids: list, external_keys: list, source: str=None,
                              is_admin: bool=False) -> Dict[str, list]:
         """
@@ -72,49 +136,37 @@ class NotificationManager(BaseManager):
         source as in the source parameter (i.e. the 'source' key in the database must == the
         source).
         Or, an admin can expire any notification.
+        Storage finds and expires them together (see
+        ActivityStorage.expire_by_id_or_external_key), so this doesn't fetch the notifications.
         """
-        # Get the notifications from the note_ids and external_keys.
-        # -- mark as unauthorized the ones that don't exist.
-        # If is_admin, cool, expire them all.
-        # If source is not None and not is_admin, make a list of the ones that can be expired
-        # (from that source)
-        # expire the ones that we should.
-        # return the results.
-
-        storage = MongoActivityStorage()
-
-        notes_from_id = storage.get_by_id(note_ids, source=source)
-        notes_from_ext_key = {}
-        if source is not None and len(external_keys):
-            notes_from_ext_key = storage.get_by_external_key(external_keys, source)
+        note_ids = list(dict.fromkeys(note_ids))
+        external_keys = list(dict.fromkeys(external_keys))
+        (expired_ids, expired_keys) = get_activity_storage().expire_by_id_or_external_key(
+            note_ids, external_keys, source=source
+        )
+        found_ids = set(expired_ids)
+        found_keys = set(expired_keys)
         unauthorized = {
-            "note_ids": [k for k in notes_from_id if notes_from_id[k] is None],
-            "external_keys": [k for k in notes_from_ext_key if notes_from_ext_key[k] is None]
+            "note_ids": [k for k in note_ids if k not in found_ids],
+            "external_keys": list()
         }
-        ids_to_expire = list()
-        expired = {"note_ids": [], "external_keys": []}
-        for k, v in notes_from_id.items():
-            if v is not None:
-                ids_to_expire.append(k)
-                expired["note_ids"].append(k)
-        for k, v in notes_from_ext_key.items():
-            if v is not None:
-                ids_to_expire.append(v['id'])
-                expired["external_keys"].append(v['external_key'])
-        storage.expire_notifications(ids_to_expire)
+        if source is not None:
+            unauthorized["external_keys"] = [k for k in external_keys if k not in found_keys]
         return {
             "unauthorized": unauthorized,
-            "expired": expired
+            "expired": {"note_ids": expired_ids, "external_keys": expired_keys}
         }
 
-    def get_notifications_by_ext_keys(self, external_keys: List[str],
-                                      source: str) -> Dict[str, Notification]:
+    def get_notifications_by_ext_keys(self, external_keys: List[str], source: str,
+                                      include_archived: bool=False) -> Dict[str, Notification]:
         """
         Fetches notifications by their external key and source.
         These are returned as a dictionary where the keys are the
         external_keys and values are notifications. Any notifications
         that don't match the criteria are just returned as None.
+        If include_archived is True, archived notifications are looked up, too.
         """
         assert source is not None
-        storage = MongoActivityStorage()
-        return storage.get_by_external_key(external_keys, source)
+        storage = get_activity_storage()
+        return storage.get_by_external_key(external_keys, source,
+                                           include_archived=include_archived)
@@ -0,0 +1,60 @@
+"""
+One-off data migrations. These scan whole collections, so they aren't run when the service
+starts. Run them once, from a single process, after changing the config they go with:
+    python -m feeds.migrate entity-encoding
+Converts the Entities in notes stored by the MongoDB engines to the form set by
+entity-encoding (see feeds/storage/mongodb/util.py). It's safe to run while the service is up.
+    python -m feeds.migrate indexes
+Swaps the MongoDB indexes over to the ones the config uses, after switching db-engine between
+mongodb and mongodb-inbox, or turning idempotent-writes on or off. Servers only ever add
+indexes, so run this once all of them have the new config.
+"""
+
+import argparse
+import logging
+from feeds.config import get_config
+from feeds.exceptions import ConfigError
+from feeds.storage.mongodb.connection import get_mongo_connection
+from feeds.storage.mongodb.util import migrate_all_entity_encodings
+from feeds.logger import log
+
+MONGO_ENGINES = ["mongodb", "mongodb-inbox"]
+
+
+def _check_mongo(migration: str) -> None:
+    if get_config().db_engine not in MONGO_ENGINES:
+        raise ConfigError("{} only applies to the {} engines".format(
+            migration, " and ".join(MONGO_ENGINES)
+        ))
+
+
+def migrate_entity_encoding() -> None:
+    cfg = get_config()
+    _check_mongo("entity-encoding")
+    for name, count in migrate_all_entity_encodings().items():
+        log(__name__, "Converted %s notes in %s to the %s entity encoding",
+            count, name, cfg.entity_encoding)
+
+
+def migrate_indexes() -> None:
+    _check_mongo("indexes")
+    dropped = get_mongo_connection().migrate_indexes()
+    log(__name__, "Dropped indexes: %s", ", ".join(dropped) or "none")
+
+
+MIGRATIONS = {
+    "entity-encoding": migrate_entity_encoding,
+    "indexes": migrate_indexes
+}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Runs a one-off data migration.")
+    parser.add_argument("migration", choices=sorted(MIGRATIONS))
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    MIGRATIONS[args.migration]()
+
+
+if __name__ == "__main__":
+    main()
@@ -28,6 +28,7 @@ from .exceptions import (
 )
 from feeds.api.api_v1 import api_v1
 from feeds.api.admin_v1 import admin_v1
+from feeds.managers.archive_manager import start_archiver
 from feeds.logger import (
     log,
     log_error
@@ -78,6 +79,7 @@ def create_app(test_config=None):
     app.url_map.strict_slashes = False
     app.register_blueprint(api_v1, url_prefix='/api/V1')
     app.register_blueprint(admin_v1, url_prefix='/admin/api/V1')
+    start_archiver()
 
     if test_config is None:
         app.config.from_pyfile('config.py', silent=True)
@@ -132,7 +134,8 @@ def create_app(test_config=None):
                     perms['permissions']['GET'] = perms['permissions']['GET'] + \
                         ['/api/V1/notifications', '/api/V1/notification/<note_id>']
                     perms['permissions']['POST'] = perms['permissions']['POST'] + \
-                        ['/api/V1/notifications/see', '/api/V1/notifications/unsee']
+                        ['/api/V1/notifications/see', '/api/V1/notifications/unsee',
+                         '/api/V1/notifications/see_all']
             except InvalidTokenError:
                 pass
             try:
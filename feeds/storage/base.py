@@ -1,4 +1,5 @@
 from feeds.entity.entity import Entity
+from feeds.exceptions import ActivityStorageError
 
 
 class BaseStorage(object):
@@ -19,12 +20,53 @@ class ActivityStorage(BaseStorage):
     def add_to_storage(self, activities):
         raise NotImplementedError()
 
+    def add_many_to_storage(self, activities):
+        """
+        Adds several activities, given as a list of (activity, target users) tuples.
+        Returns a list with an error message (or None, if it was stored) for each one, in
+        order. This default just adds them one at a time.
+        """
+        errors = list()
+        for activity, target_users in activities:
+            try:
+                self.add_to_storage(activity, target_users)
+                errors.append(None)
+            except ActivityStorageError as e:
+                errors.append(str(e))
+        return errors
+
     def get_from_storage(self, activity_ids):
         raise NotImplementedError()
 
     def remove_from_storage(self, activity_ids):
         raise NotImplementedError()
 
+    def sweep_expired(self):
+        raise NotImplementedError()
+
+    def archive_expired(self, before, batch_size):
+        raise NotImplementedError()
+
+    def set_all_seen(self, user, level=None, verb=None, source=None, before=None):
+        raise NotImplementedError()
+
+    def expire_by_id_or_external_key(self, act_ids, external_keys, source=None):
+        """
+        Expires the activities with the given ids, along with the ones from source with the
+        given external keys. If source is None, external keys aren't looked up, otherwise
+        activities from other sources are left alone.
+        Returns a tuple of (expired ids, expired external keys), each a list of the given
+        ones that were found. This default looks them all up first, then expires them by id.
+        """
+        by_id = self.get_by_id(act_ids, source=source)
+        by_key = dict()
+        if source is not None and external_keys:
+            by_key = self.get_by_external_key(external_keys, source)
+        ids = [k for k in act_ids if by_id.get(k) is not None]
+        keys = [k for k in external_keys if by_key.get(k) is not None]
+        self.expire_notifications(ids + [by_key[k]["id"] for k in keys])
+        return (ids, keys)
+
 
 class TimelineStorage(BaseStorage):
     def __init__(self, user_id, user_type):
@@ -40,5 +82,81 @@ class TimelineStorage(BaseStorage):
     def get_timeline(self, count=10):
         raise NotImplementedError()
 
+    def get_ids_in_timeline(self, note_ids):
+        raise NotImplementedError()
+
     def remove_from_timeline(self, activity_ids):
         raise NotImplementedError()
+
+
+class UnseenCountStorage(BaseStorage):
+    """
+    Keeps a running count of unseen, unexpired activities for each user, so that it can be
+    looked up without counting over their whole timeline.
+    """
+    def __init__(self):
+        pass
+
+    def increment(self, users, amount=1):
+        raise NotImplementedError()
+
+    def adjust(self, amounts):
+        raise NotImplementedError()
+
+    def get_counts(self, users):
+        raise NotImplementedError()
+
+    def reconcile_stale(self, batch_size):
+        raise NotImplementedError()
+
+
+class FeedVersionStorage(BaseStorage):
+    """
+    Keeps a version stamp for each user's feed that changes whenever that feed gets written
+    to. Useful for knowing when something that was built from a feed is out of date.
+    """
+    def __init__(self):
+        pass
+
+    def bump(self, users):
+        raise NotImplementedError()
+
+    def get_versions(self, users):
+        raise NotImplementedError()
+
+
+class GlobalSeenStorage(BaseStorage):
+    """
+    Keeps track of which global activities each user has seen, without touching the global
+    activities themselves.
+    """
+    def __init__(self, global_feed):
+        assert global_feed
+        self.global_feed = global_feed
+
+    def get_seen(self, user, activities):
+        raise NotImplementedError()
+
+    def set_seen(self, act_ids, user):
+        raise NotImplementedError()
+
+    def set_unseen(self, act_ids, user):
+        raise NotImplementedError()
+
+    def set_all_seen(self, user, level=None, verb=None, source=None, before=None):
+        raise NotImplementedError()
+
+    def get_unseen_count(self, user):
+        raise NotImplementedError()
+
+
+class LeaseStorage(BaseStorage):
+    """
+    Hands out named leases that run out after a while, so that only one process at a time
+    does some job.
+    """
+    def __init__(self):
+        pass
+
+    def acquire(self, name, owner, duration):
+        raise NotImplementedError()
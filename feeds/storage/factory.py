@@ -0,0 +1,119 @@
+from typing import Dict
+from feeds.config import get_config
+from feeds.exceptions import ConfigError
+from feeds.entity.entity import Entity
+from .base import (
+    ActivityStorage,
+    TimelineStorage,
+    UnseenCountStorage,
+    FeedVersionStorage,
+    GlobalSeenStorage,
+    LeaseStorage
+)
+from .mongodb.activity_storage import MongoActivityStorage
+from .mongodb.timeline_storage import MongoTimelineStorage
+from .mongodb.unseen_count_storage import MongoUnseenCountStorage
+from .mongodb.feed_version_storage import MongoFeedVersionStorage
+from .mongodb.global_seen_storage import MongoGlobalSeenStorage
+from .mongodb.lease_storage import MongoLeaseStorage
+from .mongodb.notification_hub import NotificationHub
+from .mongodb.inbox_storage import (
+    MongoInboxActivityStorage,
+    MongoInboxTimelineStorage,
+    MongoInboxUnseenCountStorage,
+    MongoInboxGlobalSeenStorage,
+    MongoInboxNotificationHub
+)
+from .redis.activity_storage import RedisActivityStorage
+from .redis.timeline_storage import RedisTimelineStorage
+from .redis.unseen_count_storage import RedisUnseenCountStorage
+from .redis.feed_version_storage import RedisFeedVersionStorage
+from .redis.global_seen_storage import RedisGlobalSeenStorage
+from .redis.lease_storage import RedisLeaseStorage
+from .redis.notification_hub import RedisNotificationHub
+
+"""
+Picks the storage classes to use for the db-engine in the config.
+* mongodb - each note is a single document holding all of its recipients (fanout on read).
+* mongodb-inbox - each note is stored once, with a small inbox row for each recipient
+  (fanout on write). See mongodb/inbox_storage.py.
+* redis - everything in Redis, with a sorted set of activity ids for each recipient (fanout on
+  write). See redis/activity_storage.py.
+Everything outside of the storage package should get its storage from here.
+"""
+
+_ENGINES: Dict[str, Dict[str, type]] = {
+    "mongodb": {
+        "activity": MongoActivityStorage,
+        "timeline": MongoTimelineStorage,
+        "unseen_count": MongoUnseenCountStorage,
+        "feed_version": MongoFeedVersionStorage,
+        "global_seen": MongoGlobalSeenStorage,
+        "lease": MongoLeaseStorage,
+        "hub": NotificationHub
+    },
+    "mongodb-inbox": {
+        "activity": MongoInboxActivityStorage,
+        "timeline": MongoInboxTimelineStorage,
+        "unseen_count": MongoInboxUnseenCountStorage,
+        "feed_version": MongoFeedVersionStorage,
+        "global_seen": MongoInboxGlobalSeenStorage,
+        "lease": MongoLeaseStorage,
+        "hub": MongoInboxNotificationHub
+    },
+    "redis": {
+        "activity": RedisActivityStorage,
+        "timeline": RedisTimelineStorage,
+        "unseen_count": RedisUnseenCountStorage,
+        "feed_version": RedisFeedVersionStorage,
+        "global_seen": RedisGlobalSeenStorage,
+        "lease": RedisLeaseStorage,
+        "hub": RedisNotificationHub
+    }
+}
+
+_hub = None
+
+
+def get_activity_storage() -> ActivityStorage:
+    return _engine()["activity"]()
+
+
+def get_timeline_storage(user_id: str, user_type: str) -> TimelineStorage:
+    return _engine()["timeline"](user_id, user_type)
+
+
+def get_unseen_count_storage() -> UnseenCountStorage:
+    return _engine()["unseen_count"]()
+
+
+def get_feed_version_storage() -> FeedVersionStorage:
+    return _engine()["feed_version"]()
+
+
+def get_global_seen_storage() -> GlobalSeenStorage:
+    cfg = get_config()
+    return _engine()["global_seen"](Entity(cfg.global_feed, cfg.global_feed_type))
+
+
+def get_lease_storage() -> LeaseStorage:
+    return _engine()["lease"]()
+
+
+def get_notification_hub() -> NotificationHub:
+    """
+    There's a single hub for each process, so it can share one change stream.
+    """
+    global _hub
+    if _hub is None:
+        _hub = _engine()["hub"]()
+    return _hub
+
+
+def _engine() -> Dict[str, type]:
+    engine = get_config().db_engine
+    if engine not in _ENGINES:
+        raise ConfigError("Unknown db-engine '{}'. Expected one of: {}".format(
+            engine, ", ".join(_ENGINES.keys())
+        ))
+    return _ENGINES[engine]
@@ -0,0 +1,93 @@
+from bisect import bisect_right
+from typing import (
+    List,
+    Dict,
+    Tuple
+)
+
+"""
+Global notifications are stored once, for the global feed user, so they can't carry the seen
+state of every user who reads them. Instead, each user's state is kept separately, as a
+SeenState tuple of:
+(
+    hwm: high water mark - global notes created at or before this time (ms since epoch) are
+         seen by default,
+    seen: set of ids of notes created after hwm that have been seen anyway,
+    unseen: set of ids of notes created at or before hwm that are unseen anyway
+)
+A user without any state has seen nothing (hwm = 0). Whenever a user's state changes, the
+high water mark is moved to wherever it leaves the fewest exceptions, and ids of expired notes
+are dropped, so the state stays small however many global notes the user goes through.
+
+These helpers work on that state, no matter which storage engine keeps it. Each engine reads
+a user's state, updates it, and only stores it if nobody else stored theirs in the meantime -
+otherwise it starts over, up to MAX_STATE_RETRIES times, so concurrent updates don't lose
+each other's marks.
+"""
+
+SeenState = Tuple[int, set, set]
+
+EMPTY_STATE: SeenState = (0, set(), set())
+
+MAX_STATE_RETRIES = 10
+
+
+def is_seen(state: SeenState, act_id: str, created: int) -> bool:
+    (hwm, seen, unseen) = state
+    if created <= hwm:
+        return act_id not in unseen
+    return act_id in seen
+
+
+def update_state(state: SeenState, active: List[Tuple[str, int]], act_ids: List[str],
+                 seen: bool) -> SeenState:
+    """
+    Marks the given activities as seen or unseen, and returns the most compact state that
+    describes all the active (unexpired) global activities.
+    active is a list of (id, created) tuples.
+    """
+    changed = set(act_ids)
+    seen_by_id = dict()
+    for act_id, created in active:
+        if act_id in changed:
+            seen_by_id[act_id] = seen
+        else:
+            seen_by_id[act_id] = is_seen(state, act_id, created)
+    return _compact(active, seen_by_id, state[0])
+
+
+def _compact(active: List[Tuple[str, int]], seen_by_id: Dict[str, bool],
+             hwm: int) -> SeenState:
+    """
+    Picks the high water mark that needs the fewest exceptions to describe seen_by_id.
+    Candidates are the current mark, and the creation time of each active activity, as
+    any activity made from now on has to land after the mark and be unseen. Ties go to the
+    current mark, then the oldest time.
+    A mark's exceptions are the unseen activities created at or before it, and the seen ones
+    after it, so with running counts of those over the activities sorted by creation time,
+    each candidate is a binary search instead of another pass over all of them.
+    """
+    ordered = sorted(active, key=lambda act: act[1])
+    times = [created for act_id, created in ordered]
+    # seen_before[i] / unseen_before[i] count the first i activities in ordered
+    seen_before = [0]
+    unseen_before = [0]
+    for act_id, created in ordered:
+        is_seen = seen_by_id[act_id]
+        seen_before.append(seen_before[-1] + (1 if is_seen else 0))
+        unseen_before.append(unseen_before[-1] + (0 if is_seen else 1))
+    total_seen = seen_before[-1]
+
+    def exceptions(candidate: int) -> int:
+        i = bisect_right(times, candidate)
+        return unseen_before[i] + total_seen - seen_before[i]
+
+    best = hwm
+    fewest = exceptions(hwm)
+    for candidate in times:
+        count = exceptions(candidate)
+        if count < fewest:
+            (best, fewest) = (candidate, count)
+    seen = {act_id for act_id, created in ordered if created > best and seen_by_id[act_id]}
+    unseen = {act_id for act_id, created in ordered if created <= best and not seen_by_id[act_id]}
+    return (best, seen, unseen)
@@ -1,15 +1,50 @@
+from collections import (
+    defaultdict,
+    Counter
+)
 from typing import (
     List,
-    Dict
+    Dict,
+    Tuple,
+    Optional
 )
 from ..base import ActivityStorage
-from .connection import get_feeds_collection
+from ..redis.timeline_cache import (
+    add_to_timeline_caches,
+    set_seen_in_timeline_cache,
+    clear_timeline_cache,
+    expire_from_timeline_caches
+)
+from .connection import (
+    get_feeds_collection,
+    get_archive_collection
+)
+from .unseen_count_storage import MongoUnseenCountStorage
+from .util import (
+    encode_activity,
+    encode_entities,
+    entity_forms,
+    entity_query,
+    note_id_query,
+    seen_filter_query,
+    decode_activity
+)
+from .feed_version_storage import MongoFeedVersionStorage
 from feeds.exceptions import (
     ActivityStorageError
 )
-from pymongo.errors import PyMongoError
+from pymongo import ASCENDING
+from pymongo.errors import (
+    PyMongoError,
+    BulkWriteError,
+    DuplicateKeyError
+)
+from pymongo.collection import Collection
+from feeds.config import get_config
 from feeds.util import epoch_ms
 from feeds.entity.entity import Entity
+from feeds.notification_level import Level
+from feeds.verbs import Verb
 
 
 class MongoActivityStorage(ActivityStorage):
@@ -18,30 +53,162 @@ class MongoActivityStorage(ActivityStorage):
         Adds a single activity to the MongoDB.
         Returns None if successful.
         Raises an ActivityStorageError if it fails.
+
+        With idempotent-writes on, an activity with an external key is upserted on its source
+        and external key, so it's only stored if there isn't one with those already. If there
+        is, this is treated as a retry of it - nothing gets stored, and activity.id is set to
+        the stored one's id.
+        """
+        if not self._store_note(self._note_doc(activity, target_users), activity):
+            return
+        MongoUnseenCountStorage().increment(set(target_users))
+        MongoFeedVersionStorage().bump(target_users)
+        add_to_timeline_caches(activity, target_users)
+
+    def add_many_to_storage(self, activities: List[Tuple[object, List[Entity]]]
+                            ) -> List[Optional[str]]:
+        """
+        Adds several activities, given as (activity, target users) tuples, with a single
+        unordered insert_many. Each stored activity is handled the same as add_to_storage, but
+        the unseen counts and feed versions are updated once for all of them.
+        With idempotent-writes on, the unique index on source and external key turns away any
+        that were already stored, and those are treated as retries, like in add_to_storage.
+        Returns a list with an error message (or None, if it was stored) for each activity,
+        in order.
+        Raises an ActivityStorageError if the whole insert fails.
+        """
+        if not activities:
+            return []
+        docs = [self._note_doc(activity, users) for activity, users in activities]
+        failures = self._insert_many(get_feeds_collection(), docs)
+        stored = [f is None for f in failures]
+        errors = self._resolve_failures([a for a, users in activities], failures)
+        self._after_add_many(activities, stored)
+        return errors
+
+    def _store_note(self, act_doc: dict, activity) -> bool:
+        """
+        Stores the note doc made from the activity, upserting it if it's idempotent. Returns
+        True if it was stored, or False if it matched a stored one, in which case activity.id
+        gets set to that one's id.
+        Raises an ActivityStorageError if it fails.
         """
         coll = get_feeds_collection()
-        act_doc = activity.to_dict()
-        act_doc["users"] = [t.to_dict() for t in target_users]
-        act_doc["unseen"] = [t.to_dict() for t in target_users]
         try:
-            coll.insert_one(act_doc)
+            if not self._is_idempotent(activity):
+                coll.insert_one(act_doc)
+                return True
+            result = coll.update_one(
+                {"source": activity.source, "external_key": activity.external_key},
+                {"$setOnInsert": act_doc},
+                upsert=True
+            )
+            if result.upserted_id is not None:
+                return True
+        except DuplicateKeyError as e:
+            if not self._is_idempotent(activity):
+                raise ActivityStorageError("Failed to store activity: " + str(e))
+            # otherwise, a concurrent upsert of the same one got there first
         except PyMongoError as e:
             raise ActivityStorageError("Failed to store activity: " + str(e))
+        stored = self.get_by_external_key([activity.external_key], activity.source)
+        if stored[activity.external_key] is None:
+            raise ActivityStorageError("Failed to store activity: a duplicate was found, "
+                                       "but then went missing")
+        activity.id = stored[activity.external_key]["id"]
+        return False
+
+    @staticmethod
+    def _is_idempotent(activity) -> bool:
+        return get_config().idempotent_writes and activity.external_key is not None
+
+    def _resolve_failures(self, activities: list, failures: List[Optional[dict]]
+                          ) -> List[Optional[str]]:
+        """
+        Turns the failures from _insert_many into error messages. Duplicate key failures on
+        idempotent activities aren't errors - those activities get their ids set to the ones
+        they match, like in _store_note.
+        """
+        errors = [None] * len(activities)
+        retries = defaultdict(list)
+        for idx, failure in enumerate(failures):
+            if failure is None:
+                continue
+            if failure["code"] == 11000 and self._is_idempotent(activities[idx]):
+                retries[activities[idx].source].append(idx)
+            else:
+                errors[idx] = "Failed to store activity: " + failure["errmsg"]
+        for source, idxs in retries.items():
+            stored = self.get_by_external_key([activities[i].external_key for i in idxs], source)
+            for idx in idxs:
+                note = stored[activities[idx].external_key]
+                if note is None:
+                    errors[idx] = "Failed to store activity: " + failures[idx]["errmsg"]
+                else:
+                    activities[idx].id = note["id"]
+        return errors
+
+    def _note_doc(self, activity, target_users: List[Entity]) -> dict:
+        act_doc = encode_activity(activity.to_dict())
+        act_doc["_id"] = activity.id
+        act_doc["users"] = encode_entities(target_users)
+        act_doc["unseen"] = encode_entities(target_users)
+        return act_doc
+
+    @staticmethod
+    def _insert_many(coll: Collection, docs: List[dict]) -> List[Optional[dict]]:
+        """
+        Inserts the docs without stopping at the first failure. Returns a list with the write
+        error (with its code and errmsg), or None, for each doc, in order.
+        """
+        failures = [None] * len(docs)
+        try:
+            coll.insert_many(docs, ordered=False)
+        except BulkWriteError as e:
+            for err in e.details.get('writeErrors', []):
+                failures[err['index']] = err
+        except PyMongoError as e:
+            raise ActivityStorageError("Failed to store activities: " + str(e))
+        return failures
+
+    def _after_add_many(self, activities: List[Tuple[object, List[Entity]]],
+                        stored: List[bool]) -> None:
+        """
+        Updates the unseen counts, feed versions, and timeline caches for the activities that
+        got stored.
+        """
+        counts = Counter()
+        for (activity, users), is_stored in zip(activities, stored):
+            if is_stored:
+                counts.update(set(users))
+        MongoUnseenCountStorage().adjust(dict(counts))
+        MongoFeedVersionStorage().bump(list(counts))
+        for (activity, users), is_stored in zip(activities, stored):
+            if is_stored:
+                add_to_timeline_caches(activity, users)
 
     def set_unseen(self, act_ids: List[str], user: Entity) -> None:
         """
         Setting unseen means adding the user to the list of unseens. But we should only do that for
         docs that the user can't see anyway, so put that in the query.
+        The user gets added to unseen in the same form they're stored in users, so that's done
+        for each form (see util.py).
         """
-        u = user.to_dict()
-        coll = get_feeds_collection()
-        coll.update_many({
-            'id': {'$in': act_ids},
-            'users': u,
-            'unseen': {'$nin': [u]}
-        }, {
-            '$addToSet': {'unseen': u}
-        })
+        forms = entity_forms([user])
+        coll = self._collection()
+        modified = 0
+        for u in forms:
+            result = coll.update_many(dict(self._id_query(act_ids), **{
+                'users': u,
+                'unseen': {'$nin': forms}
+            }), {
+                '$addToSet': {'unseen': u}
+            })
+            modified += result.modified_count
+        MongoUnseenCountStorage().increment([user], modified)
+        if modified:
+            MongoFeedVersionStorage().bump([user])
+            set_seen_in_timeline_cache(act_ids, user, False, modified)
 
     def set_seen(self, act_ids: List[str], user: Entity) -> None:
         """
@@ -50,62 +217,218 @@ class MongoActivityStorage(ActivityStorage):
         is in the list of users, AND the list of unseens.
         The update should remove the user from the list of unseens.
         """
-        u = user.to_dict()
-        coll = get_feeds_collection()
-        coll.update_many({
-            'id': {'$in': act_ids},
+        u = entity_query(user)
+        coll = self._collection()
+        result = coll.update_many(dict(self._id_query(act_ids), **{
             'users': u,
             'unseen': u
-        }, {
+        }), {
+            '$pull': {'unseen': u}
+        })
+        MongoUnseenCountStorage().increment([user], -result.modified_count)
+        if result.modified_count:
+            MongoFeedVersionStorage().bump([user])
+            set_seen_in_timeline_cache(act_ids, user, True, result.modified_count)
+
+    def set_all_seen(self, user: Entity, level: Level=None, verb: Verb=None, source: str=None,
+                     before: int=None) -> int:
+        """
+        Marks every unexpired activity the user hasn't seen, and that matches the filters, as
+        seen with a single update. Filters are the same as util.seen_filter_query.
+        The user's cached timeline (if any) gets dropped, since the update doesn't say which
+        activities it changed.
+        Returns the number of activities that got marked.
+        """
+        u = entity_query(user)
+        query = seen_filter_query(level=level, verb=verb, source=source, before=before)
+        query.update({'users': u, 'unseen': u})
+        result = self._collection().update_many(query, {
             '$pull': {'unseen': u}
         })
+        if result.modified_count:
+            MongoUnseenCountStorage().increment([user], -result.modified_count)
+            MongoFeedVersionStorage().bump([user])
+            clear_timeline_cache(user)
+        return result.modified_count
 
-    def get_by_id(self, act_ids: List[str], source: str=None) -> Dict[str, dict]:
+    def get_by_id(self, act_ids: List[str], source: str=None,
+                  include_archived: bool=False) -> Dict[str, dict]:
         """
         If source is not None, return only those that match the source.
-        Returns a dict mapping from note id to note
+        If include_archived is True, any that aren't found get looked up in the archive.
+        Returns a dict mapping from note id to note. The notes don't include their lists of
+        users or unseen users.
         """
         if len(act_ids) == 0:
             return {}
-        coll = get_feeds_collection()
-        query = {
-            'id': {'$in': act_ids}
-        }
-        if source is not None:
-            query['source'] = source
         notes = {k: None for k in act_ids}
-        curs = coll.find(query)
-        for d in curs:
-            notes[d["id"]] = d
+        colls = [get_feeds_collection()]
+        if include_archived:
+            colls.append(get_archive_collection())
+        for coll in colls:
+            missing = [k for k in act_ids if notes[k] is None]
+            if not missing:
+                break
+            query = note_id_query(missing)
+            if source is not None:
+                query['source'] = source
+            curs = coll.find(query, projection={"users": 0, "unseen": 0})
+            for d in curs:
+                notes[d["id"]] = decode_activity(d)
         return notes
 
-    def get_by_external_key(self, external_keys: List[str], source: str) -> Dict[str, dict]:
+    def get_by_external_key(self, external_keys: List[str], source: str,
+                            include_archived: bool=False) -> Dict[str, dict]:
         """
         Source HAS to exist here, it's part of the index.
+        If include_archived is True, any that aren't found get looked up in the archive.
         Returns a dict mapping from external_key to note
         """
         assert source is not None
         if len(external_keys) == 0:
             return {}
-        coll = get_feeds_collection()
-        query = {
-            'external_key': {'$in': external_keys},
-            'source': source
-        }
         notes = {k: None for k in external_keys}
-        curs = coll.find(query)
-        for d in curs:
-            notes[d["external_key"]] = d
+        colls = [get_feeds_collection()]
+        if include_archived:
+            colls.append(get_archive_collection())
+        for coll in colls:
+            missing = [k for k in external_keys if notes[k] is None]
+            if not missing:
+                break
+            query = {
+                'external_key': {'$in': missing},
+                'source': source
+            }
+            curs = coll.find(query)
+            for d in curs:
+                notes[d["external_key"]] = decode_activity(d)
         return notes
 
+    def sweep_expired(self) -> None:
+        """
+        Nothing to do, reads leave out expired notes themselves.
+        """
+        pass
+
+    def archive_expired(self, before: int, batch_size: int) -> List[str]:
+        """
+        Moves up to batch_size notes that expired before the given time (ms since epoch) out
+        of the notifications collection, and into the archive. Archived notes keep their
+        users, but not their unseen lists.
+        Notes get copied before they're removed, and copying one that's already archived is
+        skipped, so this is safe to run from several places at once, or again after it fails.
+        Returns the ids of the archived notes. If there are fewer than batch_size of them,
+        there's nothing left to archive.
+        """
+        coll = get_feeds_collection()
+        docs = list(coll.find(
+            {'expires': {'$lt': before}},
+            projection={'unseen': 0}
+        ).sort('expires', ASCENDING).limit(batch_size))
+        if not docs:
+            return []
+        try:
+            get_archive_collection().insert_many(docs, ordered=False)
+        except BulkWriteError as e:
+            # duplicate key errors just mean those were already archived.
+            if any(err['code'] != 11000 for err in e.details.get('writeErrors', [])):
+                raise ActivityStorageError("Failed to archive activities: " + str(e))
+        coll.delete_many({'_id': {'$in': [d['_id'] for d in docs]}})
+        return [d['id'] for d in docs]
+
     def expire_notifications(self, act_ids: List[str]) -> None:
         """
         Expires notifications by changing their expiration time to now.
+        Any of those that haven't expired yet get taken out of their unseen users' counts, and
+        the feeds of all their users get a new version.
+        """
+        self._expire(self._id_query(act_ids))
+
+    def expire_by_id_or_external_key(self, act_ids: List[str], external_keys: List[str],
+                                     source: str=None) -> Tuple[List[str], List[str]]:
+        """
+        Same as the default in ActivityStorage, but the notes are found in the same
+        aggregation that works out the unseen counts to adjust, then expired with a single
+        update, without reading anything but their ids and external keys.
+        """
+        found = self._expire(self._expire_query(act_ids, external_keys, source))
+        return self._expired_keys(found, act_ids, external_keys, source)
+
+    def _expire(self, query: dict) -> List[dict]:
+        """
+        Expires the documents in _collection() that match the query, as in
+        expire_notifications. Returns the id and external key of each one that matched,
+        including any that had already expired.
         """
         now = epoch_ms()
-        coll = get_feeds_collection()
-        coll.update_many({
-            'id': {'$in': act_ids}
-        }, {
+        coll = self._collection()
+        result = next(coll.aggregate([
+            {'$match': query},
+            {'$facet': {
+                'found': [{'$project': {'_id': 0, 'id': 1, 'external_key': 1}}],
+                'unseen_by': [
+                    {'$match': {'expires': {'$gt': now}}},
+                    {'$unwind': '$users'},
+                    {'$group': {
+                        '_id': '$users',
+                        'count': {'$sum': {'$cond': [{'$in': ['$users', '$unseen']}, 1, 0]}}
+                    }}
+                ]
+            }}
+        ]))
+        found = result['found']
+        if not found:
+            return found
+        unseen_by = result['unseen_by']
+        # while entities are being migrated, a user can show up once for each stored form
+        adjustments = defaultdict(int)
+        for d in unseen_by:
+            if d['count']:
+                adjustments[Entity.from_stored(d['_id'])] -= d['count']
+        coll.update_many(query, {
             '$set': {'expires': now}
         })
+        users = list({Entity.from_stored(d['_id']) for d in unseen_by})
+        MongoUnseenCountStorage().adjust(adjustments)
+        MongoFeedVersionStorage().bump(users)
+        expire_from_timeline_caches([d['id'] for d in found], users, adjustments)
+        return found
+
+    @staticmethod
+    def _expire_query(act_ids: List[str], external_keys: List[str], source: str) -> dict:
+        """
+        A query for the stored notes with the given ids, or the given external keys, as in
+        expire_by_id_or_external_key.
+        """
+        by_id = note_id_query(act_ids)
+        if source is None:
+            return by_id
+        return {'source': source, '$or': [
+            by_id,
+            {'external_key': {'$in': external_keys}}
+        ]}
+
+    @staticmethod
+    def _expired_keys(found: List[dict], act_ids: List[str], external_keys: List[str],
+                      source: str) -> Tuple[List[str], List[str]]:
+        """
+        Works out which of the given ids and external keys were found, from the found notes.
+        """
+        found_ids = {d['id'] for d in found}
+        found_keys = set()
+        if source is not None:
+            found_keys = {d.get('external_key') for d in found}
+        return ([k for k in act_ids if k in found_ids],
+                [k for k in external_keys if k in found_keys])
+
+    def _collection(self) -> Collection:
+        """
+        The collection that holds each note along with its recipients.
+        """
+        return get_feeds_collection()
+
+    def _id_query(self, act_ids: List[str]) -> dict:
+        """
+        A query that matches the documents in _collection() for the given note ids.
+        """
+        return note_id_query(act_ids)
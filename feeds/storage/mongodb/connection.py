@@ -1,14 +1,23 @@
+import logging
+from typing import List
 from pymongo import (
     MongoClient,
     ASCENDING,
     DESCENDING
 )
+from pymongo.errors import OperationFailure
 from feeds.config import get_config
 import feeds.logger as log
 
 _connection = None
 
 _COL_NOTIFICATIONS = "notifications"
+_COL_UNSEEN_COUNTS = "unseen_counts"
+_COL_FEED_VERSIONS = "feed_versions"
+_COL_GLOBAL_SEEN = "global_seen"
+_COL_INBOX = "inbox"
+_COL_ARCHIVE = "notifications_archive"
+_COL_LEASES = "leases"
 
 # Searches to support:
 # 1. Lookup by activity id. Easy.
@@ -19,16 +28,11 @@ _COL_NOTIFICATIONS = "notifications"
 # 6. Lookup all by user, sort by source, then sort by time, then sort by time.
 # 7. Aggregations... later. Maybe part of the Timeline class.
 
+# Lookups by note id (MongoActivityStorage.get_by_id, set_seen, set_unseen,
+# expire_notifications, and MongoTimelineStorage.get_single_activity_from_timeline) use _id.
 _INDEXES = [
-    # MongoActivityStorage.get_by_id
-    # MongoActivityStorage.expire_notifications
-    [("id", ASCENDING)],
-
-    # MongoActivityStorage.get_by_id
-    [("id", ASCENDING), ("source", ASCENDING)],
-
-    # MongoTimelineStorage.get_single_activity_from_timeline
-    [("id", ASCENDING), ("users", ASCENDING)],
+    # MongoActivityStorage.archive_expired
+    [("expires", ASCENDING)],
 
     # MongoTimelineStorage.get_timeline
     [("users", ASCENDING)],
@@ -48,6 +52,17 @@ _INDEXES = [
     # MongoTimelineStorage.get_timeline
     [("users", ASCENDING), ("level", ASCENDING), ("created", DESCENDING)],
 
+    # MongoTimelineStorage.get_timeline (keyset pagination with before/after cursors)
+    [("users", ASCENDING), ("expires", ASCENDING), ("created", DESCENDING), ("id", DESCENDING)],
+
+    # MongoTimelineStorage.get_timeline (entity filter)
+    # MongoTimelineStorage.get_group_timelines
+    # Each of these serves one clause of the $or that finds notes referencing an Entity.
+    # They can't be compounded with "users", since target and users are both arrays.
+    [("actor", ASCENDING), ("created", DESCENDING)],
+    [("object", ASCENDING), ("created", DESCENDING)],
+    [("target", ASCENDING), ("created", DESCENDING)],
+
     # MongoTimelineStorage.get_unseen_count
     # MongoTimelineStorage.get_timeline
     [("users", ASCENDING), ("expires", ASCENDING)],
@@ -70,17 +85,111 @@ _INDEXES = [
     ],
 ]
 
-_SPARSE_INDEXES = [
+# Indexes for the inbox collection, used by the mongodb-inbox engine. Its rows each have a
+# single recipient, but keep the same shape as notes (see inbox_storage.py), so the queries
+# are the same as above.
+_INBOX_INDEXES = [
+    # MongoInboxActivityStorage.set_seen / set_unseen / expire_notifications
+    # MongoInboxTimelineStorage.get_single_activity_from_timeline
+    [("id", ASCENDING), ("users", ASCENDING)],
+
+    # MongoInboxTimelineStorage.get_timeline (and keyset pagination)
+    # MongoInboxUnseenCountStorage.reconcile
+    [("users", ASCENDING), ("expires", ASCENDING), ("created", DESCENDING), ("id", DESCENDING)],
+
+    # MongoInboxTimelineStorage.get_timeline (level and verb filters)
+    [
+        ("users", ASCENDING),
+        ("expires", ASCENDING),
+        ("level", ASCENDING),
+        ("verb", ASCENDING),
+        ("created", DESCENDING)
+    ],
+
+    # MongoInboxTimelineStorage.get_timeline (entity filter)
+    # MongoInboxTimelineStorage.get_group_timelines
+    # Rows have small users arrays, but target is still an array, so that one can't be
+    # compounded with users.
+    [("users", ASCENDING), ("actor", ASCENDING), ("created", DESCENDING)],
+    [("users", ASCENDING), ("object", ASCENDING), ("created", DESCENDING)],
+    [("target", ASCENDING), ("created", DESCENDING)],
+]
+
+# Notes stored before ids were time-sortable have ObjectIds for _ids, and get looked up by
+# their id field (see util.note_id_query). This only indexes those notes, so it shrinks to
+# nothing as they expire and get archived.
+_LEGACY_ID_INDEX = "legacy_id"
+_LEGACY_ID_FILTER = {"_id": {"$type": "objectId"}}
+
+# These used to be on the notifications collection, and get dropped by migrate_indexes. The
+# mongodb-inbox engine joins its rows to notes on id, so it keeps a full index on id instead
+# of the legacy one.
+_OLD_ID_INDEXES = ["id_1", "id_1_source_1", "id_1_users_1"]
+
+# MongoActivityStorage.get_by_external_key
+# MongoActivityStorage.add_to_storage (with idempotent-writes on)
+# With idempotent-writes on, this is unique, and only covers notes that have an external key.
+# Otherwise, it's sparse. The two can't both be there, since they're on the same key.
+_EXTERNAL_KEY_INDEX = [("external_key", ASCENDING), ("source", ASCENDING)]
+_EXTERNAL_KEY_SPARSE = "external_key_1_source_1"
+_EXTERNAL_KEY_UNIQUE = "external_key_unique"
+_EXTERNAL_KEY_FILTER = {"external_key": {"$type": "string"}}
+
+# Indexes for the archive collection, where MongoActivityStorage.archive_expired moves notes
+# to once they've been expired for a while. They're only ever looked up directly.
+_ARCHIVE_UNIQUE_INDEXES = [
+    # MongoActivityStorage.get_by_id
+    # Unique, so notes can't get archived twice.
+    [("id", ASCENDING)]
+]
+
+_ARCHIVE_SPARSE_INDEXES = [
     # MongoActivityStorage.get_by_external_key
     [("external_key", ASCENDING), ("source", ASCENDING)]
 ]
 
+# Unseen counts are looked up by _id, except for finding the ones due to be reconciled.
+_UNSEEN_COUNT_INDEXES = [
+    # MongoUnseenCountStorage.reconcile_stale
+    [("touched", ASCENDING), ("reconciled", ASCENDING)]
+]
+
 
 def get_feeds_collection():
     conn = get_mongo_connection()
     return conn.get_collection(_COL_NOTIFICATIONS)
 
 
+def get_unseen_counts_collection():
+    conn = get_mongo_connection()
+    return conn.get_collection(_COL_UNSEEN_COUNTS)
+
+
+def get_feed_versions_collection():
+    conn = get_mongo_connection()
+    return conn.get_collection(_COL_FEED_VERSIONS)
+
+
+def get_global_seen_collection():
+    conn = get_mongo_connection()
+    return conn.get_collection(_COL_GLOBAL_SEEN)
+
+
+def get_inbox_collection():
+    conn = get_mongo_connection()
+    return conn.get_collection(_COL_INBOX)
+
+
+def get_archive_collection():
+    conn = get_mongo_connection()
+    return conn.get_collection(_COL_ARCHIVE)
+
+
+def get_leases_collection():
+    conn = get_mongo_connection()
+    return conn.get_collection(_COL_LEASES)
+
+
 def get_mongo_connection():
     global _connection
     if _connection is None:
@@ -110,11 +219,102 @@ class FeedsMongoConnection(object):
         return self.db[collection_name]
 
     def _setup_indexes(self):
+        """
+        Creates any indexes that are missing. Indexes are never dropped here, since servers
+        still running older code (or with an older config) might be using them - see
+        migrate_indexes.
+        """
         coll = self.get_collection(_COL_NOTIFICATIONS)
         for index in _INDEXES:
             coll.create_index(index)
-        for index in _SPARSE_INDEXES:
-            coll.create_index(index, sparse=True)
+        self._setup_id_index(coll)
+        self._setup_external_key_index(coll)
+        archive = self.get_collection(_COL_ARCHIVE)
+        for index in _ARCHIVE_UNIQUE_INDEXES:
+            archive.create_index(index, unique=True)
+        for index in _ARCHIVE_SPARSE_INDEXES:
+            archive.create_index(index, sparse=True)
+        counts = self.get_collection(_COL_UNSEEN_COUNTS)
+        for index in _UNSEEN_COUNT_INDEXES:
+            counts.create_index(index)
+        if self.cfg.db_engine == "mongodb-inbox":
+            inbox = self.get_collection(_COL_INBOX)
+            for index in _INBOX_INDEXES:
+                inbox.create_index(index)
+
+    def migrate_indexes(self) -> List[str]:
+        """
+        Drops the indexes on the notifications collection that the current config doesn't
+        use, then creates the ones it does. That's needed to finish switching db-engine or
+        idempotent-writes, since the indexes those want are on the same keys as the ones they
+        replace, and the two can't both be there. Run by python -m feeds.migrate indexes,
+        once all the servers are on the new config.
+        Returns the names of the dropped indexes.
+        """
+        coll = self.get_collection(_COL_NOTIFICATIONS)
+        keep = [self._id_index_name(), self._external_key_index_name()]
+        unused = _OLD_ID_INDEXES + [_LEGACY_ID_INDEX, _EXTERNAL_KEY_SPARSE, _EXTERNAL_KEY_UNIQUE]
+        dropped = list()
+        for name in unused:
+            if name in keep or name not in coll.index_information():
+                continue
+            try:
+                coll.drop_index(name)
+                dropped.append(name)
+            except OperationFailure:
+                pass  # another one got there first
+        self._setup_indexes()
+        return dropped
+
+    def _id_index_name(self) -> str:
+        return "id_1" if self.cfg.db_engine == "mongodb-inbox" else _LEGACY_ID_INDEX
+
+    def _external_key_index_name(self) -> str:
+        return _EXTERNAL_KEY_UNIQUE if self.cfg.idempotent_writes else _EXTERNAL_KEY_SPARSE
+
+    def _setup_id_index(self, coll):
+        """
+        The default engine gets the legacy id index. The inbox engine needs the whole id
+        index.
+        """
+        if self.cfg.db_engine == "mongodb-inbox":
+            self._create_index(coll, [("id", ASCENDING)], "id_1")
+        else:
+            self._create_index(coll, [("id", ASCENDING)], _LEGACY_ID_INDEX,
+                               partialFilterExpression=_LEGACY_ID_FILTER)
+
+    def _setup_external_key_index(self, coll):
+        """
+        The unique external key index when idempotent-writes is on, or the sparse one when
+        it's off. If there are duplicates stored, the unique index can't be built, so this
+        logs that and makes the sparse one.
+        """
+        if self.cfg.idempotent_writes:
+            try:
+                if self._create_index(coll, _EXTERNAL_KEY_INDEX, _EXTERNAL_KEY_UNIQUE,
+                                      unique=True, partialFilterExpression=_EXTERNAL_KEY_FILTER):
+                    return
+            except OperationFailure as e:
+                if e.code != 11000:
+                    raise
+                log.log(__name__, "Can't make the external key index unique while there are "
+                        "duplicate notes stored: %s", e, level=logging.ERROR)
+        self._create_index(coll, _EXTERNAL_KEY_INDEX, _EXTERNAL_KEY_SPARSE, sparse=True)
+
+    def _create_index(self, coll, keys: list, name: str, **options) -> bool:
+        """
+        Creates the index, unless a different index on the same keys is already there - the
+        two can't both be, so it's left in place until migrate_indexes drops it. Returns
+        True if the index is there.
+        """
+        for other, info in coll.index_information().items():
+            if other != name and [tuple(k) for k in info["key"]] == keys:
+                log.log(__name__, "Not making index %s, since %s is on the same keys. Run "
+                        "python -m feeds.migrate indexes to replace it.", name, other,
+                        level=logging.WARNING)
+                return False
+        coll.create_index(keys, name=name, **options)
+        return True
 
     def _setup_schema(self):
         pass
@@ -0,0 +1,44 @@
+from typing import List
+from pymongo import UpdateOne
+from pymongo.errors import PyMongoError
+from ..base import FeedVersionStorage
+from .connection import get_feed_versions_collection
+from feeds.entity.entity import Entity
+from feeds.logger import log_error
+
+"""
+Feed versions are kept in their own collection, one small document per user:
+{
+    "_id": str(Entity) - e.g. "user::wjriehl",
+    "version": int, incremented with each write to that user's feed
+}
+A user without a document is at version 0.
+"""
+
+
+class MongoFeedVersionStorage(FeedVersionStorage):
+    def bump(self, users: List[Entity]) -> None:
+        """
+        Increments the feed version of each of the given users, in one bulk write.
+        Failures are logged, not raised, so they don't fail the write that caused them.
+        """
+        updates = [
+            UpdateOne({"_id": str(u)}, {"$inc": {"version": 1}}, upsert=True)
+            for u in set(users)
+        ]
+        if not updates:
+            return
+        try:
+            get_feed_versions_collection().bulk_write(updates, ordered=False)
+        except PyMongoError as e:
+            log_error(__name__, e)
+
+    def get_versions(self, users: List[Entity]) -> List[int]:
+        """
+        Returns the current feed version of each of the given users, in order.
+        """
+        coll = get_feed_versions_collection()
+        versions = dict()
+        for doc in coll.find({"_id": {"$in": [str(u) for u in users]}}):
+            versions[doc["_id"]] = doc["version"]
+        return [versions.get(str(u), 0) for u in users]
@@ -0,0 +1,154 @@
+from typing import (
+    List,
+    Dict,
+    Tuple,
+    Optional
+)
+from pymongo.collection import Collection
+from pymongo.errors import DuplicateKeyError
+from ..base import GlobalSeenStorage
+from ..global_seen import (
+    SeenState,
+    EMPTY_STATE,
+    MAX_STATE_RETRIES,
+    is_seen,
+    update_state
+)
+from .connection import (
+    get_feeds_collection,
+    get_global_seen_collection
+)
+from .feed_version_storage import MongoFeedVersionStorage
+from .util import (
+    entity_query,
+    seen_filter_query
+)
+from feeds.util import epoch_ms
+from feeds.exceptions import ActivityStorageError
+from feeds.entity.entity import Entity
+from feeds.notification_level import Level
+from feeds.verbs import Verb
+
+"""
+Each user who has marked any global notification gets a small document with their seen state
+(see feeds/storage/global_seen.py):
+{
+    "_id": str(Entity) - e.g. "user::wjriehl",
+    "hwm": high water mark,
+    "seen": list of ids of notes created after hwm that have been seen anyway,
+    "unseen": list of ids of notes created at or before hwm that are unseen anyway,
+    "version": bumped each time the state is stored, so it's only replaced if it hasn't
+        changed since it was read - states stored before versions were added don't have one
+}
+"""
+
+
+class MongoGlobalSeenStorage(GlobalSeenStorage):
+    def get_seen(self, user: Entity, activities: List[Tuple[str, int]]) -> Dict[str, bool]:
+        """
+        Given a list of (id, created) tuples for global activities, returns a dict mapping
+        from each id to whether the user has seen it.
+        """
+        state = self._get_state(user)
+        return {act_id: is_seen(state, act_id, created) for act_id, created in activities}
+
+    def get_unseen_count(self, user: Entity) -> int:
+        """
+        Returns the number of unexpired global activities the user hasn't seen.
+        """
+        (hwm, seen, unseen) = self._get_state(user)
+        return self._collection().count_documents({
+            "users": entity_query(self.global_feed),
+            "expires": {"$gt": epoch_ms()},
+            "$or": [
+                {"created": {"$gt": hwm}, "id": {"$nin": list(seen)}},
+                {"created": {"$lte": hwm}, "id": {"$in": list(unseen)}}
+            ]
+        })
+
+    def set_seen(self, act_ids: List[str], user: Entity) -> None:
+        self._set_state(act_ids, user, True)
+
+    def set_unseen(self, act_ids: List[str], user: Entity) -> None:
+        self._set_state(act_ids, user, False)
+
+    def set_all_seen(self, user: Entity, level: Level=None, verb: Verb=None, source: str=None,
+                     before: int=None) -> None:
+        """
+        Marks every unexpired global activity that matches the filters (see
+        util.seen_filter_query) as seen for the user. Without any filters, that just moves the
+        user's high water mark up to the newest one.
+        """
+        query = seen_filter_query(level=level, verb=verb, source=source, before=before)
+        query["users"] = entity_query(self.global_feed)
+        curs = self._collection().find(query, projection={"id": 1, "_id": 0})
+        act_ids = [d["id"] for d in curs]
+        if act_ids:
+            self._set_state(act_ids, user, True)
+
+    def _set_state(self, act_ids: List[str], user: Entity, seen: bool) -> None:
+        """
+        Marks the given global activities as seen or unseen for the user, then stores the
+        most compact state that describes all the unexpired global activities. The user's feed
+        gets a new version, as their view of the global feed changed.
+        If the state keeps changing underneath this, an ActivityStorageError gets raised after
+        MAX_STATE_RETRIES tries.
+        """
+        for _ in range(MAX_STATE_RETRIES):
+            (state, version) = self._get_versioned_state(user)
+            (hwm, seen_ids, unseen_ids) = update_state(
+                state, self._get_active_activities(), act_ids, seen
+            )
+            doc = {"hwm": hwm, "seen": list(seen_ids), "unseen": list(unseen_ids),
+                   "version": (version or 0) + 1}
+            if self._store_state(user, doc, version):
+                MongoFeedVersionStorage().bump([user])
+                return
+        raise ActivityStorageError(
+            "Failed to store global seen state for {}: too many concurrent updates".format(user)
+        )
+
+    def _store_state(self, user: Entity, doc: dict, version: Optional[int]) -> bool:
+        """
+        Stores the state doc for the user, as long as the stored one still has the given
+        version (or there still isn't one, if version is None). Returns True if it got stored.
+        """
+        coll = get_global_seen_collection()
+        if version is None:
+            try:
+                coll.insert_one(dict(doc, _id=str(user)))
+                return True
+            except DuplicateKeyError:
+                return False
+        # a version of 0 means the stored state doesn't have one yet
+        result = coll.replace_one({"_id": str(user), "version": version or None}, doc)
+        return result.matched_count == 1
+
+    def _collection(self) -> Collection:
+        """
+        The collection that holds each note along with its recipients.
+        """
+        return get_feeds_collection()
+
+    def _get_state(self, user: Entity) -> SeenState:
+        return self._get_versioned_state(user)[0]
+
+    def _get_versioned_state(self, user: Entity) -> Tuple[SeenState, Optional[int]]:
+        """
+        Returns the user's state along with its version, which is None if there's no stored
+        state.
+        """
+        doc = get_global_seen_collection().find_one({"_id": str(user)})
+        if doc is None:
+            return (EMPTY_STATE, None)
+        return ((doc["hwm"], set(doc["seen"]), set(doc["unseen"])), doc.get("version", 0))
+
+    def _get_active_activities(self) -> List[Tuple[str, int]]:
+        """
+        Returns (id, created) for each unexpired global activity, oldest first.
+        """
+        curs = self._collection().find(
+            {"users": entity_query(self.global_feed), "expires": {"$gt": epoch_ms()}},
+            projection={"id": 1, "created": 1, "_id": 0}
+        ).sort([("created", 1), ("id", 1)])
+        return [(d["id"], d["created"]) for d in curs]
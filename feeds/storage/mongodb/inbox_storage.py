@@ -0,0 +1,257 @@
+from collections import Counter
+from typing import (
+    List,
+    Tuple,
+    Optional
+)
+from pymongo import UpdateOne
+from pymongo.collection import Collection
+from pymongo.errors import PyMongoError
+from .activity_storage import MongoActivityStorage
+from .timeline_storage import MongoTimelineStorage
+from .unseen_count_storage import MongoUnseenCountStorage
+from .global_seen_storage import MongoGlobalSeenStorage
+from .notification_hub import NotificationHub
+from .feed_version_storage import MongoFeedVersionStorage
+from .util import (
+    encode_activity,
+    encode_entity,
+    entity_query,
+    note_id_query
+)
+from ..redis.timeline_cache import (
+    add_to_timeline_caches,
+    clear_timeline_cache
+)
+from .connection import (
+    get_feeds_collection,
+    get_inbox_collection,
+    _COL_NOTIFICATIONS
+)
+from feeds.exceptions import ActivityStorageError
+from feeds.entity.entity import Entity
+from feeds.util import epoch_ms
+
+"""
+The mongodb-inbox engine fans notes out when they're written, instead of when they're read.
+
+The default engine keeps one document per note, with every recipient in its users and unseen
+arrays. Those arrays (and the multikey indexes over them) grow with the audience, and
+updating them gets slow for big audiences. Here, each note is stored once in the
+notifications collection, without any recipients, and each recipient gets a small row in the
+inbox collection:
+{
+    "id": note id,
+    "users": [the recipient],
+    "unseen": [the recipient] if they haven't seen it yet, [] otherwise,
+    "created", "expires", "level", "verb", "source", "actor", "object", "target": copied from
+        the note, so timelines can be filtered and sorted without touching the notes.
+}
+A row looks just like a note with a single recipient, so all the queries and updates that
+the default engine runs against notes work the same against rows, and the classes here only
+have to point them at the inbox, store things in two places, and join the note back onto
+each row when reading. Rows written before source was copied onto them don't match a source
+filter (see MongoActivityStorage.set_all_seen).
+"""
+
+_ROW_FIELDS = ["id", "created", "expires", "level", "verb", "source", "actor", "object",
+               "target"]
+
+
+class MongoInboxActivityStorage(MongoActivityStorage):
+    def add_to_storage(self, activity, target_users: List[Entity]) -> None:
+        """
+        Stores the activity once, then adds a row for it to each target user's inbox.
+        Raises an ActivityStorageError if it fails.
+        Idempotent activities are handled the same as in MongoActivityStorage. If one matches
+        a stored one, it's a retry, and storing the rows might have failed the first time - so
+        any rows that are missing get added then (see _add_missing_rows).
+        """
+        act_doc = self._note_doc(activity, target_users)
+        if not self._store_note(act_doc, activity):
+            self._add_missing_rows([(activity, target_users)])
+            return
+        rows = self._rows(act_doc, target_users)
+        try:
+            if rows:
+                get_inbox_collection().insert_many(rows, ordered=False)
+        except PyMongoError as e:
+            raise ActivityStorageError("Failed to store activity: " + str(e))
+        MongoInboxUnseenCountStorage().increment(set(target_users))
+        MongoFeedVersionStorage().bump(target_users)
+        add_to_timeline_caches(activity, target_users)
+
+    def add_many_to_storage(self, activities: List[Tuple[object, List[Entity]]]
+                            ) -> List[Optional[str]]:
+        """
+        Stores the activities with a single insert_many, then adds the inbox rows for all the
+        ones that got stored with another one. Any that were retries get their missing rows
+        added, like in add_to_storage.
+        """
+        if not activities:
+            return []
+        docs = [self._note_doc(activity, users) for activity, users in activities]
+        failures = self._insert_many(get_feeds_collection(), docs)
+        stored = [f is None for f in failures]
+        rows = list()
+        for doc, (activity, users), is_stored in zip(docs, activities, stored):
+            if is_stored:
+                rows.extend(self._rows(doc, users))
+        if rows:
+            try:
+                get_inbox_collection().insert_many(rows, ordered=False)
+            except PyMongoError as e:
+                raise ActivityStorageError("Failed to store activities: " + str(e))
+        errors = self._resolve_failures([a for a, users in activities], failures)
+        self._after_add_many(activities, stored)
+        self._add_missing_rows([a for a, is_stored, error in zip(activities, stored, errors)
+                                if not is_stored and error is None])
+        return errors
+
+    def _add_missing_rows(self, activities: List[Tuple[object, List[Entity]]]) -> None:
+        """
+        Upserts the inbox rows for activities that matched stored ones, given as (activity,
+        target users) tuples, with their ids already set to the stored ones. Rows are made
+        from the stored activities, and only the users who didn't have one yet get counted.
+        Raises an ActivityStorageError if it fails.
+        """
+        if not activities:
+            return
+        try:
+            stored = {doc["id"]: doc for doc in get_feeds_collection().find(
+                note_id_query([a.id for a, users in activities])
+            )}
+            updates = list()
+            added = list()
+            for activity, users in activities:
+                if activity.id not in stored:
+                    continue
+                for user in set(users):
+                    updates.append(UpdateOne(
+                        {"id": activity.id, "users": entity_query(user)},
+                        {"$setOnInsert": self._row(stored[activity.id], user)},
+                        upsert=True
+                    ))
+                    added.append(user)
+            if not updates:
+                return
+            result = get_inbox_collection().bulk_write(updates, ordered=False)
+        except PyMongoError as e:
+            raise ActivityStorageError("Failed to store activities: " + str(e))
+        counts = Counter(added[idx] for idx in result.upserted_ids)
+        if not counts:
+            return
+        MongoInboxUnseenCountStorage().adjust(dict(counts))
+        MongoFeedVersionStorage().bump(list(counts))
+        # the cached copies would be of the retry, not the stored activity
+        for user in counts:
+            clear_timeline_cache(user)
+
+    def _note_doc(self, activity, target_users: List[Entity]) -> dict:
+        act_doc = encode_activity(activity.to_dict())
+        act_doc.pop("users", None)
+        act_doc["_id"] = activity.id
+        return act_doc
+
+    @classmethod
+    def _rows(cls, act_doc: dict, target_users: List[Entity]) -> List[dict]:
+        return [cls._row(act_doc, user) for user in set(target_users)]
+
+    @staticmethod
+    def _row(act_doc: dict, user: Entity) -> dict:
+        row = {k: act_doc.get(k) for k in _ROW_FIELDS}
+        row["users"] = [encode_entity(user)]
+        row["unseen"] = [encode_entity(user)]
+        return row
+
+    def expire_notifications(self, act_ids: List[str]) -> None:
+        """
+        Expires the inbox rows (which also fixes up counts and feed versions), then the
+        stored activities themselves.
+        """
+        super().expire_notifications(act_ids)
+        get_feeds_collection().update_many(note_id_query(act_ids), {
+            '$set': {'expires': epoch_ms()}
+        })
+
+    def expire_by_id_or_external_key(self, act_ids: List[str], external_keys: List[str],
+                                     source: str=None) -> Tuple[List[str], List[str]]:
+        """
+        Rows don't have external keys, so the stored activities get looked up first, reading
+        only their ids and external keys, then expired by id.
+        """
+        found = list(get_feeds_collection().find(
+            self._expire_query(act_ids, external_keys, source),
+            projection={'_id': 0, 'id': 1, 'external_key': 1}
+        ))
+        if found:
+            self.expire_notifications([d['id'] for d in found])
+        return self._expired_keys(found, act_ids, external_keys, source)
+
+    def archive_expired(self, before: int, batch_size: int) -> List[str]:
+        """
+        Archives the stored activities the same as the default engine, then removes their
+        inbox rows. The archived activities don't keep their recipients.
+        """
+        act_ids = super().archive_expired(before, batch_size)
+        if act_ids:
+            get_inbox_collection().delete_many({'id': {'$in': act_ids}})
+        return act_ids
+
+    def _collection(self) -> Collection:
+        return get_inbox_collection()
+
+    def _id_query(self, act_ids: List[str]) -> dict:
+        # rows have their own _ids, so they're always found by the note id.
+        return {'id': {'$in': act_ids}}
+
+
+class MongoInboxTimelineStorage(MongoTimelineStorage):
+    def _collection(self) -> Collection:
+        return get_inbox_collection()
+
+    def _id_query(self, note_ids: List[str]) -> dict:
+        return {"id": {"$in": note_ids}}
+
+    def _unseen_counts(self) -> MongoUnseenCountStorage:
+        return MongoInboxUnseenCountStorage()
+
+    def _reader_stages(self) -> List[dict]:
+        """
+        Joins each row with its stored note, then does the same as the default engine. Fields
+        from the row win over those from the note.
+        """
+        return [
+            {"$lookup": {
+                "from": _COL_NOTIFICATIONS,
+                "localField": "id",
+                "foreignField": "id",
+                "as": "note"
+            }},
+            {"$replaceRoot": {"newRoot": {
+                "$mergeObjects": [{"$arrayElemAt": ["$note", 0]}, "$$ROOT"]
+            }}},
+            {"$project": {"note": 0}}
+        ] + super()._reader_stages()
+
+
+class MongoInboxUnseenCountStorage(MongoUnseenCountStorage):
+    def _collection(self) -> Collection:
+        return get_inbox_collection()
+
+
+class MongoInboxGlobalSeenStorage(MongoGlobalSeenStorage):
+    def _collection(self) -> Collection:
+        return get_inbox_collection()
+
+
+class MongoInboxNotificationHub(NotificationHub):
+    def _collection(self) -> Collection:
+        return get_inbox_collection()
+
+    def _full_note(self, doc: dict) -> dict:
+        note = get_feeds_collection().find_one({"id": doc["id"]})
+        if note is None:
+            return doc
+        note.update(doc)
+        return note
@@ -0,0 +1,32 @@
+from pymongo.errors import DuplicateKeyError
+from ..base import LeaseStorage
+from .connection import get_leases_collection
+from feeds.util import epoch_ms
+
+"""
+Leases are kept in their own collection, one small document per lease:
+{
+    "_id": name of the lease, e.g. "archiver",
+    "owner": whoever holds it,
+    "expires": time (ms since epoch) the lease runs out
+}
+"""
+
+
+class MongoLeaseStorage(LeaseStorage):
+    def acquire(self, name: str, owner: str, duration: int) -> bool:
+        """
+        Takes the named lease for owner, for duration ms, if nobody else holds it. The current
+        owner can call this again to renew it. Returns True if owner holds the lease now.
+        """
+        now = epoch_ms()
+        try:
+            get_leases_collection().update_one(
+                {"_id": name, "$or": [{"owner": owner}, {"expires": {"$lte": now}}]},
+                {"$set": {"owner": owner, "expires": now + duration}},
+                upsert=True
+            )
+        except DuplicateKeyError:
+            # someone else holds it, so the upsert tried to make a second copy.
+            return False
+        return True
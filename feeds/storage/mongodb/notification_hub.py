@@ -0,0 +1,182 @@
+import queue
+import threading
+import time
+from collections import defaultdict
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    Set
+)
+from pymongo.errors import PyMongoError
+from pymongo.collection import Collection
+from .connection import get_feeds_collection
+from feeds.entity.entity import Entity
+from feeds.config import get_config
+from feeds.logger import (
+    log,
+    log_error
+)
+
+"""
+Fans a single MongoDB change stream on the notifications collection out to any number of
+subscribers in this process.
+
+Each subscriber is a queue for one user. Whenever a notification in that user's feed is
+inserted or changed (seen, unseen, expired), a ChangeEvent gets put on the queue. Changes to
+global notifications go to everyone. Every subscriber gets the same ChangeEvent, so anything
+they'd all work out from it only gets worked out once (see ChangeEvent.shared).
+
+Only stdlib threading and queue primitives are used here, so under gunicorn's gevent worker
+(which monkey-patches them) the watcher is a greenlet, and waiting subscribers just park on
+their queues without holding on to a thread or a poll loop each. The watcher only runs while
+there are subscribers.
+
+Change streams need MongoDB to run as a replica set (a single node set is fine).
+"""
+
+SUBSCRIBER_QUEUE_SIZE = 100
+MAX_AWAIT_TIME_MS = 1000
+RETRY_WAIT = 5  # seconds
+
+_CHANGE_PIPELINE = [
+    {"$match": {"operationType": {"$in": ["insert", "update", "replace"]}}}
+]
+
+
+class ChangeEvent(object):
+    def __init__(self, change: str, doc: dict, is_global: bool):
+        """
+        :param change: "insert" or "update"
+        :param doc: the notification document
+        :param is_global: True if it's a global notification
+        """
+        self.change = change
+        self.doc = doc
+        self.is_global = is_global
+        self._shared = dict()
+        self._lock = threading.Lock()
+
+    def shared(self, make: Callable[[dict], Any]) -> Any:
+        """
+        Returns make(doc), but only calls it for the first subscriber that asks. The others
+        wait for that, then get the same result.
+        """
+        with self._lock:
+            if make not in self._shared:
+                self._shared[make] = make(self.doc)
+            return self._shared[make]
+
+
+class NotificationHub(object):
+    def __init__(self):
+        cfg = get_config()
+        self.global_feed = str(Entity(cfg.global_feed, cfg.global_feed_type))
+        self._subscribers: Dict[str, Set[queue.Queue]] = defaultdict(set)
+        self._lock = threading.Lock()
+        self._watcher = None
+        self._resume_token = None
+
+    def subscribe(self, user: Entity) -> queue.Queue:
+        """
+        Returns a new queue that gets change events for the user's feed. Make sure to
+        unsubscribe it when done.
+        If a subscriber falls more than SUBSCRIBER_QUEUE_SIZE events behind, newer events
+        are dropped for it until it catches up.
+        """
+        q = queue.Queue(maxsize=SUBSCRIBER_QUEUE_SIZE)
+        with self._lock:
+            self._subscribers[str(user)].add(q)
+            if self._watcher is None:
+                self._watcher = threading.Thread(target=self._watch, daemon=True)
+                self._watcher.start()
+        return q
+
+    def unsubscribe(self, user: Entity, q: queue.Queue) -> None:
+        with self._lock:
+            subs = self._subscribers.get(str(user))
+            if subs is None:
+                return
+            subs.discard(q)
+            if not subs:
+                del self._subscribers[str(user)]
+
+    def _has_subscribers(self) -> bool:
+        with self._lock:
+            return len(self._subscribers) > 0
+
+    def _keep_watching(self) -> bool:
+        """
+        Decides, under the lock, whether the watcher should keep going. If it stops, it's
+        cleared here so the next subscriber starts a new one.
+        """
+        with self._lock:
+            if self._subscribers:
+                return True
+            self._watcher = None
+            self._resume_token = None
+            return False
+
+    def _watch(self) -> None:
+        """
+        Follows the change stream until there's nobody left to tell about it.
+        pymongo already resumes the stream after transient errors, so if it fails anyway (e.g.
+        the resume point fell off the oplog), it gets reopened from the present after
+        RETRY_WAIT seconds.
+        """
+        log(__name__, "Starting notification change stream")
+        while self._keep_watching():
+            try:
+                with self._collection().watch(
+                    _CHANGE_PIPELINE,
+                    full_document="updateLookup",
+                    resume_after=self._resume_token,
+                    max_await_time_ms=MAX_AWAIT_TIME_MS
+                ) as stream:
+                    while stream.alive and self._has_subscribers():
+                        change = stream.try_next()
+                        self._resume_token = stream.resume_token
+                        if change is not None:
+                            self._publish(change)
+            except PyMongoError as e:
+                log_error(__name__, e)
+                self._resume_token = None
+                time.sleep(RETRY_WAIT)
+        log(__name__, "Stopping notification change stream")
+
+    def _publish(self, change: dict) -> None:
+        doc = change.get("fullDocument")
+        if doc is None:
+            # it's gone since the change was made, nothing to tell anyone.
+            return
+        users = [str(Entity.from_stored(u)) for u in doc.get("users", [])]
+        is_global = self.global_feed in users
+        with self._lock:
+            if is_global:
+                targets = [q for subs in self._subscribers.values() for q in subs]
+            else:
+                targets = [q for u in users for q in self._subscribers.get(u, [])]
+        if not targets:
+            return
+        event = ChangeEvent(
+            "insert" if change["operationType"] == "insert" else "update",
+            self._full_note(doc),
+            is_global
+        )
+        for q in targets:
+            try:
+                q.put_nowait(event)
+            except queue.Full:
+                pass
+
+    def _collection(self) -> Collection:
+        """
+        The collection that holds each note along with its recipients.
+        """
+        return get_feeds_collection()
+
+    def _full_note(self, doc: dict) -> dict:
+        """
+        Returns the whole note for a changed document from _collection.
+        """
+        return doc
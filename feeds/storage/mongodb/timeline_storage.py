@@ -1,13 +1,31 @@
 import pymongo
+from pymongo.collection import Collection
+from redis.exceptions import RedisError
 from ..base import TimelineStorage
+from ..redis.timeline_cache import (
+    get_timeline_cache,
+    TimelineCache,
+    CACHE_SIZE
+)
 from .connection import get_feeds_collection
+from .unseen_count_storage import MongoUnseenCountStorage
+from .feed_version_storage import MongoFeedVersionStorage
+from .util import (
+    entity_forms,
+    entity_query,
+    note_id_query
+)
 from feeds.util import epoch_ms
+from feeds.logger import log_error
 from feeds.activity.base import BaseActivity
 from feeds.notification_level import Level
 from feeds.verbs import Verb
+from feeds.entity.entity import Entity
 from typing import (
     List,
-    Dict
+    Dict,
+    Tuple,
+    Optional
 )
 
 
@@ -20,59 +38,286 @@ class MongoTimelineStorage(TimelineStorage):
         raise NotImplementedError()
 
     def get_timeline(self, count: int=10, include_seen: int=False, level: Level=None,
-                     verb: Verb=None, reverse: bool=False) -> List[dict]:
+                     verb: Verb=None, reverse: bool=False, before: Tuple[int, str]=None,
+                     after: Tuple[int, str]=None, entity: Entity=None) -> List[dict]:
         """
         :param count: int > 0
         :param include_seen: boolean
         :param level: Level or None
         :param verb: Verb or None
+        :param before: (created, id) tuple or None - if present, only returns notes that
+            come strictly before that position in the feed (i.e. are older)
+        :param after: (created, id) tuple or None - if present, only returns notes that
+            come strictly after that position in the feed (i.e. are newer)
+        :param entity: Entity or None - if present, only returns notes that reference that
+            Entity as their actor, object, or one of their targets
+        If there's a timeline cache, the newest part of the timeline gets read from there.
+        """
+        timeline = self._get_cached_timeline(count, include_seen, level, verb, reverse,
+                                             before, after, entity)
+        if timeline is None:
+            timeline = self._query_timeline(count, include_seen, level, verb, reverse, before,
+                                            after, entity)
+        return timeline
+
+    def _query_timeline(self, count: int, include_seen: bool, level: Level, verb: Verb,
+                        reverse: bool, before: Tuple[int, str], after: Tuple[int, str],
+                        entity: Entity) -> List[dict]:
+        """
+        Reads the timeline from the database. Parameters are the same as get_timeline.
+        The pipeline starts with $match, $sort, and $limit, which the database runs as a
+        single indexed query, so only the page gets read - the reader stages come after.
+        """
+        coll = self._collection()
+        query = self._active_query(entity)
+        query.update(self._filter_query(include_seen, level, verb, before, after))
+        pipeline = [
+            {"$match": query},
+            {"$sort": dict(self._sort_order(reverse))},
+            {"$limit": count}
+        ] + self._reader_stages()
+        serial_notes = [note for note in coll.aggregate(pipeline)]
+        return serial_notes
+
+    def get_timeline_and_unseen_count(self, count: int=10, include_seen: int=False,
+                                      level: Level=None, verb: Verb=None, reverse: bool=False,
+                                      before: Tuple[int, str]=None, after: Tuple[int, str]=None,
+                                      entity: Entity=None) -> Tuple[List[dict], int]:
+        """
+        Does the work of both get_timeline and get_unseen_count.
+        Parameters are the same as get_timeline. Filters only apply to the timeline, not the
+        unseen count, except for entity - that narrows both down to the notes that reference
+        the Entity. Without one, the unseen count is the stored count (see
+        get_unseen_count). With one, it's counted from the notes, since only whole timelines
+        have stored counts.
+        Returns a tuple of (timeline, unseen count).
+        """
+        timeline = self.get_timeline(count=count, include_seen=include_seen, level=level,
+                                     verb=verb, reverse=reverse, before=before, after=after,
+                                     entity=entity)
+        if entity is None:
+            return (timeline, self.get_unseen_count())
+        return (timeline, self._count_unseen(entity))
+
+    def get_group_timelines(self, group_ids: List[str], count: int=10, include_seen: int=False,
+                            level: Level=None, verb: Verb=None,
+                            reverse: bool=False) -> Dict[str, Tuple[List[dict], int]]:
+        """
+        Fetches the timelines for several groups at once. A group's timeline is made of the
+        user's notes that reference that group as their actor, object, or one of their targets.
+        Each group gets its own indexed query, and its own count, so no group's notes have
+        to be read to get another group's page.
+        Filters are the same as get_timeline, and are applied separately for each group, so
+        each one gets up to count notes. As with get_timeline_and_unseen_count, filters don't
+        apply to the unseen counts.
+        Returns a dict mapping from group id to a (timeline, unseen count) tuple.
+        """
+        timelines = dict()
+        for g_id in group_ids:
+            group = Entity(g_id, "group")
+            timelines[g_id] = (
+                self._query_timeline(count, include_seen, level, verb, reverse, None, None,
+                                     group),
+                self._count_unseen(group)
+            )
+        return timelines
+
+    def get_single_activity_from_timeline(self, note_id: str) -> dict:
+        coll = self._collection()
+        query = dict(self._id_query([note_id]), users=self._user_query())
+        pipeline = [{"$match": query}, {"$limit": 1}] + self._reader_stages()
+        return next(coll.aggregate(pipeline), None)
+
+    def get_ids_in_timeline(self, note_ids: List[str]) -> List[str]:
+        """
+        Returns the ones of the given note ids that are in the user's timeline, with a single
+        find that only reads their ids.
+        """
+        if not note_ids:
+            return []
+        query = dict(self._id_query(note_ids), users=self._user_query())
+        return [d["id"] for d in self._collection().find(query, projection={"id": 1, "_id": 0})]
+
+    def get_unseen_count(self) -> int:
+        """
+        Returns the number of unseen, unexpired notes for the user, from the timeline cache if
+        it's there, or the stored counts.
+        """
+        cache = get_timeline_cache(self.user)
+        if cache is None:
+            return self._unseen_counts().get_counts([self.user])[0]
+        try:
+            count = cache.get_unseen_count()
+            if count is None:
+                version = self._feed_version()
+                count = self._unseen_counts().get_counts([self.user])[0]
+                cache.set_unseen_count(count)
+                self._check_cache_version(cache, version)
+            return count
+        except RedisError as e:
+            log_error(__name__, e)
+            return self._unseen_counts().get_counts([self.user])[0]
+
+    def get_unseen_counts(self, others: List[Entity]) -> List[int]:
+        """
+        Returns the unseen count for this timeline's user, followed by the unseen counts for
+        each of the others, in order. These come from the stored counts in a single lookup.
+        """
+        return self._unseen_counts().get_counts([self.user] + others)
+
+    def _collection(self) -> Collection:
+        """
+        The collection that holds each note along with its recipients.
+        """
+        return get_feeds_collection()
+
+    def _count_unseen(self, entity: Entity) -> int:
+        """
+        Counts the user's unseen, unexpired notes that reference the Entity, with an indexed
+        count that doesn't read the notes.
+        """
+        query = dict(self._active_query(entity), unseen=self._user_query())
+        return self._collection().count_documents(query)
+
+    def _get_cached_timeline(self, count: int, include_seen: bool, level: Level, verb: Verb,
+                             reverse: bool, before: Tuple[int, str], after: Tuple[int, str],
+                             entity: Entity) -> Optional[List[dict]]:
+        """
+        Tries to read the timeline from the timeline cache, filling the cache first if the
+        user isn't in it. Only the newest notes are cached, so this only works when reading
+        from the newest end, optionally paging back with before, and without an entity filter.
+        Returns None if the timeline has to come from the database instead.
+        """
+        cache = get_timeline_cache(self.user)
+        if cache is None or reverse or count > CACHE_SIZE:
+            return None
+        if after is not None or entity is not None:
+            return None
+        try:
+            timeline = cache.get_timeline(count, include_seen, level, verb, before)
+            if timeline is None and not cache.is_filled():
+                self._fill_cache(cache)
+                timeline = cache.get_timeline(count, include_seen, level, verb, before)
+            return timeline
+        except RedisError as e:
+            log_error(__name__, e)
+            return None
+
+    def _fill_cache(self, cache: TimelineCache) -> None:
+        version = self._feed_version()
+        recent = self._query_timeline(CACHE_SIZE, True, None, None, False, None, None, None)
+        count = self._unseen_counts().get_counts([self.user])[0]
+        cache.fill(recent, len(recent) < CACHE_SIZE, count)
+        self._check_cache_version(cache, version)
+
+    def _check_cache_version(self, cache: TimelineCache, version: int) -> None:
+        """
+        Writes go to the database, then bump the feed version, then update the cache, but
+        only for users who are already cached. So if the feed version changed since the cache
+        was read from the database, the cache might have missed that write, and gets dropped.
+        """
+        if self._feed_version() != version:
+            cache.clear()
+
+    def _feed_version(self) -> int:
+        return MongoFeedVersionStorage().get_versions([self.user])[0]
+
+    def _unseen_counts(self) -> MongoUnseenCountStorage:
+        return MongoUnseenCountStorage()
+
+    def _active_query(self, entity: Entity=None) -> dict:
+        """
+        The base query for a timeline - all the user's notes that haven't expired yet.
+        If entity is given, this is narrowed down to the notes that reference it.
         """
-        coll = get_feeds_collection()
-        now = epoch_ms()
         query = {
-            "users": self._user_doc(),
-            "expires": {"$gt": now}
+            "users": self._user_query(),
+            "expires": {"$gt": epoch_ms()}
         }
+        if entity is not None:
+            query["$or"] = self._entity_reference_query([entity])
+        return query
+
+    def _filter_query(self, include_seen: bool, level: Level, verb: Verb,
+                      before: Tuple[int, str], after: Tuple[int, str]) -> dict:
+        """
+        Builds the part of a timeline query that comes from the optional filters.
+        """
+        query = dict()
         if not include_seen:
-            query['unseen'] = self._user_doc()
+            query['unseen'] = self._user_query()
         if level is not None:
             query['level'] = level.id
         if verb is not None:
             query['verb'] = verb.id
+        keyset = list()
+        if before is not None:
+            keyset.append(self._keyset_query(before, "$lt"))
+        if after is not None:
+            keyset.append(self._keyset_query(after, "$gt"))
+        if keyset:
+            query['$and'] = keyset
+        return query
+
+    def _reader_stages(self) -> List[dict]:
+        """
+        Aggregation stages that turn stored notes into what this timeline's user gets to read.
+        The seen flag is computed for the user from the unseen list (whichever form the user
+        is stored in), then the users and unseen lists are dropped. Those can hold hundreds of
+        entries for notes with a big audience, so leaving them in the database keeps reads the
+        same size no matter who else gets a note.
+        """
+        unseen = {"$ifNull": ["$unseen", []]}
+        return [
+            {"$addFields": {
+                "seen": {"$not": [{"$or": [
+                    {"$in": [{"$literal": form}, unseen]} for form in entity_forms([self.user])
+                ]}]}
+            }},
+            {"$project": {"users": 0, "unseen": 0}}
+        ]
+
+    def _entity_reference_query(self, entities: List[Entity]) -> List[dict]:
+        """
+        Returns the clauses for an $or query that matches notes referencing any of the given
+        Entities as their actor, object, or one of their targets.
+        Each clause is backed by its own index, so the database can serve these with an
+        index union instead of scanning the whole user timeline.
+        """
+        forms = entity_forms(entities)
+        return [
+            {"actor": {"$in": forms}},
+            {"object": {"$in": forms}},
+            {"target": {"$in": forms}}
+        ]
+
+    def _sort_order(self, reverse: bool) -> List[Tuple[str, int]]:
         order = pymongo.DESCENDING
         if reverse:
             order = pymongo.ASCENDING
-        timeline = coll.find(query).sort("created", order).limit(count)
-        serial_notes = [note for note in timeline]
-        return serial_notes
+        return [("created", order), ("id", order)]
 
-    def get_single_activity_from_timeline(self, note_id: str) -> dict:
-        coll = get_feeds_collection()
-        query = {
-            "id": note_id,
-            "users": self._user_doc()
+    def _keyset_query(self, position: Tuple[int, str], op: str) -> dict:
+        """
+        Builds the query part that limits a timeline to notes on one side of a
+        (created, id) position. op should be either "$lt" or "$gt".
+        """
+        (created, note_id) = position
+        return {
+            "$or": [
+                {"created": {op: created}},
+                {"created": created, "id": {op: note_id}}
+            ]
         }
-        note_serial = coll.find_one(query)
-        if note_serial is None:
-            return None
-        if self.user.to_dict() in note_serial['unseen']:
-            note_serial['seen'] = False
-        else:
-            note_serial['seen'] = True
-        return note_serial
 
-    def get_unseen_count(self) -> int:
-        coll = get_feeds_collection()
-        now = epoch_ms()
-        query = {
-            "users": self._user_doc(),
-            "unseen": self._user_doc(),
-            "expires": {"$gt": now}
-        }
-        return coll.count_documents(query)
+    def _id_query(self, note_ids: List[str]) -> dict:
+        """
+        A query that matches the documents in _collection() for the given note ids.
+        """
+        return note_id_query(note_ids)
 
-    def _user_doc(self) -> Dict[str, str]:
-        return {
-            "id": self.user_id,
-            "type": self.user_type
-        }
+    def _user_query(self) -> dict:
+        """
+        A query clause that matches this timeline's user in either stored form.
+        """
+        return entity_query(self.user)
@@ -0,0 +1,162 @@
+from typing import (
+    List,
+    Dict
+)
+from pymongo import UpdateOne
+from pymongo.errors import PyMongoError
+from pymongo.collection import Collection
+from ..base import UnseenCountStorage
+from .connection import (
+    get_feeds_collection,
+    get_unseen_counts_collection
+)
+from .util import entity_forms
+from feeds.util import epoch_ms
+from feeds.entity.entity import Entity
+from feeds.logger import log_error
+
+"""
+Unseen counts are kept in their own collection, one small document per user:
+{
+    "_id": str(Entity) - e.g. "user::wjriehl",
+    "count": number of unseen, unexpired notifications for that user,
+    "reconciled": time (ms since epoch) the count was last recomputed from the notifications,
+        or 0 if it never has been,
+    "touched": time the count was last adjusted or read since it was reconciled, if it has
+        been
+}
+The count is bumped as notifications are added, seen, unseen, and expired, so reading it is a
+single lookup. Notifications that expire on their own don't trigger any writes, and a failed
+adjustment shouldn't fail the write it goes along with, so counts can drift. To fix that, the
+background jobs (see feeds/managers/archive_manager.py) recompute the touched counts that
+haven't been reconciled for RECONCILE_INTERVAL ms, with reconcile_stale. Counts nobody adjusts
+or reads are left alone, so that work goes with how many users are active, not how many have
+counts. Reads never wait on it, except for a count that's never been reconciled at all - an
+adjustment can create a count before that, without knowing the notifications it's missing.
+"""
+
+RECONCILE_INTERVAL = 5 * 60 * 1000
+
+
+class MongoUnseenCountStorage(UnseenCountStorage):
+    def increment(self, users: List[Entity], amount: int=1) -> None:
+        """
+        Adds amount (which can be negative) to the unseen count of each of the given users.
+        """
+        self.adjust({u: amount for u in users})
+
+    def adjust(self, amounts: Dict[Entity, int]) -> None:
+        """
+        Adds each amount to the unseen count of the Entity it's mapped to, in one bulk write.
+        Failures are logged, not raised - reconciliation will catch up with them later.
+        """
+        now = epoch_ms()
+        updates = [
+            UpdateOne(
+                {"_id": str(user)},
+                # new counts get computed the first time they're read
+                {
+                    "$inc": {"count": amount},
+                    "$set": {"touched": now},
+                    "$setOnInsert": {"reconciled": 0}
+                },
+                upsert=True
+            ) for user, amount in amounts.items() if amount != 0
+        ]
+        if not updates:
+            return
+        try:
+            get_unseen_counts_collection().bulk_write(updates, ordered=False)
+        except PyMongoError as e:
+            log_error(__name__, e)
+
+    def get_counts(self, users: List[Entity]) -> List[int]:
+        """
+        Returns the unseen counts for each of the given users, in order. Any counts that are
+        missing, or have never been reconciled, get computed first. Counts that are due for
+        reconciling get marked as touched, so reconcile_stale picks them up.
+        """
+        coll = get_unseen_counts_collection()
+        stale_after = epoch_ms() - RECONCILE_INTERVAL
+        counts = dict()
+        untouched = list()
+        for doc in coll.find({"_id": {"$in": [str(u) for u in users]}}):
+            if not doc.get("reconciled"):
+                continue
+            counts[doc["_id"]] = doc["count"]
+            if doc["reconciled"] < stale_after and "touched" not in doc:
+                untouched.append(doc["_id"])
+        missing = [u for u in users if str(u) not in counts]
+        if missing:
+            counts.update(self.reconcile(missing))
+        if untouched:
+            self._touch(untouched)
+        return [max(counts[str(u)], 0) for u in users]
+
+    def _touch(self, user_keys: List[str]) -> None:
+        """
+        Marks the counts with the given _ids as touched. Failures are logged, not raised.
+        """
+        try:
+            get_unseen_counts_collection().update_many(
+                {"_id": {"$in": user_keys}, "touched": {"$exists": False}},
+                {"$set": {"touched": epoch_ms()}}
+            )
+        except PyMongoError as e:
+            log_error(__name__, e)
+
+    def reconcile_stale(self, batch_size: int) -> int:
+        """
+        Reconciles up to batch_size of the touched counts that haven't been reconciled for
+        RECONCILE_INTERVAL ms. Returns the number of reconciled counts. If there are fewer
+        than batch_size of them, there's nothing left to reconcile.
+        """
+        stale_after = epoch_ms() - RECONCILE_INTERVAL
+        docs = get_unseen_counts_collection().find(
+            {"touched": {"$gt": 0}, "reconciled": {"$lt": stale_after}}, {"_id": 1}
+        ).limit(batch_size)
+        users = [Entity.from_str(doc["_id"]) for doc in docs]
+        if users:
+            self.reconcile(users)
+        return len(users)
+
+    def reconcile(self, users: List[Entity]) -> Dict[str, int]:
+        """
+        Recomputes the unseen counts for the given users by counting over the notifications
+        collection, and stores them. They stay touched if they were adjusted after the
+        counting started. Returns a dict mapping from str(user) to count.
+        """
+        now = epoch_ms()
+        user_docs = entity_forms(users)
+        pipeline = [
+            {"$match": {
+                "users": {"$in": user_docs},
+                "unseen": {"$in": user_docs},
+                "expires": {"$gt": now}
+            }},
+            {"$unwind": "$unseen"},
+            {"$match": {"unseen": {"$in": user_docs}}},
+            {"$group": {"_id": "$unseen", "count": {"$sum": 1}}}
+        ]
+        counts = {str(u): 0 for u in users}
+        for doc in self._collection().aggregate(pipeline):
+            counts[str(Entity.from_stored(doc["_id"]))] += doc["count"]
+        updates = list()
+        for user_key, count in counts.items():
+            updates.append(UpdateOne(
+                {"_id": user_key},
+                {"$set": {"count": count, "reconciled": now}},
+                upsert=True
+            ))
+            updates.append(UpdateOne(
+                {"_id": user_key, "touched": {"$lte": now}},
+                {"$unset": {"touched": ""}}
+            ))
+        get_unseen_counts_collection().bulk_write(updates, ordered=False)
+        return counts
+
+    def _collection(self) -> Collection:
+        """
+        The collection that holds each note along with its recipients.
+        """
+        return get_feeds_collection()
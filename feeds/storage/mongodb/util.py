@@ -0,0 +1,218 @@
+from typing import (
+    List,
+    Dict,
+    Tuple,
+    Union
+)
+from pymongo import (
+    ASCENDING,
+    UpdateOne
+)
+from pymongo.collection import Collection
+from .connection import (
+    get_feeds_collection,
+    get_inbox_collection,
+    get_archive_collection
+)
+from feeds.config import get_config
+from feeds.entity.entity import Entity
+from feeds.notification_level import Level
+from feeds.verbs import Verb
+from feeds.util import (
+    is_sortable_id,
+    epoch_ms
+)
+
+"""
+How the MongoDB engines store Entities.
+
+With entity-encoding=document (the default), each Entity in a stored note - actor, object,
+target, users, and unseen - is its to_dict() form, a {"id": ..., "type": ...} subdocument.
+With entity-encoding=compact, each is its str() form, "type::id", instead. That makes notes
+smaller, and makes the entries in the multikey indexes on users much smaller.
+
+Either way, Entity.from_stored reads both forms, and every query matches
+both of them, so a database can hold a mix while it's being migrated (see
+migrate_entity_encoding, run by python -m feeds.migrate entity-encoding). Notes that get read
+back out of the database directly (not through a timeline) have their Entities decoded back
+to dicts, so the API doesn't change.
+
+Notes are stored with their id as their _id, too. Those ids are time-sortable (see
+feeds.util.sortable_id), so new notes always go at the end of the _id index. Notes from
+before that have UUIDs for ids, and ObjectIds for _ids - note_id_query finds both.
+"""
+
+ENTITY_FIELDS = ["actor", "object"]
+ENTITY_LIST_FIELDS = ["target", "users", "unseen"]
+MIGRATION_BATCH_SIZE = 1000
+
+
+def is_compact() -> bool:
+    return get_config().entity_encoding == "compact"
+
+
+def encode_entity(entity: Entity) -> Union[str, Dict[str, str]]:
+    """
+    Returns the form of the Entity that gets stored, set by entity-encoding in the config.
+    """
+    if is_compact():
+        return str(entity)
+    return entity.to_dict()
+
+
+def encode_entities(entities: List[Entity]) -> List[Union[str, Dict[str, str]]]:
+    return [encode_entity(e) for e in entities]
+
+
+def entity_forms(entities: List[Entity]) -> List[Union[str, Dict[str, str]]]:
+    """
+    Returns both stored forms of each Entity, for matching in queries.
+    """
+    forms = list()
+    for e in entities:
+        forms.extend([e.to_dict(), str(e)])
+    return forms
+
+
+def entity_query(entity: Entity) -> dict:
+    """
+    A query clause that matches a field holding the Entity in either of its forms (or an
+    array field holding it).
+    """
+    return {"$in": entity_forms([entity])}
+
+
+def note_id_query(act_ids: List[str]) -> dict:
+    """
+    A query that matches the stored notes with the given ids. Sortable ids are looked up by
+    _id. Any others are from older notes, and are looked up by their id field, through an
+    index that only covers those notes (see connection.py).
+    """
+    new_ids = [i for i in act_ids if is_sortable_id(i)]
+    old_ids = [i for i in act_ids if not is_sortable_id(i)]
+    clauses = list()
+    if new_ids or not old_ids:
+        clauses.append({"_id": {"$in": new_ids}})
+    if old_ids:
+        clauses.append({"id": {"$in": old_ids}, "_id": {"$type": "objectId"}})
+    if len(clauses) == 1:
+        return clauses[0]
+    return {"$or": clauses}
+
+
+def seen_filter_query(level: Level=None, verb: Verb=None, source: str=None,
+                      before: int=None) -> dict:
+    """
+    A query that matches the unexpired notes with the given level, verb, and source, created
+    before the given time (in epoch ms). Filters that are None are left out.
+    """
+    query = {"expires": {"$gt": epoch_ms()}}
+    if level is not None:
+        query["level"] = level.id
+    if verb is not None:
+        query["verb"] = verb.id
+    if source is not None:
+        query["source"] = source
+    if before is not None:
+        query["created"] = {"$lt": before}
+    return query
+
+
+def encode_activity(act_doc: dict) -> dict:
+    """
+    Encodes the Entities in an activity's to_dict() form for storage. Modifies and returns
+    act_doc.
+    """
+    return _convert_doc(act_doc, encode_entity)
+
+
+def decode_activity(doc: dict) -> dict:
+    """
+    Turns all the Entities in a stored activity back into their dict form. Modifies and
+    returns doc.
+    """
+    if doc is None:
+        return None
+    return _convert_doc(doc, lambda e: e.to_dict())
+
+
+def _convert_doc(doc: dict, convert) -> dict:
+    for f in ENTITY_FIELDS:
+        if doc.get(f) is not None:
+            doc[f] = convert(Entity.from_stored(doc[f]))
+    for f in ENTITY_LIST_FIELDS:
+        if doc.get(f) is not None:
+            doc[f] = [convert(Entity.from_stored(e)) for e in doc[f]]
+    return doc
+
+
+def migrate_entity_encoding(coll: Collection, batch_size: int=MIGRATION_BATCH_SIZE) -> int:
+    """
+    Converts every stored note in the collection that has any Entities in the other form into
+    the form set by entity-encoding, with a bulk write for every batch_size notes.
+    Notes are read in _id order, and each batch picks up after the last one, so the
+    collection only gets scanned once.
+    Each note is only updated if its users and unseen lists haven't changed since it was read,
+    so this can run while the service is taking writes. If any did change, another scan picks
+    them up.
+    Returns the number of converted notes.
+    """
+    if is_compact():
+        # subdocuments have a type field, and a type query on an array checks its elements
+        old_form = {"$or": [{f + ".type": {"$exists": True}}
+                            for f in ENTITY_FIELDS + ENTITY_LIST_FIELDS]}
+    else:
+        old_form = {"$or": [{f: {"$type": "string"}}
+                            for f in ENTITY_FIELDS + ENTITY_LIST_FIELDS]}
+    total = 0
+    while True:
+        (converted, missed) = _migrate_scan(coll, old_form, batch_size)
+        total += converted
+        if not missed:
+            return total
+
+
+def _migrate_scan(coll: Collection, old_form: dict, batch_size: int) -> Tuple[int, int]:
+    """
+    Returns the number of notes that got converted, and the number that changed before they
+    could be.
+    """
+    converted = 0
+    missed = 0
+    # newer notes have string _ids, and older ones have ObjectIds, and a range on _id only
+    # matches one type
+    for id_type in ["string", "objectId"]:
+        id_range = {"$type": id_type}
+        while True:
+            docs = list(coll.find({"$and": [old_form, {"_id": id_range}]})
+                        .sort("_id", ASCENDING).limit(batch_size))
+            if not docs:
+                break
+            updates = list()
+            for doc in docs:
+                match = {"_id": doc["_id"]}
+                for f in ["users", "unseen"]:
+                    if f in doc:
+                        match[f] = doc[f]
+                encoded = encode_activity(dict(doc))
+                update = {f: encoded[f] for f in ENTITY_FIELDS + ENTITY_LIST_FIELDS
+                          if f in encoded}
+                updates.append(UpdateOne(match, {"$set": update}))
+            result = coll.bulk_write(updates, ordered=False)
+            converted += result.modified_count
+            missed += len(updates) - result.matched_count
+            if len(docs) < batch_size:
+                break
+            id_range = {"$type": id_type, "$gt": docs[-1]["_id"]}
+    return (converted, missed)
+
+
+def migrate_all_entity_encodings() -> Dict[str, int]:
+    """
+    Converts the notes in all the MongoDB collections to the configured entity-encoding.
+    Returns the number of converted notes in each collection, by name.
+    """
+    counts = dict()
+    for coll in [get_feeds_collection(), get_inbox_collection(), get_archive_collection()]:
+        counts[coll.name] = migrate_entity_encoding(coll)
+    return counts
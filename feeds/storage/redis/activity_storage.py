@@ -1,63 +1,427 @@
+import json
+from typing import (
+    List,
+    Dict,
+    Tuple,
+    Optional
+)
+from redis.exceptions import RedisError
 from ..base import ActivityStorage
 from .connection import get_redis_connection
-# from cachetools import TTLCache
-from .util import get_activity_key
+from .feed_version_storage import RedisFeedVersionStorage
+from .util import (
+    get_activity_key,
+    get_activity_users_key,
+    get_archive_key,
+    get_archive_external_key_key,
+    get_external_key_key,
+    get_user_key,
+    get_unseen_key,
+    EXPIRES_KEY,
+    EXPIRED_KEY,
+    CHANGES_CHANNEL
+)
 from collections import defaultdict
+from feeds.exceptions import ActivityStorageError
+from feeds.entity.entity import Entity
+from feeds.notification_level import Level
+from feeds.verbs import Verb
+from feeds.config import get_config
+from feeds.util import epoch_ms
+from feeds.logger import log_error
 
 """
 Activities get added to Redis like this:
-Each activity comes from a source - that source is used as the key.
 Each activity gets a unique id that it knows how to make.
-Each activity can also be serialized/deserialized into a string. Maybe it gets pickled.
-So now we have the makings of a hash.
-Each key = activity's unique id.
-Each value = serialized version of activity.
+Each activity is stored as a JSON string (its to_dict form) in a hash, keyed by the
+activity's id. Hashes are namespaced by a single character of the ids (the last one for
+time-sortable ids, the first for older UUIDs), which should help with sharding, if we need to.
 
-Should be small and fast.
+Fanout happens on write. Each user (or other Entity) that gets an activity has two sorted
+sets, both scored by the activity's creation time:
+* feed:<entity> - all their activities
+* unseen:<entity> - the ones they haven't seen yet
+Since members with the same score are sorted by their value (the id), these give the same
+(created, id) order as the MongoDB engine. Unseen counts are just the size of the unseen set.
 
-If we make a MongoDB adapter, it can work with documents.
+Alongside those,
+* note_users:<id> is the set of everyone who got an activity
+* ext_keys:<source> maps each external key from a source to its activity id (with
+  idempotent-writes on, the first activity to claim a key and get stored keeps it, see
+  add_to_storage)
+* expires is a sorted set of all unexpired activity ids scored by expiration time.
+
+Expired activities are swept out of everyone's sorted sets (see sweep_expired_activities) by
+the background jobs in feeds/managers/archive_manager.py. Until then, reads leave them out
+themselves (see get_unswept_expired), so they never have to wait on a sweep. Swept activities
+move over to the expired sorted set, with the same scores. The activities
+themselves stay around, so they can still be looked up by id or external key, until they get
+archived (see archive_expired). That moves them to archive:<id character> hashes, and
+their external keys to archive_ext_keys:<source>.
+
+Each write publishes a small message on the feeds:changes channel, for anyone who wants to
+follow along (see notification_hub.py).
 """
 
-# activity_cache = TTLCache(1000, 600)
+SWEEP_BATCH_SIZE = 1000
+UNSWEPT_LIMIT = 1000
 
 
 class RedisActivityStorage(ActivityStorage):
-    def serialize(self):
-        raise NotImplementedError()
+    def add_to_storage(self, activity, target_users: List[Entity]) -> None:
+        """
+        Adds a single activity to Redis, and fans it out to each target user's feed, all in
+        a single pipeline.
+        Raises an ActivityStorageError if it fails.
 
-    def deserialize(self):
-        raise NotImplementedError()
+        With idempotent-writes on, an activity with an external key claims that key for its
+        source first (see _claim_external_key). If another activity has it already, this is
+        treated as a retry of that one - nothing gets stored, and activity.id is set to the
+        stored one's id. If storing the activity fails, its claim is dropped, so a retry can
+        make it again.
+        """
+        act_doc = activity.to_dict()
+        act_doc.pop("users", None)
+        users = set(target_users)
+        r = get_redis_connection()
+        claimed = False
+        if get_config().idempotent_writes and activity.external_key is not None:
+            try:
+                stored_id = self._claim_external_key(r, activity)
+            except RedisError as e:
+                raise ActivityStorageError("Failed to store activity: " + str(e))
+            if stored_id is not None:
+                activity.id = stored_id
+                return
+            claimed = True
+        pipe = r.pipeline(transaction=False)
+        pipe.hset(get_activity_key(activity.id), activity.id, json.dumps(act_doc))
+        pipe.zadd(EXPIRES_KEY, activity.expires, activity.id)
+        if activity.external_key is not None:
+            pipe.hset(get_external_key_key(activity.source), activity.external_key, activity.id)
+        if users:
+            pipe.sadd(get_activity_users_key(activity.id), *[str(u) for u in users])
+        for u in users:
+            pipe.zadd(get_user_key(u), activity.created, activity.id)
+            pipe.zadd(get_unseen_key(u), activity.created, activity.id)
+        pipe.publish(CHANGES_CHANNEL, _change_message("insert", activity.id, users))
+        try:
+            pipe.execute()
+        except RedisError as e:
+            if claimed:
+                self._release_external_key(r, activity)
+            raise ActivityStorageError("Failed to store activity: " + str(e))
+        RedisFeedVersionStorage().bump(target_users)
+
+    @staticmethod
+    def _claim_external_key(r, activity) -> Optional[str]:
+        """
+        Claims the activity's external key for its id. Returns None if it got the claim, or
+        the id of the stored activity that already has it.
+        A claim on an activity that never got stored was left by a write that died partway
+        through (one that failed would have dropped it), so that gets taken over.
+        """
+        ext_key = get_external_key_key(activity.source)
+        if r.hsetnx(ext_key, activity.external_key, activity.id):
+            return None
+        stored_id = r.hget(ext_key, activity.external_key)
+        if stored_id is not None and r.hexists(get_activity_key(stored_id), stored_id):
+            return stored_id
+        r.hset(ext_key, activity.external_key, activity.id)
+        return None
+
+    @staticmethod
+    def _release_external_key(r, activity) -> None:
+        """
+        Drops the activity's claim on its external key, if it still has it. Failures are
+        logged - the claim then gets taken over by the next retry.
+        """
+        ext_key = get_external_key_key(activity.source)
+        try:
+            if r.hget(ext_key, activity.external_key) == activity.id:
+                r.hdel(ext_key, activity.external_key)
+        except RedisError as e:
+            log_error(__name__, e)
+
+    def set_unseen(self, act_ids: List[str], user: Entity) -> None:
+        """
+        Adds the activities back to the user's unseen set, but only those that are in the
+        user's feed.
+        """
+        r = get_redis_connection()
+        created = _get_scores(r, get_user_key(user), act_ids)
+        unseen = _get_scores(r, get_unseen_key(user), act_ids)
+        to_add = [act_id for act_id in act_ids
+                  if created[act_id] is not None and unseen[act_id] is None]
+        if not to_add:
+            return
+        pipe = r.pipeline(transaction=False)
+        for act_id in to_add:
+            pipe.zadd(get_unseen_key(user), created[act_id], act_id)
+            pipe.publish(CHANGES_CHANNEL, _change_message("update", act_id, [user]))
+        pipe.execute()
+        RedisFeedVersionStorage().bump([user])
+
+    def set_seen(self, act_ids: List[str], user: Entity) -> None:
+        """
+        Setting seen just means removing the activities from the user's unseen set.
+        """
+        if len(act_ids) == 0:
+            return
+        r = get_redis_connection()
+        removed = r.zrem(get_unseen_key(user), *act_ids)
+        if not removed:
+            return
+        pipe = r.pipeline(transaction=False)
+        for act_id in act_ids:
+            pipe.publish(CHANGES_CHANNEL, _change_message("update", act_id, [user]))
+        pipe.execute()
+        RedisFeedVersionStorage().bump([user])
+
+    def set_all_seen(self, user: Entity, level: Level=None, verb: Verb=None, source: str=None,
+                     before: int=None) -> int:
+        """
+        Takes every activity that matches the filters out of the user's unseen set, all at
+        once. The unseen set gets cut off at before (in epoch ms) by its scores, and the
+        activities are only fetched if there's a level, verb, or source to check.
+        Returns the number of activities that got marked.
+        """
+        r = get_redis_connection()
+        high = "({}".format(before) if before is not None else "+inf"
+        act_ids = r.zrangebyscore(get_unseen_key(user), "-inf", high)
+        if act_ids and (level is not None or verb is not None or source is not None):
+            act_ids = self.filter_ids(act_ids, level=level, verb=verb, source=source)
+        if not act_ids:
+            return 0
+        pipe = r.pipeline(transaction=False)
+        pipe.zrem(get_unseen_key(user), *act_ids)
+        for act_id in act_ids:
+            pipe.publish(CHANGES_CHANNEL, _change_message("update", act_id, [user]))
+        removed = pipe.execute()[0]
+        if removed:
+            RedisFeedVersionStorage().bump([user])
+        return removed
+
+    def filter_ids(self, act_ids: List[str], level: Level=None, verb: Verb=None,
+                   source: str=None) -> List[str]:
+        """
+        Returns the ones of the given activity ids whose activities have the given level, verb,
+        and source. Filters that are None are left out.
+        """
+        found = self.get_by_id(act_ids, source=source)
+        matching = list()
+        for act_id in act_ids:
+            note = found[act_id]
+            if note is None:
+                continue
+            if level is not None and note["level"] != level.id:
+                continue
+            if verb is not None and note["verb"] != verb.id:
+                continue
+            matching.append(act_id)
+        return matching
 
-    def add_to_storage(self, activity):
-        # namespaces notes under the first character of their id.
-        # should help with sharding, if we need to.
-        key = get_activity_key(activity)
+    def get_by_id(self, act_ids: List[str], source: str=None,
+                  include_archived: bool=False) -> Dict[str, dict]:
+        """
+        If source is not None, return only those that match the source.
+        If include_archived is True, any that aren't found get looked up in the archive.
+        Returns a dict mapping from note id to note (or None if it's not found).
+        """
+        serials = self.get_from_storage(act_ids)
+        if include_archived:
+            missing = [act_id for act_id, s in zip(act_ids, serials) if s is None]
+            archived = dict(zip(missing, self.get_from_storage(missing, archive=True)))
+            serials = [s if s is not None else archived[act_id]
+                       for act_id, s in zip(act_ids, serials)]
+        notes = dict()
+        for act_id, serial in zip(act_ids, serials):
+            note = None
+            if serial is not None:
+                note = json.loads(serial)
+                if source is not None and note["source"] != source:
+                    note = None
+            notes[act_id] = note
+        return notes
+
+    def get_by_external_key(self, external_keys: List[str], source: str,
+                            include_archived: bool=False) -> Dict[str, dict]:
+        """
+        Source HAS to exist here, it's part of the key.
+        If include_archived is True, any that aren't found get looked up in the archive.
+        Returns a dict mapping from external_key to note
+        """
+        assert source is not None
+        if len(external_keys) == 0:
+            return {}
         r = get_redis_connection()
-        r.hset(key, activity.id, activity.serialize())
+        act_ids = r.hmget(get_external_key_key(source), external_keys)
+        if include_archived:
+            archived_ids = r.hmget(get_archive_external_key_key(source), external_keys)
+            act_ids = [a if a is not None else b for a, b in zip(act_ids, archived_ids)]
+        found = self.get_by_id([i for i in act_ids if i is not None],
+                               include_archived=include_archived)
+        return {
+            key: found.get(act_id) if act_id is not None else None
+            for key, act_id in zip(external_keys, act_ids)
+        }
 
-    def get_from_storage(self, activity_ids):
-        # returns a list of serialized strings. We don't know what subclass
-        # to return as here, so it's up to the calling Manager or Feed to deserialize.
+    def get_from_storage(self, activity_ids: List[str], archive: bool=False) -> List[str]:
+        # returns a list of serialized strings (or None for anything that's not found), in
+        # the same order as activity_ids. If archive is True, they come from the archive.
+        if len(activity_ids) == 0:
+            return []
 
         # first, map the activity_ids onto their stored hash keys
+        key_fn = get_archive_key if archive else get_activity_key
         lookup_map = defaultdict(list)
         for id_ in activity_ids:
-            lookup_map[get_activity_key(id_)].append(id_)
+            lookup_map[key_fn(id_)].append(id_)
         r = get_redis_connection()
-        acts = dict()  # act id -> Activity
+        pipe = r.pipeline(transaction=False)
         for key in lookup_map:
-            id_list = lookup_map[key]
-            serial_acts = r.hmget(key, lookup_map[key])
+            pipe.hmget(key, lookup_map[key])
+        acts = dict()  # act id -> serialized Activity
+        for key, serial_acts in zip(lookup_map, pipe.execute()):
             # The above are the same length (redis fills in None for missing keys)
             # just smash them into a dict
-            for idx, id_ in enumerate(id_list):
+            for idx, id_ in enumerate(lookup_map[key]):
                 acts[id_] = serial_acts[idx]
         # now, just map the acts dict back onto the original activity_ids list
         # to maintain the order
-        ret_list = list()
-        for id_ in activity_ids:
-            ret_list.append(acts[id_])
-        return ret_list
+        return [acts[id_] for id_ in activity_ids]
 
     def remove_from_storage(self, activity_ids):
         raise NotImplementedError()
+
+    def expire_notifications(self, act_ids: List[str]) -> None:
+        """
+        Expires notifications by changing their expiration time to now, then sweeps them
+        out of their users' feeds.
+        """
+        now = epoch_ms()
+        notes = self.get_by_id(act_ids)
+        r = get_redis_connection()
+        pipe = r.pipeline(transaction=False)
+        for act_id, note in notes.items():
+            if note is None:
+                continue
+            note["expires"] = now
+            pipe.hset(get_activity_key(act_id), act_id, json.dumps(note))
+            pipe.zadd(EXPIRES_KEY, now, act_id)
+        pipe.execute()
+        sweep_expired_activities(now)
+
+    def sweep_expired(self) -> None:
+        """
+        Sweeps expired activities out of everyone's sorted sets (see sweep_expired_activities).
+        """
+        sweep_expired_activities()
+
+    def archive_expired(self, before: int, batch_size: int) -> List[str]:
+        """
+        Moves up to batch_size activities that expired (and have been swept) before the given
+        time (ms since epoch) into the archive hashes, along with their external keys.
+        Returns the ids of the archived activities. If there are fewer than batch_size of
+        them, there's nothing left to archive.
+        """
+        sweep_expired_activities()
+        r = get_redis_connection()
+        act_ids = r.zrangebyscore(EXPIRED_KEY, "-inf", "({}".format(before),
+                                  start=0, num=batch_size)
+        if not act_ids:
+            return []
+        pipe = r.pipeline(transaction=True)
+        for act_id, serial in zip(act_ids, self.get_from_storage(act_ids)):
+            if serial is not None:
+                pipe.hset(get_archive_key(act_id), act_id, serial)
+                pipe.hdel(get_activity_key(act_id), act_id)
+                note = json.loads(serial)
+                if note.get("external_key") is not None:
+                    pipe.hset(get_archive_external_key_key(note["source"]),
+                              note["external_key"], act_id)
+                    pipe.hdel(get_external_key_key(note["source"]), note["external_key"])
+        pipe.zrem(EXPIRED_KEY, *act_ids)
+        try:
+            pipe.execute()
+        except RedisError as e:
+            raise ActivityStorageError("Failed to archive activities: " + str(e))
+        return act_ids
+
+
+def sweep_expired_activities(now: int=None) -> None:
+    """
+    Takes every activity that expired by now (default: right now) out of the feeds and unseen
+    sets of everyone who got it, SWEEP_BATCH_SIZE activities at a time. Anyone who had one
+    gets a new feed version.
+    Swept activities go into the expired sorted set, to wait for archiving.
+    This is safe to run at the same time from several places, the worst that happens is an
+    extra feed version.
+    """
+    if now is None:
+        now = epoch_ms()
+    r = get_redis_connection()
+    while True:
+        # swept activities leave the expires set, so the next batch is always at the start
+        expired = r.zrangebyscore(EXPIRES_KEY, "-inf", now, start=0, num=SWEEP_BATCH_SIZE,
+                                  withscores=True)
+        if expired:
+            _sweep(r, expired)
+        if len(expired) < SWEEP_BATCH_SIZE:
+            return
+
+
+def _sweep(r, expired: List[Tuple[str, float]]) -> None:
+    """
+    Sweeps the given (id, expiration time) tuples, as in sweep_expired_activities.
+    """
+    act_ids = [act_id for act_id, expires in expired]
+    pipe = r.pipeline(transaction=False)
+    for act_id in act_ids:
+        pipe.smembers(get_activity_users_key(act_id))
+    users_by_id = dict(zip(act_ids, pipe.execute()))
+    touched = set()
+    pipe = r.pipeline(transaction=False)
+    for act_id, user_keys in users_by_id.items():
+        users = [Entity.from_str(u) for u in user_keys]
+        for u in users:
+            pipe.zrem(get_user_key(u), act_id)
+            pipe.zrem(get_unseen_key(u), act_id)
+        pipe.delete(get_activity_users_key(act_id))
+        pipe.publish(CHANGES_CHANNEL, _change_message("update", act_id, users))
+        touched.update(users)
+    pipe.zrem(EXPIRES_KEY, *act_ids)
+    scores = list()
+    for act_id, expires in expired:
+        scores.extend([expires, act_id])
+    pipe.zadd(EXPIRED_KEY, *scores)
+    pipe.execute()
+    RedisFeedVersionStorage().bump(list(touched))
+
+
+def get_unswept_expired(now: int=None) -> List[str]:
+    """
+    Returns the ids of activities that expired by now (default: right now), but haven't been
+    swept yet, up to UNSWEPT_LIMIT of them, soonest expired first. There shouldn't be many, as
+    long as the background jobs are running - if there are more, the rest are only left out of
+    reads that fetch the activities themselves, and still get counted until they're swept.
+    """
+    if now is None:
+        now = epoch_ms()
+    return get_redis_connection().zrangebyscore(EXPIRES_KEY, "-inf", now, start=0,
+                                                num=UNSWEPT_LIMIT)
+
+
+def _get_scores(r, key: str, members: List[str]) -> Dict[str, float]:
+    pipe = r.pipeline(transaction=False)
+    for m in members:
+        pipe.zscore(key, m)
+    return dict(zip(members, pipe.execute()))
+
+
+def _change_message(op: str, act_id: str, users: List[Entity]) -> str:
+    return json.dumps({
+        "op": op,
+        "id": act_id,
+        "users": [u.to_dict() for u in users]
+    })
@@ -1,33 +1,47 @@
 import redis
 from feeds.config import get_config
 
-connection_pool = None
+DEFAULT_SERVER = "default"
+CACHE_SERVER = "cache"
 
+connection_pools = dict()
 
-def get_redis_connection(server_name='default'):
+
+def get_redis_connection(server_name=DEFAULT_SERVER):
     '''
-    Gets the specified redis connection
+    Gets the specified redis connection. That's either the default server, which is the
+    configured db when the db-engine is redis, or the cache server.
     '''
-    global connection_pool
-
-    if connection_pool is None:
-        connection_pool = setup_redis()
+    if server_name not in connection_pools:
+        connection_pools[server_name] = setup_redis(server_name)
 
-    return redis.StrictRedis(connection_pool=connection_pool)
+    return redis.StrictRedis(connection_pool=connection_pools[server_name])
 
 
-def setup_redis():
+def setup_redis(server_name=DEFAULT_SERVER):
     '''
     Starts the connection pool for the configured redis server
     '''
     config = get_config()
+    if server_name == CACHE_SERVER:
+        return redis.ConnectionPool(
+            host=config.cache_host,
+            port=config.cache_port,
+            password=config.cache_pw or None,
+            decode_responses=True
+        )
+    # Redis databases are numbered, so a db-name that isn't a number (like the default
+    # "feeds") just means the default database.
+    db = 0
+    if config.db_name and config.db_name.isdigit():
+        db = int(config.db_name)
     pool = redis.ConnectionPool(
         host=config.db_host,
         port=config.db_port,
-        password=config.db_pw,
-        db=config.db_name
+        password=config.db_pw or None,
+        db=db,
+        decode_responses=True
 
-        # decode_responses=config.get('decode_responses', True),
         # # connection options
         # socket_timeout=config.get('socket_timeout', None),
         # socket_connect_timeout=config.get('socket_connect_timeout', None),
@@ -0,0 +1,39 @@
+from typing import List
+from redis.exceptions import RedisError
+from ..base import FeedVersionStorage
+from .connection import get_redis_connection
+from .util import FEED_VERSIONS_KEY
+from feeds.entity.entity import Entity
+from feeds.logger import log_error
+
+"""
+Feed versions are kept in a single hash, from str(Entity) to version. A user without an entry
+is at version 0.
+"""
+
+
+class RedisFeedVersionStorage(FeedVersionStorage):
+    def bump(self, users: List[Entity]) -> None:
+        """
+        Increments the feed version of each of the given users, in one pipeline.
+        Failures are logged, not raised, so they don't fail the write that caused them.
+        """
+        users = set(users)
+        if not users:
+            return
+        pipe = get_redis_connection().pipeline(transaction=False)
+        for u in users:
+            pipe.hincrby(FEED_VERSIONS_KEY, str(u), 1)
+        try:
+            pipe.execute()
+        except RedisError as e:
+            log_error(__name__, e)
+
+    def get_versions(self, users: List[Entity]) -> List[int]:
+        """
+        Returns the current feed version of each of the given users, in order.
+        """
+        if len(users) == 0:
+            return []
+        versions = get_redis_connection().hmget(FEED_VERSIONS_KEY, [str(u) for u in users])
+        return [int(v) if v is not None else 0 for v in versions]
@@ -0,0 +1,127 @@
+import json
+from redis.exceptions import WatchError
+from typing import (
+    List,
+    Dict,
+    Tuple
+)
+from ..base import GlobalSeenStorage
+from ..global_seen import (
+    SeenState,
+    EMPTY_STATE,
+    MAX_STATE_RETRIES,
+    is_seen,
+    update_state
+)
+from .connection import get_redis_connection
+from .activity_storage import (
+    RedisActivityStorage,
+    get_unswept_expired
+)
+from .feed_version_storage import RedisFeedVersionStorage
+from .util import (
+    get_user_key,
+    get_global_seen_key
+)
+from feeds.exceptions import ActivityStorageError
+from feeds.entity.entity import Entity
+from feeds.notification_level import Level
+from feeds.verbs import Verb
+
+"""
+Each user who has marked any global notification gets their seen state (see
+feeds/storage/global_seen.py) stored as a JSON string at global_seen:<entity>, in the form
+{"hwm": int, "seen": [ids], "unseen": [ids]}. It's updated in a WATCH/MULTI transaction,
+so it's only replaced if it hasn't changed since it was read.
+"""
+
+
+class RedisGlobalSeenStorage(GlobalSeenStorage):
+    def get_seen(self, user: Entity, activities: List[Tuple[str, int]]) -> Dict[str, bool]:
+        """
+        Given a list of (id, created) tuples for global activities, returns a dict mapping
+        from each id to whether the user has seen it.
+        """
+        state = self._get_state(user)
+        return {act_id: is_seen(state, act_id, created) for act_id, created in activities}
+
+    def get_unseen_count(self, user: Entity) -> int:
+        """
+        Returns the number of unexpired global activities the user hasn't seen.
+        """
+        state = self._get_state(user)
+        return len([
+            act_id for act_id, created in self._get_active_activities()
+            if not is_seen(state, act_id, created)
+        ])
+
+    def set_seen(self, act_ids: List[str], user: Entity) -> None:
+        self._set_state(act_ids, user, True)
+
+    def set_unseen(self, act_ids: List[str], user: Entity) -> None:
+        self._set_state(act_ids, user, False)
+
+    def set_all_seen(self, user: Entity, level: Level=None, verb: Verb=None, source: str=None,
+                     before: int=None) -> None:
+        """
+        Marks every unexpired global activity with the given level, verb, and source, created
+        before the given time (in epoch ms), as seen for the user. Filters that are None are
+        left out. Without any filters, that just moves the user's high water mark up to the
+        newest one.
+        """
+        act_ids = [act_id for act_id, created in self._get_active_activities()
+                   if before is None or created < before]
+        if act_ids and (level is not None or verb is not None or source is not None):
+            act_ids = RedisActivityStorage().filter_ids(act_ids, level=level, verb=verb,
+                                                        source=source)
+        if act_ids:
+            self._set_state(act_ids, user, True)
+
+    def _set_state(self, act_ids: List[str], user: Entity, seen: bool) -> None:
+        """
+        Marks the given global activities as seen or unseen for the user, then stores the
+        most compact state that describes all the unexpired global activities. The user's feed
+        gets a new version, as their view of the global feed changed.
+        If the state keeps changing underneath this, an ActivityStorageError gets raised after
+        MAX_STATE_RETRIES tries.
+        """
+        key = get_global_seen_key(user)
+        with get_redis_connection().pipeline() as pipe:
+            for _ in range(MAX_STATE_RETRIES):
+                try:
+                    pipe.watch(key)
+                    state = self._decode_state(pipe.get(key))
+                    (hwm, seen_ids, unseen_ids) = update_state(
+                        state, self._get_active_activities(), act_ids, seen
+                    )
+                    pipe.multi()
+                    pipe.set(key, json.dumps({
+                        "hwm": hwm, "seen": list(seen_ids), "unseen": list(unseen_ids)
+                    }))
+                    pipe.execute()
+                    RedisFeedVersionStorage().bump([user])
+                    return
+                except WatchError:
+                    continue
+        raise ActivityStorageError(
+            "Failed to store global seen state for {}: too many concurrent updates".format(user)
+        )
+
+    def _get_state(self, user: Entity) -> SeenState:
+        return self._decode_state(get_redis_connection().get(get_global_seen_key(user)))
+
+    @staticmethod
+    def _decode_state(serial: str) -> SeenState:
+        if serial is None:
+            return EMPTY_STATE
+        doc = json.loads(serial)
+        return (doc["hwm"], set(doc["seen"]), set(doc["unseen"]))
+
+    def _get_active_activities(self) -> List[Tuple[str, int]]:
+        """
+        Returns (id, created) for each unexpired global activity, oldest first.
+        """
+        expired = set(get_unswept_expired())
+        active = get_redis_connection().zrange(get_user_key(self.global_feed), 0, -1,
+                                               withscores=True)
+        return [(act_id, int(created)) for act_id, created in active if act_id not in expired]
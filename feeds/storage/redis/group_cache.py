@@ -0,0 +1,73 @@
+import json
+from typing import (
+    List,
+    Dict,
+    Optional
+)
+from redis.exceptions import RedisError
+from .connection import (
+    get_redis_connection,
+    CACHE_SERVER
+)
+from .util import get_group_members_key
+from feeds.config import get_config
+from feeds.logger import log_error
+
+"""
+A cache of who's in each group (see GroupsFanout), kept in the Redis server set by cache-host
+and cache-port in the config, so every process that fans out group notifications shares it.
+
+Each group's members are a JSON list of user names at group_members:<group id>, or null if the
+group couldn't be found. Those expire after GROUP_CACHE_TTL seconds, and get dropped right away
+by invalidate_group_members.
+
+Without a cache-host, nothing gets cached here. Failures talking to the cache are logged, and
+just mean the members get looked up again.
+"""
+
+GROUP_CACHE_TTL = 5 * 60  # seconds
+
+
+def get_cached_group_members(group_ids: List[str]) -> Dict[str, Optional[List[str]]]:
+    """
+    Returns a dict mapping from group id to members, for the groups that are cached.
+    """
+    if not get_config().cache_host or not group_ids:
+        return {}
+    try:
+        serials = _connection().mget([get_group_members_key(g_id) for g_id in group_ids])
+    except RedisError as e:
+        log_error(__name__, e)
+        return {}
+    return {g_id: json.loads(s) for g_id, s in zip(group_ids, serials) if s is not None}
+
+
+def cache_group_members(members: Dict[str, Optional[List[str]]]) -> None:
+    """
+    Caches the members of each group, given as a dict mapping from group id to members.
+    """
+    if not get_config().cache_host or not members:
+        return
+    try:
+        pipe = _connection().pipeline(transaction=False)
+        for g_id, names in members.items():
+            pipe.setex(get_group_members_key(g_id), GROUP_CACHE_TTL, json.dumps(names))
+        pipe.execute()
+    except RedisError as e:
+        log_error(__name__, e)
+
+
+def invalidate_group_members(group_ids: List[str]) -> None:
+    """
+    Drops the cached members of the groups.
+    """
+    if not get_config().cache_host or not group_ids:
+        return
+    try:
+        _connection().delete(*[get_group_members_key(g_id) for g_id in group_ids])
+    except RedisError as e:
+        log_error(__name__, e)
+
+
+def _connection():
+    return get_redis_connection(CACHE_SERVER)
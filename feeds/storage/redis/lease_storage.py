@@ -0,0 +1,29 @@
+from ..base import LeaseStorage
+from .connection import get_redis_connection
+from .util import get_lease_key
+
+"""
+Each lease is a key holding its owner, that expires when the lease runs out. Taking or
+renewing one is a small Lua script, so the check and the write can't interleave with anyone
+else's.
+"""
+
+_ACQUIRE_SCRIPT = """
+local owner = redis.call('get', KEYS[1])
+if owner and owner ~= ARGV[1] then
+    return 0
+end
+redis.call('set', KEYS[1], ARGV[1], 'PX', ARGV[2])
+return 1
+"""
+
+
+class RedisLeaseStorage(LeaseStorage):
+    def acquire(self, name: str, owner: str, duration: int) -> bool:
+        """
+        Takes the named lease for owner, for duration ms, if nobody else holds it. The current
+        owner can call this again to renew it. Returns True if owner holds the lease now.
+        """
+        r = get_redis_connection()
+        result = r.eval(_ACQUIRE_SCRIPT, 1, get_lease_key(name), owner, duration)
+        return bool(result)
@@ -0,0 +1,65 @@
+import json
+import time
+from redis.exceptions import RedisError
+from ..mongodb.notification_hub import (
+    NotificationHub,
+    RETRY_WAIT
+)
+from .connection import get_redis_connection
+from .activity_storage import RedisActivityStorage
+from .util import CHANGES_CHANNEL
+from feeds.logger import (
+    log,
+    log_error
+)
+
+"""
+Does the same as the MongoDB NotificationHub, but follows the messages that the Redis engine
+publishes on its changes channel (see activity_storage.py) instead of a change stream.
+Redis pub/sub doesn't keep anything for listeners that aren't connected, so there's no
+resuming - whatever gets published while the listener reconnects is missed.
+"""
+
+LISTEN_TIMEOUT = 1.0  # seconds
+
+
+class RedisNotificationHub(NotificationHub):
+    def _watch(self) -> None:
+        """
+        Listens to the changes channel until there's nobody left to tell about it. If the
+        connection fails, it gets reopened after RETRY_WAIT seconds.
+        """
+        log(__name__, "Starting notification change listener")
+        while self._keep_watching():
+            pubsub = get_redis_connection().pubsub(ignore_subscribe_messages=True)
+            try:
+                pubsub.subscribe(CHANGES_CHANNEL)
+                while self._has_subscribers():
+                    message = pubsub.get_message(timeout=LISTEN_TIMEOUT)
+                    if message is not None:
+                        self._publish(self._to_change(message["data"]))
+            except RedisError as e:
+                log_error(__name__, e)
+                time.sleep(RETRY_WAIT)
+            finally:
+                pubsub.close()
+        log(__name__, "Stopping notification change listener")
+
+    @staticmethod
+    def _to_change(data: str) -> dict:
+        """
+        Turns a message from the changes channel into the shape of a change stream event,
+        with just enough of a document for _publish to route it.
+        """
+        msg = json.loads(data)
+        return {
+            "operationType": msg["op"],
+            "fullDocument": {"id": msg["id"], "users": msg["users"]}
+        }
+
+    def _full_note(self, doc: dict) -> dict:
+        note = RedisActivityStorage().get_by_id([doc["id"]])[doc["id"]]
+        if note is None:
+            return doc
+        note.update(doc)
+        return note
@@ -0,0 +1,324 @@
+from typing import (
+    List,
+    Dict,
+    Tuple,
+    Optional
+)
+from redis.exceptions import RedisError
+from .connection import (
+    get_redis_connection,
+    CACHE_SERVER
+)
+from .util import get_timeline_cache_keys
+from feeds.activity.notification import Notification
+from feeds.config import get_config
+from feeds.entity.entity import Entity
+from feeds.notification_level import Level
+from feeds.verbs import Verb
+from feeds.util import epoch_ms
+from feeds.logger import log_error
+
+"""
+A read-through cache of the most recent part of each active user's timeline, kept in the Redis
+server set by cache-host and cache-port in the config, in front of the MongoDB engines.
+
+A user's cache gets filled from the database the first time their timeline gets read (see
+MongoTimelineStorage), with their CACHE_SIZE most recent activities, seen or not, and their
+unseen count. After that, the writes that touch their timeline (new activities, seeing and
+unseeing, expiring) get applied to it as they happen, instead of throwing it away. So the
+database only gets read for users who aren't cached, for reads that go further back than
+what's cached, and for filters the cache can't do.
+
+Each cached user has four keys:
+* timeline_cache:<entity> - sorted set of the cached activity ids, scored by creation time,
+  trimmed to the newest CACHE_SIZE.
+* timeline_cache_notes:<entity> - hash from id to the activity, as Notification.serialize()
+  makes it, without its users.
+* timeline_cache_unseen:<entity> - set of the cached ids the user hasn't seen.
+* timeline_cache_meta:<entity> - hash with:
+    filled - set once the cache has been filled. Writes leave users without this alone, so
+        only users who actually read their timeline get cached.
+    complete - "1" if the cache holds the user's whole timeline.
+    unseen - the user's unseen count, over their whole timeline.
+    counted - when (ms since epoch) unseen was read from the database. It gets read again
+        once that's COUNT_REFRESH ms old, so any drift in the stored counts catches up.
+Reads reset the expiration of all four keys to CACHE_TTL seconds. Writes don't, so users who
+stop reading drop out of the cache. So that a write can't bring back a cache that expired
+after it was checked (without any expiration, this time), each write checks for filled and
+applies itself in a single Lua script.
+
+Failures talking to the cache are logged, and reads fall back to the database. A write that
+can't be applied leaves that user's cache behind until it expires.
+"""
+
+CACHE_SIZE = 200
+CACHE_TTL = 60 * 60  # seconds
+COUNT_REFRESH = 5 * 60 * 1000  # ms
+
+_FILLED = "filled"
+_COMPLETE = "complete"
+_UNSEEN = "unseen"
+_COUNTED = "counted"
+
+# Each script takes the user's four keys, in the order of TimelineCache._keys, and does nothing
+# unless the user's cache is filled.
+_IF_FILLED = """
+if redis.call('hexists', KEYS[4], 'filled') == 0 then
+    return 0
+end
+"""
+
+# ARGV: created, id, serialized activity, CACHE_SIZE
+_ADD_SCRIPT = _IF_FILLED + """
+redis.call('zadd', KEYS[1], ARGV[1], ARGV[2])
+redis.call('hset', KEYS[2], ARGV[2], ARGV[3])
+redis.call('sadd', KEYS[3], ARGV[2])
+redis.call('hincrby', KEYS[4], 'unseen', 1)
+local overflow = redis.call('zrange', KEYS[1], 0, -(tonumber(ARGV[4]) + 1))
+for _, act_id in ipairs(overflow) do
+    redis.call('zrem', KEYS[1], act_id)
+    redis.call('hdel', KEYS[2], act_id)
+    redis.call('srem', KEYS[3], act_id)
+end
+if #overflow > 0 then
+    redis.call('hset', KEYS[4], 'complete', 0)
+end
+return 1
+"""
+
+# ARGV: "1" if seen or "0" if unseen, the change to the unseen count, then the ids
+_SET_SEEN_SCRIPT = _IF_FILLED + """
+for i = 3, #ARGV do
+    if ARGV[1] == '1' then
+        redis.call('srem', KEYS[3], ARGV[i])
+    elseif redis.call('zscore', KEYS[1], ARGV[i]) then
+        redis.call('sadd', KEYS[3], ARGV[i])
+    end
+end
+redis.call('hincrby', KEYS[4], 'unseen', ARGV[2])
+return 1
+"""
+
+# ARGV: the change to the unseen count, then the ids
+_EXPIRE_SCRIPT = _IF_FILLED + """
+for i = 2, #ARGV do
+    redis.call('zrem', KEYS[1], ARGV[i])
+    redis.call('hdel', KEYS[2], ARGV[i])
+    redis.call('srem', KEYS[3], ARGV[i])
+end
+if ARGV[1] ~= '0' then
+    redis.call('hincrby', KEYS[4], 'unseen', ARGV[1])
+end
+return 1
+"""
+
+# ARGV: unseen count, when it was counted
+_SET_COUNT_SCRIPT = _IF_FILLED + """
+redis.call('hmset', KEYS[4], 'unseen', ARGV[1], 'counted', ARGV[2])
+return 1
+"""
+
+
+def get_timeline_cache(user: Entity) -> Optional["TimelineCache"]:
+    """
+    Returns the cache for the user's timeline, or None if there's no cache configured.
+    """
+    if not get_config().cache_host:
+        return None
+    return TimelineCache(user)
+
+
+class TimelineCache(object):
+    def __init__(self, user: Entity):
+        self.user = user
+        (self.timeline_key, self.notes_key, self.unseen_key, self.meta_key) = \
+            get_timeline_cache_keys(user)
+
+    def get_timeline(self, count: int, include_seen: bool, level: Level, verb: Verb,
+                     before: Tuple[int, str]) -> Optional[List[dict]]:
+        """
+        Returns up to count of the user's newest activities from the cache, in the same form
+        and with the same filters as MongoTimelineStorage.get_timeline.
+        Returns None if the cache can't answer that - if the user isn't cached, or if there
+        aren't enough matching activities cached and there might be more in the database.
+        """
+        r = _connection()
+        pipe = r.pipeline(transaction=False)
+        pipe.hgetall(self.meta_key)
+        pipe.zrevrange(self.timeline_key, 0, -1, withscores=True)
+        pipe.smembers(self.unseen_key)
+        for key in self._keys():
+            pipe.expire(key, CACHE_TTL)
+        (meta, cached, unseen) = pipe.execute()[:3]
+        if _FILLED not in meta:
+            return None
+        if before is not None:
+            cached = [(a, c) for a, c in cached if (int(c), a) < tuple(before)]
+        candidates = [a for a, c in cached if include_seen or a in unseen]
+        now = epoch_ms()
+        notes = list()
+        serials = r.hmget(self.notes_key, candidates) if candidates else []
+        for act_id, serial in zip(candidates, serials):
+            if serial is None:
+                # out of step with the timeline, shouldn't happen. Let the database answer.
+                return None
+            note = Notification.deserialize(serial)
+            if note.expires <= now:
+                continue
+            if level is not None and note.level.id != level.id:
+                continue
+            if verb is not None and note.verb.id != verb.id:
+                continue
+            doc = note.to_dict()
+            doc.pop("users", None)
+            doc["seen"] = act_id not in unseen
+            notes.append(doc)
+            if len(notes) == count:
+                return notes
+        if meta.get(_COMPLETE) == "1":
+            return notes
+        return None
+
+    def get_unseen_count(self) -> Optional[int]:
+        """
+        Returns the user's cached unseen count, or None if there isn't one, or it's due to be
+        read again.
+        """
+        (filled, unseen, counted) = _connection().hmget(
+            self.meta_key, [_FILLED, _UNSEEN, _COUNTED]
+        )
+        if filled is None or unseen is None or counted is None:
+            return None
+        if int(counted) < epoch_ms() - COUNT_REFRESH:
+            return None
+        return max(int(unseen), 0)
+
+    def set_unseen_count(self, count: int) -> None:
+        """
+        Caches the user's unseen count, if the user is cached.
+        """
+        r = _connection()
+        r.register_script(_SET_COUNT_SCRIPT)(keys=self._keys(), args=[count, epoch_ms()])
+
+    def is_filled(self) -> bool:
+        return bool(_connection().hexists(self.meta_key, _FILLED))
+
+    def fill(self, notes: List[dict], complete: bool, unseen_count: int) -> None:
+        """
+        Replaces anything cached for the user.
+        :param notes: the user's newest activities, seen or not, newest first, as returned by
+            MongoTimelineStorage.get_timeline. Only the first CACHE_SIZE get cached.
+        :param complete: True if those are all of the user's activities
+        :param unseen_count: the user's unseen count
+        """
+        notes = notes[:CACHE_SIZE]
+        pipe = _connection().pipeline(transaction=True)
+        pipe.delete(*self._keys())
+        if notes:
+            scores = list()
+            for n in notes:
+                scores.extend([n["created"], n["id"]])
+            pipe.zadd(self.timeline_key, *scores)
+            pipe.hmset(self.notes_key, {n["id"]: _serialize(n) for n in notes})
+        unseen = [n["id"] for n in notes if not n.get("seen")]
+        if unseen:
+            pipe.sadd(self.unseen_key, *unseen)
+        pipe.hmset(self.meta_key, {
+            _FILLED: 1,
+            _COMPLETE: 1 if complete else 0,
+            _UNSEEN: unseen_count,
+            _COUNTED: epoch_ms()
+        })
+        for key in self._keys():
+            pipe.expire(key, CACHE_TTL)
+        pipe.execute()
+
+    def clear(self) -> None:
+        _connection().delete(*self._keys())
+
+    def _keys(self) -> Tuple[str, str, str, str]:
+        return (self.timeline_key, self.notes_key, self.unseen_key, self.meta_key)
+
+
+def add_to_timeline_caches(activity, users: List[Entity]) -> None:
+    """
+    Adds a new, unseen activity to the caches of any of the given users who are cached, and
+    trims their caches back to CACHE_SIZE.
+    """
+    if not get_config().cache_host:
+        return
+    try:
+        r = _connection()
+        script = r.register_script(_ADD_SCRIPT)
+        serial = _serialize(activity.to_dict())
+        pipe = r.pipeline(transaction=False)
+        for user in set(users):
+            script(keys=TimelineCache(user)._keys(),
+                   args=[activity.created, activity.id, serial, CACHE_SIZE], client=pipe)
+        pipe.execute()
+    except RedisError as e:
+        log_error(__name__, e)
+
+
+def set_seen_in_timeline_cache(act_ids: List[str], user: Entity, seen: bool,
+                               changed: int) -> None:
+    """
+    Marks the activities as seen or unseen in the user's cache, if they're cached.
+    changed is the number of activities whose state actually changed in the database, which
+    the cached unseen count gets adjusted by.
+    """
+    if not get_config().cache_host or not act_ids:
+        return
+    try:
+        r = _connection()
+        r.register_script(_SET_SEEN_SCRIPT)(
+            keys=TimelineCache(user)._keys(),
+            args=["1" if seen else "0", -changed if seen else changed] + list(act_ids)
+        )
+    except RedisError as e:
+        log_error(__name__, e)
+
+
+def clear_timeline_cache(user: Entity) -> None:
+    """
+    Drops the user's cache, if they're cached. For writes that don't know which of the user's
+    activities they changed - the cache gets filled again on the next read.
+    """
+    if not get_config().cache_host:
+        return
+    try:
+        TimelineCache(user).clear()
+    except RedisError as e:
+        log_error(__name__, e)
+
+
+def expire_from_timeline_caches(act_ids: List[str], users: List[Entity],
+                                adjustments: Dict[Entity, int]) -> None:
+    """
+    Takes the activities out of the caches of any of the given users who are cached.
+    adjustments maps users to the amount their unseen count changed by.
+    """
+    if not get_config().cache_host or not act_ids:
+        return
+    try:
+        r = _connection()
+        script = r.register_script(_EXPIRE_SCRIPT)
+        pipe = r.pipeline(transaction=False)
+        for user in set(users):
+            script(keys=TimelineCache(user)._keys(),
+                   args=[adjustments.get(user, 0)] + list(act_ids), client=pipe)
+        pipe.execute()
+    except RedisError as e:
+        log_error(__name__, e)
+
+
+def _serialize(doc: dict) -> str:
+    """
+    Serializes an activity in dict form, leaving out its users - those aren't part of anyone's
+    timeline, and can be a long list.
+    """
+    return Notification.from_dict(dict(doc, users=[])).serialize()
+
+
+def _connection():
+    return get_redis_connection(CACHE_SERVER)
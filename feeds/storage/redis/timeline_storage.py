@@ -1,26 +1,232 @@
+from typing import (
+    List,
+    Dict,
+    Tuple,
+    Iterator,
+    Optional
+)
 from ..base import TimelineStorage
 from .connection import get_redis_connection
+from .activity_storage import RedisActivityStorage
+from .unseen_count_storage import RedisUnseenCountStorage
 from .util import (
-    get_user_key
+    get_user_key,
+    get_unseen_key
 )
+from feeds.util import epoch_ms
+from feeds.activity.base import BaseActivity
+from feeds.notification_level import Level
+from feeds.verbs import Verb
+from feeds.entity.entity import Entity
+
+"""
+Timelines are read from the user's feed sorted set, or their unseen sorted set if seen
+activities are left out (see activity_storage.py). Those only give the order, so ids get read
+from them SCAN_BATCH at a time, the activities are fetched, and the rest of the filters are
+applied here until there are enough of them.
+
+Nothing narrows the sorted sets down to the activities that reference an Entity, so reads with
+an entity filter (including group timelines and their unseen counts) only look through the
+newest ENTITY_SCAN_LIMIT entries of the set they read.
+"""
+
+SCAN_BATCH = 100
+ENTITY_SCAN_LIMIT = 1000
 
 
 class RedisTimelineStorage(TimelineStorage):
-    # TODO: CACHING!!
+    """
+    Returns the serialized/dictified storage elements, not the actual Activity objects.
+    Same as the MongoDB engine, each one has a seen flag for the timeline's user.
+    """
+    def add_to_timeline(self, activity: BaseActivity) -> None:
+        raise NotImplementedError()
+
+    def get_timeline(self, count: int=10, include_seen: int=False, level: Level=None,
+                     verb: Verb=None, reverse: bool=False, before: Tuple[int, str]=None,
+                     after: Tuple[int, str]=None, entity: Entity=None) -> List[dict]:
+        """
+        :param count: int > 0
+        :param include_seen: boolean
+        :param level: Level or None
+        :param verb: Verb or None
+        :param before: (created, id) tuple or None - if present, only returns notes that
+            come strictly before that position in the feed (i.e. are older)
+        :param after: (created, id) tuple or None - if present, only returns notes that
+            come strictly after that position in the feed (i.e. are newer)
+        :param entity: Entity or None - if present, only returns notes that reference that
+            Entity as their actor, object, or one of their targets
+        """
+        key = get_user_key(self.user) if include_seen else get_unseen_key(self.user)
+        limit = ENTITY_SCAN_LIMIT if entity is not None else None
+        notes = list()
+        for batch in self._scan(key, reverse, before, after, limit=limit):
+            notes.extend(self._read(batch, include_seen, level, verb, entity))
+            if len(notes) >= count:
+                break
+        return notes[:count]
 
-    def get_timeline(self, count=10):
+    def get_timeline_and_unseen_count(self, count: int=10, include_seen: int=False,
+                                      level: Level=None, verb: Verb=None, reverse: bool=False,
+                                      before: Tuple[int, str]=None, after: Tuple[int, str]=None,
+                                      entity: Entity=None) -> Tuple[List[dict], int]:
         """
-        Gets the user's timeline of activity ids.
+        Parameters are the same as get_timeline. Filters only apply to the timeline, not the
+        unseen count, except for entity - that narrows both down to the notes that reference
+        the Entity.
+        Returns a tuple of (timeline, unseen count).
         """
+        timeline = self.get_timeline(count=count, include_seen=include_seen, level=level,
+                                     verb=verb, reverse=reverse, before=before, after=after,
+                                     entity=entity)
+        if entity is None:
+            return (timeline, self.get_unseen_count())
+        return (timeline, self._count_unseen([entity])[0])
+
+    def get_group_timelines(self, group_ids: List[str], count: int=10, include_seen: int=False,
+                            level: Level=None, verb: Verb=None,
+                            reverse: bool=False) -> Dict[str, Tuple[List[dict], int]]:
+        """
+        Fetches the timelines for several groups. A group's timeline is made of the user's
+        notes that reference that group as their actor, object, or one of their targets.
+        Filters are the same as get_timeline, and are applied separately for each group, so
+        each one gets up to count notes. As with get_timeline_and_unseen_count, filters don't
+        apply to the unseen counts.
+        The user's feed is read once for all the groups, and only through the newest
+        ENTITY_SCAN_LIMIT entries, as are their unseen notes for the counts.
+        Returns a dict mapping from group id to a (timeline, unseen count) tuple.
+        """
+        if not group_ids:
+            return {}
+        groups = [Entity(g_id, "group") for g_id in group_ids]
+        docs = [g.to_dict() for g in groups]
+        feeds = [list() for g in groups]
+        key = get_user_key(self.user) if include_seen else get_unseen_key(self.user)
+        for batch in self._scan(key, reverse, None, None, limit=ENTITY_SCAN_LIMIT):
+            for note in self._read(batch, include_seen, level, verb, None):
+                for idx, doc in enumerate(docs):
+                    if len(feeds[idx]) < count and self._references(note, doc):
+                        feeds[idx].append(note)
+            if all(len(feed) >= count for feed in feeds):
+                break
+        unseen = self._count_unseen(groups)
+        return {g_id: (feeds[idx], unseen[idx]) for idx, g_id in enumerate(group_ids)}
+
+    def get_single_activity_from_timeline(self, note_id: str) -> dict:
         r = get_redis_connection()
-        user_key = get_user_key(self.user_id)
-        user_timeline = r.zrevrange(user_key, 0, count)
-        return user_timeline
+        if r.zscore(get_user_key(self.user), note_id) is None:
+            return None
+        return next(iter(self._read([note_id], True, None, None, None)), None)
+
+    def get_ids_in_timeline(self, note_ids: List[str]) -> List[str]:
+        """
+        Returns the ones of the given note ids that are in the user's timeline.
+        """
+        if not note_ids:
+            return []
+        pipe = get_redis_connection().pipeline(transaction=False)
+        for note_id in note_ids:
+            pipe.zscore(get_user_key(self.user), note_id)
+        return [n for n, score in zip(note_ids, pipe.execute()) if score is not None]
 
-    def add_to_timeline(self, activity):
+    def get_unseen_count(self) -> int:
+        """
+        Returns the number of unseen, unexpired notes for the user.
+        """
+        return RedisUnseenCountStorage().get_counts([self.user])[0]
+
+    def get_unseen_counts(self, others: List[Entity]) -> List[int]:
+        """
+        Returns the unseen count for this timeline's user, followed by the unseen counts for
+        each of the others, in order.
+        """
+        return RedisUnseenCountStorage().get_counts([self.user] + others)
+
+    def _count_unseen(self, entities: List[Entity]) -> List[int]:
+        """
+        Counts the user's unseen notes that reference each of the given Entities, in order,
+        out of the newest ENTITY_SCAN_LIMIT unseen ones.
+        """
+        docs = [e.to_dict() for e in entities]
+        counts = [0] * len(entities)
+        for batch in self._scan(get_unseen_key(self.user), False, None, None,
+                                limit=ENTITY_SCAN_LIMIT):
+            for note in self._read(batch, False, None, None, None):
+                for idx, doc in enumerate(docs):
+                    if self._references(note, doc):
+                        counts[idx] += 1
+        return counts
+
+    def _scan(self, key: str, reverse: bool, before: Tuple[int, str],
+              after: Tuple[int, str], limit: Optional[int]=None) -> Iterator[List[str]]:
+        """
+        Yields batches of activity ids from the sorted set at key, newest first (or oldest
+        first if reverse), limited to those strictly between the after and before positions.
+        Members with the same score come in order of their ids, which matches the
+        (created, id) order used everywhere else.
+        If limit is given, no more than that many members get read from the set.
+        """
         r = get_redis_connection()
-        feed_key = get_user_key(self.user_id)
-        r.zadd(feed_key, activity.time, activity.id)
+        low = after[0] if after is not None else "-inf"
+        high = before[0] if before is not None else "+inf"
+        start = 0
+        while True:
+            num = SCAN_BATCH
+            if limit is not None:
+                num = min(num, limit - start)
+                if num <= 0:
+                    return
+            if reverse:
+                batch = r.zrangebyscore(key, low, high, start=start, num=num,
+                                        withscores=True)
+            else:
+                batch = r.zrevrangebyscore(key, high, low, start=start, num=num,
+                                           withscores=True)
+            ids = list()
+            for act_id, score in batch:
+                position = (int(score), act_id)
+                if before is not None and position >= tuple(before):
+                    continue
+                if after is not None and position <= tuple(after):
+                    continue
+                ids.append(act_id)
+            if ids:
+                yield ids
+            if len(batch) < num:
+                return
+            start += num
 
-    def remove_from_timeline(self, activity):
-        raise NotImplementedError()
+    def _read(self, act_ids: List[str], include_seen: bool, level: Level, verb: Verb,
+              entity: Entity) -> List[dict]:
+        """
+        Fetches the given activities, in order, drops the ones that don't match the filters
+        (or have expired, but haven't been swept yet), and adds the seen flag for this user.
+        """
+        now = epoch_ms()
+        found = RedisActivityStorage().get_by_id(act_ids)
+        notes = list()
+        for act_id in act_ids:
+            note = found[act_id]
+            if note is None or note["expires"] <= now:
+                continue
+            if level is not None and note["level"] != level.id:
+                continue
+            if verb is not None and note["verb"] != verb.id:
+                continue
+            if entity is not None and not self._references(note, entity.to_dict()):
+                continue
+            notes.append(note)
+        if not include_seen:
+            for note in notes:
+                note["seen"] = False
+            return notes
+        pipe = get_redis_connection().pipeline(transaction=False)
+        for note in notes:
+            pipe.zscore(get_unseen_key(self.user), note["id"])
+        for note, unseen in zip(notes, pipe.execute()):
+            note["seen"] = unseen is None
+        return notes
+
+    @staticmethod
+    def _references(note: dict, entity_doc: Dict[str, str]) -> bool:
+        return entity_doc in [note["actor"], note["object"]] + note.get("target", [])
@@ -0,0 +1,62 @@
+from typing import (
+    List,
+    Dict
+)
+from ..base import UnseenCountStorage
+from .connection import get_redis_connection
+from .activity_storage import get_unswept_expired
+from .util import get_unseen_key
+from feeds.entity.entity import Entity
+
+"""
+Each user's unseen activities are already kept in their own sorted set, so there's nothing
+extra to store - a count is just the size of that set, less any expired activities in it that
+haven't been swept out yet. Those get checked by a small Lua script, so each user's count is
+a single call, however many there are.
+"""
+
+_COUNT_SCRIPT = """
+local count = redis.call('zcard', KEYS[1])
+for i = 1, #ARGV do
+    if redis.call('zscore', KEYS[1], ARGV[i]) then
+        count = count - 1
+    end
+end
+return count
+"""
+
+
+class RedisUnseenCountStorage(UnseenCountStorage):
+    def increment(self, users: List[Entity], amount: int=1) -> None:
+        """
+        Nothing to do, counts always come straight from the unseen sets.
+        """
+        pass
+
+    def adjust(self, amounts: Dict[Entity, int]) -> None:
+        """
+        Nothing to do, counts always come straight from the unseen sets.
+        """
+        pass
+
+    def reconcile_stale(self, batch_size: int) -> int:
+        """
+        Nothing to do, counts always come straight from the unseen sets.
+        """
+        return 0
+
+    def get_counts(self, users: List[Entity]) -> List[int]:
+        """
+        Returns the unseen counts for each of the given users, in order.
+        """
+        expired = get_unswept_expired()
+        r = get_redis_connection()
+        pipe = r.pipeline(transaction=False)
+        if not expired:
+            for u in users:
+                pipe.zcard(get_unseen_key(u))
+            return pipe.execute()
+        script = r.register_script(_COUNT_SCRIPT)
+        for u in users:
+            script(keys=[get_unseen_key(u)], args=expired, client=pipe)
+        return pipe.execute()
@@ -1,9 +1,84 @@
-USER_FEED_KEY = "feed:user:{}"
+from typing import Tuple
+from feeds.entity.entity import Entity
+from feeds.util import is_sortable_id
+
+USER_FEED_KEY = "feed:{}"
+USER_UNSEEN_KEY = "unseen:{}"
 ACTIVITY_STORAGE_KEY = "notes:{}"
+ACTIVITY_USERS_KEY = "note_users:{}"
+EXTERNAL_KEY_KEY = "ext_keys:{}"
+EXPIRES_KEY = "expires"
+EXPIRED_KEY = "expired"
+ARCHIVE_STORAGE_KEY = "archive:{}"
+ARCHIVE_EXTERNAL_KEY_KEY = "archive_ext_keys:{}"
+FEED_VERSIONS_KEY = "feed_versions"
+GLOBAL_SEEN_KEY = "global_seen:{}"
+CHANGES_CHANNEL = "feeds:changes"
+TIMELINE_CACHE_KEY = "timeline_cache:{}"
+TIMELINE_CACHE_NOTES_KEY = "timeline_cache_notes:{}"
+TIMELINE_CACHE_UNSEEN_KEY = "timeline_cache_unseen:{}"
+TIMELINE_CACHE_META_KEY = "timeline_cache_meta:{}"
+GROUP_MEMBERS_KEY = "group_members:{}"
+LEASE_KEY = "lease:{}"
+
+
+def get_user_key(user: Entity) -> str:
+    """
+    The sorted set of all the user's activity ids, scored by creation time.
+    """
+    return USER_FEED_KEY.format(str(user))
+
+
+def get_unseen_key(user: Entity) -> str:
+    """
+    The sorted set of the user's unseen activity ids, scored by creation time.
+    """
+    return USER_UNSEEN_KEY.format(str(user))
+
+
+def get_activity_users_key(act_id: str) -> str:
+    """
+    The set of everyone (as str(Entity)) who got an activity.
+    """
+    return ACTIVITY_USERS_KEY.format(act_id)
+
+
+def get_external_key_key(source: str) -> str:
+    """
+    The hash from external key to activity id for a source.
+    """
+    return EXTERNAL_KEY_KEY.format(source)
+
+
+def get_archive_external_key_key(source: str) -> str:
+    """
+    The hash from external key to activity id for a source's archived activities.
+    """
+    return ARCHIVE_EXTERNAL_KEY_KEY.format(source)
 
 
-def get_user_key(user):
-    return USER_FEED_KEY.format(user)
+def get_global_seen_key(user: Entity) -> str:
+    return GLOBAL_SEEN_KEY.format(str(user))
+
+
+def get_timeline_cache_keys(user: Entity) -> Tuple[str, str, str, str]:
+    """
+    The keys of a user's cached timeline - the sorted set of ids, the hash of serialized
+    activities, the set of unseen ids, and the hash of info about the cache.
+    """
+    return (
+        TIMELINE_CACHE_KEY.format(str(user)),
+        TIMELINE_CACHE_NOTES_KEY.format(str(user)),
+        TIMELINE_CACHE_UNSEEN_KEY.format(str(user)),
+        TIMELINE_CACHE_META_KEY.format(str(user))
+    )
+
+
+def get_group_members_key(group_id: str) -> str:
+    """
+    A group's cached members, as a JSON list of user names.
+    """
+    return GROUP_MEMBERS_KEY.format(group_id)
 
 
 def get_note_id(note):
@@ -12,8 +87,32 @@ def get_note_id(note):
 
 def get_activity_key(activity):
     if isinstance(activity, bytes):
-        return ACTIVITY_STORAGE_KEY.format(activity.decode('utf-8')[0])
+        return ACTIVITY_STORAGE_KEY.format(_shard(activity.decode('utf-8')))
     elif hasattr(activity, "id"):
-        return ACTIVITY_STORAGE_KEY.format(activity.id[0])
+        return ACTIVITY_STORAGE_KEY.format(_shard(activity.id))
     else:
-        return ACTIVITY_STORAGE_KEY.format(activity[0])
+        return ACTIVITY_STORAGE_KEY.format(_shard(activity))
+
+
+def get_archive_key(activity_id: str) -> str:
+    """
+    Archived activities are kept the same way as get_activity_key, in their own hashes.
+    """
+    return ARCHIVE_STORAGE_KEY.format(_shard(activity_id))
+
+
+def _shard(activity_id: str) -> str:
+    """
+    Sortable ids all start with the time, so they're spread out by their last (random)
+    character instead. Older UUID ids use their first character, like they always have.
+    """
+    if is_sortable_id(activity_id):
+        return activity_id[-1]
+    return activity_id[0]
+
+
+def get_lease_key(name: str) -> str:
+    """
+    The owner of a lease, which expires along with the lease.
+    """
+    return LEASE_KEY.format(name)
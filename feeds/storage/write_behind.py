@@ -0,0 +1,189 @@
+import atexit
+import threading
+import time
+from collections import deque
+from typing import (
+    List,
+    Optional
+)
+from .factory import get_activity_storage
+from feeds.config import get_config
+from feeds.entity.entity import Entity
+from feeds.exceptions import ActivityStorageError
+from feeds.logger import (
+    log,
+    log_error
+)
+
+"""
+A write-behind queue for new activities, set up by write-behind in the config.
+
+With it on, NotificationManager.add_notification hands each new activity to the queue instead
+of storing it. A single background flusher takes them off the queue in batches, and stores each
+batch with add_many_to_storage. So under a burst of posts, each handled in its own greenlet,
+the storage gets one write per batch instead of one per activity.
+
+A batch gets written once there are write-batch-size activities waiting, or once the first
+one has waited write-batch-wait ms, whichever comes first. At most write-queue-size can be
+waiting at once - past that, adding another blocks until there's room, and fails with an
+ActivityStorageError after PUT_TIMEOUT seconds.
+
+* async - an activity is acknowledged as soon as it's queued. Anything still queued when the
+  process goes down is lost, and failures to store it are only logged. Since nothing waits for
+  the store, a retry that idempotent-writes would have matched up with an earlier activity
+  can't report that one's id, so the config doesn't allow the two together.
+* durable - adding an activity waits until the batch it's in has been stored, and raises an
+  ActivityStorageError if that failed, the same as storing it directly. It also raises one if
+  the store takes longer than WRITE_TIMEOUT seconds - the activity might still get stored
+  after that, so it's up to the client to retry (which idempotent-writes makes safe).
+"""
+
+PUT_TIMEOUT = 5  # seconds
+WRITE_TIMEOUT = 30  # seconds
+FLUSH_TIMEOUT = 10  # seconds
+
+_queue = None
+_queue_lock = threading.Lock()
+
+
+def get_write_queue() -> Optional["WriteBehindQueue"]:
+    """
+    Returns this process's write-behind queue, or None if write-behind is off.
+    """
+    global _queue
+    cfg = get_config()
+    if cfg.write_behind == "off":
+        return None
+    with _queue_lock:
+        if _queue is None:
+            _queue = WriteBehindQueue(
+                cfg.write_batch_size, cfg.write_batch_wait, cfg.write_queue_size,
+                cfg.write_behind == "durable"
+            )
+            atexit.register(_queue.flush, FLUSH_TIMEOUT)
+        return _queue
+
+
+class _Entry(object):
+    def __init__(self, activity, target_users: List[Entity]):
+        self.activity = activity
+        self.target_users = target_users
+        self.error = None
+        self.done = threading.Event()
+
+
+class WriteBehindQueue(object):
+    def __init__(self, batch_size: int, batch_wait: int, max_size: int, durable: bool,
+                 put_timeout: float=PUT_TIMEOUT, write_timeout: float=WRITE_TIMEOUT):
+        """
+        :param batch_size: the most activities to store at once
+        :param batch_wait: how long (ms) the first activity in a batch waits for others
+        :param max_size: the most activities that can wait in the queue
+        :param durable: if True, add waits for its activity to be stored
+        :param put_timeout: how long (seconds) add waits for room in the queue
+        :param write_timeout: how long (seconds) a durable add waits for its activity to be
+            stored
+        """
+        self.batch_size = batch_size
+        self.batch_wait = batch_wait / 1000
+        self.max_size = max_size
+        self.durable = durable
+        self.put_timeout = put_timeout
+        self.write_timeout = write_timeout
+        self._pending = deque()
+        self._writing = 0
+        self._flushing = False
+        self._cond = threading.Condition()
+        self._flusher = None
+
+    def add(self, activity, target_users: List[Entity]) -> None:
+        """
+        Queues the activity to be stored for the target users.
+        Raises an ActivityStorageError if the queue stays full for put_timeout seconds, or, if
+        this queue is durable, if storing the activity fails or takes longer than
+        write_timeout seconds.
+        """
+        entry = _Entry(activity, target_users)
+        deadline = time.time() + self.put_timeout
+        with self._cond:
+            while len(self._pending) >= self.max_size:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    raise ActivityStorageError("Failed to store activity: the write queue is full")
+                self._cond.wait(remaining)
+            self._pending.append(entry)
+            self._start_flusher()
+            self._cond.notify_all()
+        if self.durable:
+            if not entry.done.wait(self.write_timeout):
+                raise ActivityStorageError(
+                    "Failed to store activity: timed out waiting for it to be written"
+                )
+            if entry.error is not None:
+                raise ActivityStorageError(entry.error)
+
+    def flush(self, timeout: Optional[float]=None) -> bool:
+        """
+        Writes everything that's queued right away, and waits for it to be stored. Returns
+        False if that took longer than timeout seconds.
+        """
+        deadline = None if timeout is None else time.time() + timeout
+        with self._cond:
+            self._flushing = True
+            self._cond.notify_all()
+            try:
+                while self._pending or self._writing:
+                    remaining = None if deadline is None else deadline - time.time()
+                    if remaining is not None and remaining <= 0:
+                        return False
+                    self._cond.wait(remaining)
+            finally:
+                self._flushing = False
+        return True
+
+    def _start_flusher(self) -> None:
+        if self._flusher is None:
+            self._flusher = threading.Thread(target=self._run, daemon=True)
+            self._flusher.start()
+
+    def _run(self) -> None:
+        while True:
+            batch = self._next_batch()
+            self._write(batch)
+            with self._cond:
+                self._writing -= len(batch)
+                self._cond.notify_all()
+
+    def _next_batch(self) -> List[_Entry]:
+        """
+        Waits for a batch to be ready, and takes it off the queue.
+        """
+        with self._cond:
+            while not self._pending:
+                self._cond.wait()
+            deadline = time.time() + self.batch_wait
+            while len(self._pending) < self.batch_size and not self._flushing:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+            count = min(self.batch_size, len(self._pending))
+            batch = [self._pending.popleft() for i in range(count)]
+            self._writing += count
+            # there's room for anyone who's waiting to add
+            self._cond.notify_all()
+        return batch
+
+    def _write(self, batch: List[_Entry]) -> None:
+        try:
+            errors = get_activity_storage().add_many_to_storage(
+                [(e.activity, e.target_users) for e in batch]
+            )
+        except Exception as e:
+            log_error(__name__, e)
+            errors = [str(e)] * len(batch)
+        for entry, error in zip(batch, errors):
+            entry.error = error
+            entry.done.set()
+            if error is not None and not self.durable:
+                log(__name__, "Failed to store queued activity %s: %s", entry.activity.id, error)
@@ -1,5 +1,64 @@
+import base64
+import json
+import os
 from datetime import datetime
+from typing import Tuple
+from .exceptions import IllegalParameterError
+
+
+# Crockford's base32, used by ULIDs - no I, L, O, or U, so ids are easy to read out.
+_ID_ALPHABET = "0123456789ABCDEFGHJKMNPQRSTVWXYZ"
+_ID_TIME_CHARS = 10
+_ID_RANDOM_CHARS = 16
+SORTABLE_ID_LENGTH = _ID_TIME_CHARS + _ID_RANDOM_CHARS
 
 
 def epoch_ms():
     return int(datetime.utcnow().timestamp() * 1000)
+
+
+def sortable_id(timestamp: int) -> str:
+    """
+    Makes a new ULID-style id - a 26 character string that starts with the given timestamp
+    (ms since epoch) and ends with 80 random bits. Ids made from later timestamps sort after
+    ones made from earlier timestamps, so ids made from creation times sort the same way as
+    (created, id) pairs.
+    """
+    value = (timestamp << 80) | int.from_bytes(os.urandom(10), "big")
+    chars = list()
+    for i in range(SORTABLE_ID_LENGTH):
+        chars.append(_ID_ALPHABET[value & 31])
+        value >>= 5
+    return "".join(reversed(chars))
+
+
+def is_sortable_id(s: str) -> bool:
+    """
+    True if s looks like an id made by sortable_id, as opposed to the UUIDs that older
+    notifications have.
+    """
+    return len(s) == SORTABLE_ID_LENGTH and all(c in _ID_ALPHABET for c in s)
+
+
+def encode_cursor(created: int, note_id: str) -> str:
+    """
+    Builds an opaque pagination cursor from a notification's creation time and id.
+    The (created, id) pair gives a total ordering over notifications, so it can be used
+    as a keyset position in a feed.
+    """
+    raw = json.dumps([created, note_id], separators=(',', ':'))
+    return base64.urlsafe_b64encode(raw.encode('utf-8')).decode('utf-8')
+
+
+def decode_cursor(cursor: str) -> Tuple[int, str]:
+    """
+    Turns a cursor made by encode_cursor back into a (created, id) tuple.
+    Raises an IllegalParameterError if the cursor is malformed.
+    """
+    try:
+        (created, note_id) = json.loads(base64.urlsafe_b64decode(cursor.encode('utf-8')))
+    except (ValueError, TypeError):
+        raise IllegalParameterError("Invalid cursor '{}'".format(cursor))
+    if not isinstance(created, int) or isinstance(created, bool) or not isinstance(note_id, str):
+        raise IllegalParameterError("Invalid cursor '{}'".format(cursor))
+    return (created, note_id)
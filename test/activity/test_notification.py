@@ -4,7 +4,7 @@ from feeds.activity.notification import Notification
 import uuid
 from feeds.util import epoch_ms
 from ..util import (
-    assert_is_uuid,
+    assert_is_sortable_id,
     test_config
 )
 from feeds.exceptions import (
@@ -55,7 +55,11 @@ def assert_note_ok(note, **kwargs):
     if 'expires' not in kwargs:
         assert note.expires == note.created + (int(cfg.get('feeds', 'lifespan')) * 24 * 60 * 60 * 1000)
     assert note.created < note.expires
-    assert_is_uuid(note.id)
+    if 'id' in kwargs:
+        # older notes have UUIDs, and still need to load.
+        assert note.id == kwargs['id']
+    else:
+        assert_is_sortable_id(note.id)
 
 def test_note_new_ok_no_kwargs():
     note = Notification(actor, verb_inf, note_object, source)
@@ -318,7 +322,7 @@ def test_serialization():
     serial = note.serialize()
     json_serial = json.loads(serial)
     assert "i" in json_serial
-    assert_is_uuid(json_serial['i'])
+    assert_is_sortable_id(json_serial['i'])
     assert "a" in json_serial and json_serial['a'] == str(actor)
     assert "v" in json_serial and json_serial['v'] == verb_id
     assert "o" in json_serial and json_serial['o'] == str(note_object)
@@ -338,7 +342,7 @@ def test_serialization_all_kwargs():
     serial = note.serialize()
     json_serial = json.loads(serial)
     assert "i" in json_serial
-    assert_is_uuid(json_serial['i'])
+    assert_is_sortable_id(json_serial['i'])
     assert "a" in json_serial and json_serial['a'] == str(actor)
     assert "v" in json_serial and json_serial['v'] == verb_id
     assert "o" in json_serial and json_serial['o'] == str(note_object)
@@ -84,6 +84,33 @@ def test_add_global_notification_expiration(client, mock_valid_admin_token, mong
     assert "id" in data
 
 
+def test_add_global_notification_refreshes_cache(client, mock_valid_admin_token, mock_valid_users, mongo):
+    mock_valid_users({"kbase": "KBase"})
+    mock_valid_admin_token("kbase_admin", "KBase Admin")
+    auth = {"Authorization": "token-"+str(uuid4())}
+    before = json.loads(client.get("/api/V1/notifications/global").data)
+    # fetch it again, should be served from the cache
+    assert json.loads(client.get("/api/V1/notifications/global").data) == before
+
+    response = client.post(
+        "/admin/api/V1/notification/global",
+        headers=auth,
+        json={"verb": 1, "object": "2", "level": 1}
+    )
+    note_id = json.loads(response.data)["id"]
+    after = json.loads(client.get("/api/V1/notifications/global").data)
+    assert after["feed"][0]["id"] == note_id
+    assert len(after["feed"]) == len(before["feed"]) + 1
+
+    client.post(
+        "/admin/api/V1/notifications/expire",
+        headers=auth,
+        json={"note_ids": [note_id]}
+    )
+    expired = json.loads(client.get("/api/V1/notifications/global").data)
+    assert note_id not in [n["id"] for n in expired["feed"]]
+
+
 def test_add_global_notification_user_auth(client, mock_valid_user_token):
     mock_valid_user_token("not_admin", "Not Admin")
     response = client.post(
@@ -14,7 +14,7 @@ def test_api_root(client):
     response = client.get('/api/V1')
     data = json.loads(response.data)
     assert 'routes' in data
-    assert len(data['routes']) == 7
+    assert len(data['routes']) == 10
 
 ###
 # GET /notifications
@@ -76,6 +76,42 @@ def test_get_notifications_filtered(client, mock_valid_user_token, mock_valid_us
     note_order = [n['id'] for n in data['user']['feed']]
     assert note_order == expected
 
+def test_get_notifications_paged(client, mock_valid_user_token, mock_valid_users, mock_workspace_info, mongo_notes):
+    mock_valid_user_token("test_user", "Test User")
+    mock_valid_users({
+        "kbasetest": "KBase Test",
+        "test_user": "Test User",
+        "_kbase_": "KBase Admin"
+    })
+    mock_workspace_info(["123", "A_Workspace", "owner", "Timestamp", 18, "a", "n", "unlocked", {"narrative": "1", "narrative_nice_name": "Some Narrative"}])
+    auth = {"Authorization": "token-"+str(uuid4())}
+    pages = list()
+    route = '/api/V1/notifications?seen=1&n=4'
+    while True:
+        data = json.loads(client.get(route, headers=auth).data)
+        if not data['user']['feed']:
+            assert data['user']['cursor'] is None
+            break
+        pages.append([n['id'] for n in data['user']['feed']])
+        route = '/api/V1/notifications?seen=1&n=4&before=' + data['user']['cursor']
+    assert pages == [['10', '9', '8', '7'], ['6', '5', '4', '3'], ['2', '1']]
+
+    # and back the other way from the oldest note
+    data = json.loads(client.get('/api/V1/notifications?seen=1&n=1&rev=1', headers=auth).data)
+    assert [n['id'] for n in data['user']['feed']] == ['1']
+    cursor = data['user']['cursor']
+    response = client.get('/api/V1/notifications?seen=1&n=2&rev=1&after=' + cursor, headers=auth)
+    assert [n['id'] for n in json.loads(response.data)['user']['feed']] == ['2', '3']
+    response = client.get('/api/V1/notifications?seen=1&n=3&after=' + cursor, headers=auth)
+    assert [n['id'] for n in json.loads(response.data)['user']['feed']] == ['10', '9', '8']
+
+def test_get_notifications_bad_cursor(client, mock_valid_user_token):
+    mock_valid_user_token("test_user", "Test User")
+    response = client.get('/api/V1/notifications?before=nope', headers={"Authorization": "token-"+str(uuid4())})
+    data = json.loads(response.data)
+    assert data['error']['http_code'] == 400
+    assert data['error']['message'] == "Invalid cursor 'nope'"
+
 def test_get_notifications_no_auth(client):
     response = client.get('/api/V1/notifications')
     data = json.loads(response.data)
@@ -167,6 +203,58 @@ def test_post_notification_ok(client, mock_valid_service_token, mock_valid_user_
     assert len(data_return['user']['feed']) == 0
 
 
+def test_post_notifications_bulk(client, mock_valid_service_token, mock_valid_user_token, mock_valid_users, mock_workspace_info, mongo_notes):
+    service = "a_service"
+    test_user = "test_bulk_note"
+    test_actor = "test_actor"
+    mock_valid_users({test_actor: "Test Actor", test_user: "Test User"})
+    mock_workspace_info(["stuff", "A_Workspace", "owner", "Timestamp", 18, "a", "n", "unlocked", {"narrative": "1", "narrative_nice_name": "Some Narrative"}])
+    mock_valid_service_token("user", "pw", service)
+    note = {
+        "actor": {"id": test_actor, "type": "user"},
+        "users": [{"id": test_user, "type": "user"}],
+        "verb": 1,
+        "level": 1,
+        "object": {"id": "stuff", "type": "workspace"},
+        "source": service
+    }
+    bad_note = dict(note)
+    del bad_note["actor"]
+    response = client.post(
+        "/api/V1/notifications/bulk",
+        headers={"Authorization": "token-"+str(uuid4())},
+        json={"notifications": [
+            note, bad_note, dict(note, verb="not_a_verb"), note, dict(note, context="oops"),
+            dict(note, actor="user::" + test_actor)
+        ]}
+    )
+    assert response.status_code == 200
+    results = json.loads(response.data)["notifications"]
+    assert len(results) == 6
+    assert results[0]["error"] is None and results[3]["error"] is None
+    assert results[1] == {"id": None, "error": "Missing parameter - actor"}
+    assert results[2]["id"] is None and "not_a_verb" in results[2]["error"]
+    assert results[4]["id"] is None and results[4]["error"] is not None
+    # Entities are only read from strings in storage, not from the API
+    assert results[5]["id"] is None and "dictionary" in results[5]["error"]
+    mock_valid_user_token(test_user, "Some Name")
+    response = client.get("/api/V1/notifications", headers={"Authorization": "token-"+str(uuid4())})
+    feed = json.loads(response.data)["user"]["feed"]
+    assert sorted(n["id"] for n in feed) == sorted([results[0]["id"], results[3]["id"]])
+
+
+def test_post_notifications_bulk_too_many(client, mock_valid_service_token):
+    mock_valid_service_token("user", "pw", "a_service")
+    response = client.post(
+        "/api/V1/notifications/bulk",
+        headers={"Authorization": "token-"+str(uuid4())},
+        json={"notifications": [{}] * 1001}
+    )
+    data = json.loads(response.data)
+    assert data['error']['http_code'] == 400
+    assert data['error']['message'] == 'Can only add up to 1000 notifications at a time.'
+
+
 def test_post_notification_no_auth(client):
     response = client.post('/api/V1/notification')
     data = json.loads(response.data)
@@ -204,6 +292,18 @@ def test_get_global_notifications(client, mock_valid_users, mock_workspace_info)
     data = json.loads(response.data)
     assert len(data["feed"]) >= 1 and data["feed"][-1]["id"] == "global-1"
 
+def test_get_global_notifications_paging(client, mock_valid_users, mock_workspace_info):
+    mock_valid_users({"kbasetest": "KBase Test", "_kbase_": "KBase Admin"})
+    mock_workspace_info(["123", "A_Workspace", "owner", "Timestamp", 18, "a", "n", "unlocked", {"narrative": "1", "narrative_nice_name": "Some Narrative"}])
+    data = json.loads(client.get('/api/V1/notifications/global').data)
+    all_ids = [n["id"] for n in data["feed"]]
+    first = json.loads(client.get('/api/V1/notifications/global?n=1').data)
+    assert [n["id"] for n in first["feed"]] == all_ids[:1]
+    response = client.get('/api/V1/notifications/global?before=' + first["cursor"])
+    assert [n["id"] for n in json.loads(response.data)["feed"]] == all_ids[1:]
+    response = client.get('/api/V1/notifications/global?before=nope')
+    assert response.status_code == 400
+
 ###
 # GET /notification/<note_id>
 ###
@@ -467,6 +567,60 @@ def test_mark_notifications_unseen_invalid_auth(client, mongo_notes, mock_invali
     assert 'error' in data
     assert data['error']['http_code'] == 403
 
+###
+# POST /notifications/see_all
+###
+
+def test_mark_all_notifications_seen(client, mongo_notes, mock_valid_user_token):
+    from feeds.storage.mongodb.activity_storage import MongoActivityStorage
+    from feeds.activity.notification import Notification
+    from feeds.entity.entity import Entity
+    reader = Entity("test_see_all", "user")
+    notes = list()
+    for level in ["alert", "alert", "request"]:
+        note = Notification(Entity("kbasetest", "user"), "invite", Entity("123", "workspace"),
+                            "ws", level=level)
+        MongoActivityStorage().add_to_storage(note, [reader])
+        notes.append(note)
+    mock_valid_user_token(reader.id, "Test All Seer")
+    auth = {"Authorization": "token-"+str(uuid4())}
+    response = client.post("/api/V1/notifications/see_all", json={"level": "alert"}, headers=auth)
+    assert json.loads(response.data) == {"seen_count": 2}
+    response = client.get('/api/V1/notifications/unseen_count', headers=auth)
+    data = json.loads(response.data)
+    assert data['unseen']['user'] == 1
+    assert data['unseen']['global'] == 1
+
+    response = client.post("/api/V1/notifications/see_all", headers=auth)
+    assert json.loads(response.data) == {"seen_count": 1}
+    response = client.get('/api/V1/notifications/unseen_count', headers=auth)
+    data = json.loads(response.data)
+    assert data['unseen'] == {'user': 0, 'global': 0}
+
+def test_mark_all_notifications_seen_no_auth(client):
+    response = client.post('/api/V1/notifications/see_all')
+    data = json.loads(response.data)
+    assert 'error' in data
+    assert data['error']['http_code'] == 401
+
+@pytest.mark.parametrize("params,expected_error", [
+    ("foo", "Expected a JSON object as an input."),
+    ({"level": "not_a_level"}, 'Level "not_a_level" not found.'),
+    ({"source": 123}, "Expected a string as source."),
+    ({"before": "yesterday"}, "Expected a timestamp in epoch milliseconds as before."),
+    ({"before": -1}, "Expected a timestamp in epoch milliseconds as before.")
+])
+def test_mark_all_notifications_seen_errors(client, mock_valid_user_token, params, expected_error):
+    mock_valid_user_token("some_user", "Some User")
+    response = client.post(
+        "/api/V1/notifications/see_all",
+        headers={"Authorization": "token-"+str(uuid4())},
+        json=params
+    )
+    data = json.loads(response.data)
+    assert data["error"]["http_code"] == 400
+    assert data["error"]["message"] == expected_error
+
 ###
 # POST /notifications/expire
 ###
@@ -608,6 +762,104 @@ def test_get_unseen_count_invalid_auth(client, mock_invalid_user_token):
     assert 'error' in data
     assert data['error']['http_code'] == 403
 
+def test_get_unseen_count_etag(client, mock_valid_user_token):
+    mock_valid_user_token('test_user', 'Test User')
+    auth = {"Authorization": "token-"+str(uuid4())}
+    route = '/api/V1/notifications/unseen_count'
+    response = client.get(route, headers=auth)
+    etag = response.headers['ETag']
+    response = client.get(route, headers=dict(auth, **{"If-None-Match": etag}))
+    assert response.status_code == 304
+    assert response.data == b''
+
+    # marking a note as seen makes a new version of the feed
+    client.post('/api/V1/notifications/see', json={"note_ids": ['7']}, headers=auth)
+    response = client.get(route, headers=dict(auth, **{"If-None-Match": etag}))
+    assert response.status_code == 200
+    assert json.loads(response.data)['unseen']['user'] == 6
+    assert response.headers['ETag'] != etag
+    client.post('/api/V1/notifications/unsee', json={"note_ids": ['7']}, headers=auth)
+
+def test_get_notifications_etag(client, mock_valid_user_token, mock_valid_users, mock_workspace_info, requests_mock):
+    mock_valid_user_token("test_user", "Test User")
+    mock_valid_users({
+        "kbasetest": "KBase Test",
+        "test_user": "Test User",
+        "_kbase_": "KBase Admin"
+    })
+    mock_workspace_info(["123", "A_Workspace", "owner", "Timestamp", 18, "a", "n", "unlocked", {"narrative": "1", "narrative_nice_name": "Some Narrative"}])
+    auth = {"Authorization": "token-"+str(uuid4())}
+    response = client.get('/api/V1/notifications?n=2', headers=auth)
+    etag = response.headers['ETag']
+    response = client.get('/api/V1/notifications?n=2', headers=dict(auth, **{"If-None-Match": etag}))
+    assert response.status_code == 304
+    # different params, different response
+    response = client.get('/api/V1/notifications?n=3', headers=dict(auth, **{"If-None-Match": etag}))
+    assert response.status_code == 200
+    assert len(json.loads(response.data)['user']['feed']) == 3
+    # the user's groups are only looked up once
+    assert len([r for r in requests_mock.request_history if r.path.endswith('/member/')]) == 1
+
+###
+# GET /notifications/stream
+###
+
+class _FakeHub(object):
+    """
+    Stands in for the notification hub, which needs a change stream, so the test can hand
+    the stream its changes.
+    """
+    def __init__(self):
+        import queue
+        self.changes = queue.Queue()
+
+    def subscribe(self, user):
+        return self.changes
+
+    def unsubscribe(self, user, q):
+        pass
+
+
+def _next_event(events):
+    (event, data) = next(events).decode('utf-8').strip().split('\n')
+    return (event[len('event: '):], json.loads(data[len('data: '):]))
+
+
+def test_stream_notifications(client, mock_valid_user_token, mock_valid_users, monkeypatch):
+    import feeds.api.api_v1 as api
+    from feeds.activity.notification import Notification
+    from feeds.entity.entity import Entity
+    from feeds.storage.mongodb.notification_hub import ChangeEvent
+    hub = _FakeHub()
+    monkeypatch.setattr(api, "get_notification_hub", lambda: hub)
+    monkeypatch.setattr(api, "STREAM_RECOUNT_WAIT", 0)
+    mock_valid_user_token('test_user', 'Test User')
+    mock_valid_users({"stream_actor": "Stream Actor", "test_user": "Test User"})
+    response = client.get('/api/V1/notifications/stream', headers={"Authorization": "token-"+str(uuid4())}, buffered=False)
+    assert response.status_code == 200
+    assert response.mimetype == 'text/event-stream'
+    events = iter(response.response)
+    assert _next_event(events) == ('unseen', {'unseen': {'user': 7, 'global': 1}})
+
+    # a new notification adds to the count, without looking it up again
+    note = Notification(Entity("stream_actor", "user"), "invite", Entity("test_user", "user"),
+                        "test", users=[Entity("test_user", "user")])
+    hub.changes.put(ChangeEvent("insert", note.to_dict(), False))
+    (event, data) = _next_event(events)
+    assert event == 'notification' and data['id'] == note.id
+    assert data['actor']['name'] == "Stream Actor" and data['seen'] is False
+    assert _next_event(events) == ('unseen', {'unseen': {'user': 8, 'global': 1}})
+
+    # other changes get the count looked up again
+    hub.changes.put(ChangeEvent("update", note.to_dict(), False))
+    assert _next_event(events) == ('unseen', {'unseen': {'user': 7, 'global': 1}})
+    response.close()
+
+def test_stream_notifications_no_auth(client):
+    response = client.get('/api/V1/notifications/stream')
+    data = json.loads(response.data)
+    assert data['error']['http_code'] == 401
+
 
 def _validate_notification(note):
     """
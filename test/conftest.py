@@ -8,6 +8,7 @@ from feeds.util import epoch_ms
 import test.util as test_util
 from .util import test_config
 from .mongo_controller import MongoController
+from .redis_controller import RedisController
 import shutil
 import time
 import re
@@ -34,14 +35,29 @@ def mongo_notes(mongo):
 
 @pytest.fixture(scope="module")
 def mongo():
+    yield from _run_mongo()
+
+@pytest.fixture(scope="module")
+def mongo_replset():
+    """
+    A MongoDB running as a single node replica set, for tests that need change streams.
+    """
+    yield from _run_mongo(replica_set="feeds_test")
+
+def _run_mongo(replica_set=None):
     mongoexe = test_util.get_mongo_exe()
     tempdir = test_util.get_temp_dir()
-    mongo = MongoController(mongoexe, tempdir)
+    mongo = MongoController(mongoexe, tempdir, replica_set=replica_set)
     print("running MongoDB {} on port {} in dir {}".format(
         mongo.db_version, mongo.port, mongo.temp_dir
     ))
     feeds.config.__config.db_port = mongo.port
     feeds.storage.mongodb.connection._connection = None
+    # imported as aliases, so they don't shadow the feeds package in here
+    import feeds.api.util as api_util
+    import feeds.storage.factory as storage_factory
+    api_util._global_feed_cache.clear()
+    storage_factory._hub = None
 
     yield mongo
     del_temp = test_util.get_delete_temp_files()
@@ -51,6 +67,47 @@ def mongo():
         shutil.rmtree(test_util.get_temp_dir())
     # time.sleep(5) # wait for Mongo to go away
 
+@pytest.fixture(scope="module")
+def redis():
+    """
+    A Redis server, with the config switched over to the redis db-engine while it runs.
+    """
+    yield from _run_redis(("db_engine", "db_port"), lambda port: ("redis", port))
+
+@pytest.fixture(scope="module")
+def timeline_cache():
+    """
+    A Redis server, set up as the timeline cache while it runs.
+    """
+    yield from _run_redis(("cache_host", "cache_port"), lambda port: ("localhost", port))
+
+def _run_redis(cfg_keys, cfg_values):
+    redisexe = test_util.get_redis_exe()
+    tempdir = test_util.get_temp_dir()
+    redis = RedisController(redisexe, tempdir)
+    print("running Redis {} on port {} in dir {}".format(
+        redis.db_version, redis.port, redis.temp_dir
+    ))
+    cfg = feeds.config.get_config()
+    backup = [getattr(cfg, key) for key in cfg_keys]
+    for key, value in zip(cfg_keys, cfg_values(redis.port)):
+        setattr(cfg, key, value)
+    import feeds.api.util as api_util
+    import feeds.storage.factory as storage_factory
+    feeds.storage.redis.connection.connection_pools.clear()
+    storage_factory._hub = None
+    api_util._global_feed_cache.clear()
+
+    yield redis
+    for key, value in zip(cfg_keys, backup):
+        setattr(cfg, key, value)
+    feeds.storage.redis.connection.connection_pools.clear()
+    storage_factory._hub = None
+    api_util._global_feed_cache.clear()
+    del_temp = test_util.get_delete_temp_files()
+    print("Shutting down Redis,{} deleting temp files".format(" not" if not del_temp else ""))
+    redis.destroy(del_temp)
+
 @pytest.fixture(scope="module")
 def app():
     from feeds.server import create_app
@@ -299,6 +356,9 @@ def mock_user_groups(requests_mock):
         cfg = test_config()
         groups_url = cfg.get('feeds', 'groups-url')
         requests_mock.get("{}/member/".format(groups_url), json=groups)
+        # drop groups the API cached from an earlier mock
+        import feeds.api.util as api_util
+        api_util._user_groups_cache.clear()
     return user_groups
 
 
@@ -312,6 +372,27 @@ def mock_group_names(requests_mock):
     return group_names
 
 
+@pytest.fixture
+def mock_group_members(requests_mock):
+    """
+    Mocks looking up groups, with the given dict from group id to group info. Any other group
+    is a 404. Returns the requests_mock Mocker, so tests can count the calls.
+    """
+    def group_members(groups):
+        cfg = test_config()
+        groups_url = cfg.get('feeds', 'groups-url')
+        def respond(request, context):
+            g_id = request.path.rstrip("/").split("/")[-1]
+            if g_id not in groups:
+                context.status_code = 404
+                return {"error": {"httpcode": 404, "message": "No group " + g_id}}
+            return dict(groups[g_id], id=g_id)
+        matcher = re.compile("^{}/group/[^/]+$".format(re.escape(groups_url)))
+        requests_mock.register_uri("GET", matcher, json=respond)
+        return requests_mock
+    return group_members
+
+
 ###################################
 ### WORKSPACE SERVICE API MOCKING
 ###################################
@@ -375,6 +456,45 @@ def mock_workspace_info_invalid(requests_mock):
     return invalid_workspace_info
 
 
+def workspace_permissions_matcher(req):
+    body = json.loads(req.text)
+    return body.get("method") == "Workspace.administer" and \
+        body["params"][0].get("command") == "getPermissionsMass"
+
+@pytest.fixture
+def mock_workspace_permissions(requests_mock):
+    """
+    Mocks the getPermissionsMass admin command with the given dict from workspace id to
+    permissions. Asking for any other workspace fails, like the Workspace does for a missing
+    one. Returns the requests_mock Mocker, so tests can count the calls.
+    """
+    def workspace_permissions(perms):
+        cfg = test_config()
+        ws_url = cfg.get('feeds', 'workspace-url')
+        def respond(request, context):
+            params = json.loads(request.text)["params"][0]["params"]
+            ws_ids = [str(w["id"]) for w in params["workspaces"]]
+            missing = [ws_id for ws_id in ws_ids if ws_id not in perms]
+            if missing:
+                context.status_code = 500
+                return {
+                    "version": "1.1",
+                    "error": {
+                        "name": "JSONRPCError",
+                        "code": "-32500",
+                        "message": "No workspace with id {} exists".format(missing[0]),
+                        "error": "Long winded exception..."
+                    }
+                }
+            return {"version": "1.1", "result": [{"perms": [perms[ws_id] for ws_id in ws_ids]}]}
+        requests_mock.register_uri("POST", ws_url,
+            additional_matcher=workspace_permissions_matcher,
+            json=respond
+        )
+        return requests_mock
+    return workspace_permissions
+
+
 #######################################
 ### CATALOG/NMS SERVICE API MOCKING ###
 #######################################
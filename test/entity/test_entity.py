@@ -153,7 +153,9 @@ def test_entity_from_dict():
     ({"id": "wat", "type": "nope"}, EntityValidationError, "is not a valid type for an Entity"),
     ({"type": "user"}, EntityValidationError, "An Entity requires an id!"),
     ({"id": "foo"}, EntityValidationError, "An Entity requires a type!"),
-    ("some str", AssertionError, "from_dict requires a dictionary input!")
+    (["some", "list"], AssertionError, "from_dict requires a dictionary input!"),
+    ("some str", AssertionError, "from_dict requires a dictionary input!"),
+    ("user::foo", AssertionError, "from_dict requires a dictionary input!")
 ])
 def test_entity_from_dict_fail(d, err, msg):
     with pytest.raises(err) as e:
@@ -180,6 +182,13 @@ def test_entity_from_str():
     assert e.type == etype
 
 
+def test_entity_from_stored():
+    e = Entity("foo", "user")
+    assert Entity.from_stored("user::foo") == e
+    assert Entity.from_stored({"id": "foo", "type": "user"}) == e
+    assert Entity.from_stored(str(e)).to_dict() == e.to_dict()
+
+
 @pytest.mark.parametrize("s,err,msg", [
     ("nope::stuff", EntityValidationError, "is not a valid type for an Entity"),
     ("123::foo", EntityValidationError, "is not a valid type for an Entity"),
@@ -2,7 +2,8 @@ import pytest
 from feeds.external_api.groups import (
     get_user_groups,
     get_group_names,
-    validate_group_id
+    validate_group_id,
+    get_group_members
 )
 from feeds.exceptions import GroupsError
 
@@ -43,3 +44,15 @@ def test_get_group_names(mock_group_names):
     for n in ["g1", "g2"]:
         assert n in names
         assert names[n] == std[n]
+
+def test_get_group_members(mock_group_members):
+    mock_group_members({
+        "g1": {"owner": "o", "admins": ["a"], "members": ["m1", "m2", "a"]}
+    })
+    members = get_group_members(["g1", "nope"])
+    assert members == {"g1": ["o", "a", "m1", "m2"], "nope": None}
+
+def test_get_group_members_fail(mock_network_error):
+    with pytest.raises(GroupsError) as e:
+        get_group_members(["g1"])
+    assert "Unable to fetch group information" in str(e)
@@ -6,8 +6,10 @@ from feeds.external_api.workspace import (
     get_workspace_name,
     get_workspace_names,
     get_narrative_name,
-    get_narrative_names
+    get_narrative_names,
+    get_workspace_acls
 )
+import feeds.external_api.workspace as workspace
 from feeds.exceptions import WorkspaceError
 
 DUMMY_WS_INFO = [1, "some_name"]
@@ -135,3 +137,59 @@ def test_get_narr_names_fail(mock_valid_user_token, mock_workspace_info_invalid)
 def test_get_narr_names_err(mock_valid_user_token, mock_workspace_info_error):
     pass
 
+def test_get_workspace_acls(mock_workspace_permissions):
+    mocker = mock_workspace_permissions({
+        "101": {"owner": "a", "writer": "w", "reader": "r", "nobody": "n", "*": "r"},
+        "102": {"owner2": "a"}
+    })
+    acls = get_workspace_acls([101, "102", "103"])
+    assert acls == {
+        "101": {"owner": "a", "writer": "w", "reader": "r"},
+        "102": {"owner2": "a"},
+        "103": {}
+    }
+    # one call for all three, then, since 103 is missing, for [101] and [102, 103], then for
+    # [102] and [103]
+    assert mocker.call_count == 5
+    # they're all cached now
+    assert get_workspace_acls(["101", "103"]) == {"101": acls["101"], "103": {}}
+    assert mocker.call_count == 5
+    assert "102" in workspace.__acl_cache
+
+def test_get_workspace_acls_batches(mock_workspace_permissions, monkeypatch):
+    monkeypatch.setattr(workspace, "MAX_PERMISSIONS_MASS", 2)
+    mocker = mock_workspace_permissions({str(i): {"user" + str(i): "r"} for i in range(201, 206)})
+    acls = get_workspace_acls(list(range(201, 206)))
+    assert acls == {str(i): {"user" + str(i): "r"} for i in range(201, 206)}
+    assert mocker.call_count == 3
+
+def test_get_workspace_acls_err(requests_mock):
+    from requests.exceptions import ConnectionError
+    requests_mock.register_uri("POST", workspace.config.ws_url, exc=ConnectionError)
+    with pytest.raises(WorkspaceError) as e:
+        get_workspace_acls([301])
+    assert "Unable to fetch workspace permissions" in str(e)
+    assert "301" not in workspace.__acl_cache
+
+def test_get_workspace_acls_bisects(mock_workspace_permissions):
+    mocker = mock_workspace_permissions({str(i): {"user" + str(i): "r"} for i in range(501, 516)})
+    acls = get_workspace_acls(list(range(501, 517)))
+    assert acls["516"] == {} and acls["501"] == {"user501": "r"}
+    # the batch gets halved until the missing workspace is found, instead of trying each one
+    assert mocker.call_count == 9
+
+def test_get_workspace_acls_server_err(requests_mock):
+    requests_mock.register_uri("POST", workspace.config.ws_url, status_code=500, json={
+        "version": "1.1",
+        "error": {
+            "name": "JSONRPCError",
+            "code": "-32400",
+            "message": "Token validation failed!",
+            "error": "Long winded exception..."
+        }
+    })
+    with pytest.raises(WorkspaceError) as e:
+        get_workspace_acls([302, 303])
+    assert "Token validation failed" in str(e)
+    assert requests_mock.call_count == 1
+    assert "302" not in workspace.__acl_cache
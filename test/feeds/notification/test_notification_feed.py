@@ -1,6 +1,7 @@
 import pytest
 from feeds.feeds.notification.notification_feed import NotificationFeed
 from feeds.activity.notification import Notification
+from feeds.entity.entity import Entity
 
 USER = "test_user"
 USER_TYPE = "user"
@@ -32,3 +33,42 @@ def test_update_timeline(mongo_notes):
     assert len(feed.timeline) == 7
     for n in feed.timeline:
         assert isinstance(n, dict)
+
+def test_get_notifications_unseen_ignores_filters(mongo_notes):
+    feed = NotificationFeed(USER, USER_TYPE)
+    notes = feed.get_notifications(count=2, include_seen=True)
+    assert [n.id for n in notes["feed"]] == ["10", "9"]
+    assert notes["unseen"] == 7
+
+def test_get_unseen_counts(mongo_notes):
+    feed = NotificationFeed(USER, USER_TYPE)
+    others = [Entity("test_user2", "user"), Entity("test_user3", "user"), Entity("nobody", "user")]
+    assert feed.get_unseen_counts(others) == [7, 5, 3, 0]
+
+def test_get_groups_notifications(mongo_notes, mock_valid_users, mock_group_names):
+    groups = [{"id": "group1", "name": "Group 1"}, {"id": "some_group", "name": "Some Group"}]
+    mock_valid_users({"kbasetest": "KBase Test", "test_user": "Test User"})
+    mock_group_names(groups)
+    feed = NotificationFeed("test_group_user", USER_TYPE)
+    notes = feed.get_groups_notifications(groups, count=5)
+    assert set(notes.keys()) == {"group1", "some_group"}
+    assert notes["group1"]["feed"] == []
+    assert notes["group1"]["unseen"] == 0
+    assert notes["group1"]["cursor"] is None
+    assert notes["some_group"]["name"] == "Some Group"
+    assert notes["some_group"]["unseen"] == 1
+    assert [n["id"] for n in notes["some_group"]["feed"]] == ["group-feed-test"]
+    assert notes["some_group"]["feed"][0]["object"]["name"] == "Some Group"
+    assert feed.get_groups_notifications([]) == {}
+
+def test_get_group_notifications(mongo_notes, mock_valid_users, mock_group_names):
+    group = {"id": "some_group", "name": "Some Group"}
+    mock_valid_users({"kbasetest": "KBase Test", "test_user": "Test User"})
+    mock_group_names([group])
+    feed = NotificationFeed("test_group_user", USER_TYPE)
+    notes = feed.get_group_notifications(group, count=1)
+    assert notes["name"] == "Some Group"
+    assert notes["unseen"] == 1
+    assert [n["id"] for n in notes["feed"]] == ["group-feed-test"]
+    notes = feed.get_group_notifications({"id": "other_group", "name": "Other"})
+    assert notes["feed"] == [] and notes["unseen"] == 0
@@ -0,0 +1,60 @@
+import pytest
+from feeds.ingest.brokers import (
+    MemoryBroker,
+    FileBroker,
+    get_broker
+)
+from feeds.config import get_config
+from feeds.exceptions import ConfigError
+
+
+def test_memory_broker():
+    broker = MemoryBroker(["a", "b", "c"])
+    batch = broker.poll(2)
+    assert [m.value for m in batch] == ["a", "b"]
+    broker.commit(batch)
+    assert [m.value for m in broker.poll(2)] == ["c"]
+    broker.rewind()
+    broker.send("d")
+    assert [m.value for m in broker.poll(5)] == ["c", "d"]
+    assert broker.poll(5) == []
+
+
+def test_file_broker(tmpdir):
+    path = str(tmpdir.join("messages.ndjson"))
+    with open(path, "w") as f:
+        f.write('{"n": 1}\n\n{"n": 2}\n{"n": 3}\n{"n": ')
+    broker = FileBroker(path)
+    batch = broker.poll(2, timeout=0)
+    assert [m.value for m in batch] == ['{"n": 1}', '{"n": 2}']
+    broker.commit(batch)
+    # the partial line at the end isn't read until it's finished
+    assert [m.value for m in broker.poll(5, timeout=0)] == ['{"n": 3}']
+    broker.rewind()
+    with open(path, "a") as f:
+        f.write('4}\n')
+
+    # a new broker picks up from the last commit
+    broker = FileBroker(path)
+    assert [m.value for m in broker.poll(5, timeout=0)] == ['{"n": 3}', '{"n": 4}']
+    assert broker.poll(5, timeout=0) == []
+
+
+def test_get_broker(tmpdir):
+    cfg = get_config()
+    backup = (cfg.consumer_broker, cfg.consumer_file, cfg.consumer_servers)
+    try:
+        cfg.consumer_broker = "file"
+        cfg.consumer_file = None
+        with pytest.raises(ConfigError) as e:
+            get_broker()
+        assert str(e.value) == "consumer-file must be set to use the file consumer-broker"
+        cfg.consumer_file = str(tmpdir.join("messages.ndjson"))
+        assert isinstance(get_broker(), FileBroker)
+        cfg.consumer_broker = "kafka"
+        cfg.consumer_servers = None
+        with pytest.raises(ConfigError) as e:
+            get_broker()
+        assert str(e.value) == "consumer-servers must be set to use the kafka consumer-broker"
+    finally:
+        (cfg.consumer_broker, cfg.consumer_file, cfg.consumer_servers) = backup
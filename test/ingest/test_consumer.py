@@ -0,0 +1,185 @@
+import json
+import pytest
+from feeds.ingest.brokers import MemoryBroker
+from feeds.ingest.consumer import NotificationConsumer
+from feeds.storage.factory import get_activity_storage
+from feeds.storage.redis.timeline_storage import RedisTimelineStorage
+from feeds.config import get_config
+from feeds.exceptions import (
+    ActivityStorageError,
+    ConfigError
+)
+
+
+@pytest.fixture
+def idempotent_writes():
+    cfg = get_config()
+    cfg.idempotent_writes = True
+    yield
+    cfg.idempotent_writes = False
+
+
+def _notify(external_key, **kwargs):
+    note = {
+        "operation": "notify",
+        "actor": "junkypants",
+        "external_key": external_key,
+        "level": "request",
+        "verb": "request",
+        "context": {"resourcetype": "user"},
+        "source": "groupsservice",
+        "users": ["consumer_reader"],
+        "target": ["junkypants"],
+        "object": "i"
+    }
+    note.update(kwargs)
+    return json.dumps(note)
+
+
+def _cancel(external_keys):
+    return json.dumps({
+        "operation": "cancel", "source": "groupsservice", "external_ids": external_keys
+    })
+
+
+def test_consumer(redis, idempotent_writes):
+    broker = MemoryBroker([
+        _notify("consumer_key_1"),
+        "not json",
+        _notify("consumer_key_2", verb="not_a_verb"),
+        json.dumps({"operation": "explode"}),
+        _notify("consumer_key_3", users=["consumer_reader", "user::consumer_other"])
+    ])
+    consumer = NotificationConsumer(broker, batch_size=10, poll_timeout=0)
+    assert consumer.consume_batch() == 5
+    assert broker.committed == 5
+    found = get_activity_storage().get_by_external_key(
+        ["consumer_key_1", "consumer_key_2", "consumer_key_3"], "groupsservice"
+    )
+    assert found["consumer_key_2"] is None
+    note = found["consumer_key_1"]
+    assert note["actor"] == {"id": "junkypants", "type": "user"}
+    assert note["object"] == {"id": "i", "type": "group"}
+    assert note["target"] == [{"id": "junkypants", "type": "user"}]
+    timeline = RedisTimelineStorage("consumer_other", "user")
+    assert [n["id"] for n in timeline.get_timeline()] == [found["consumer_key_3"]["id"]]
+
+    broker.send(_cancel(["consumer_key_1", "consumer_key_3"]))
+    assert consumer.run(until_idle=True) == 1
+    timeline = RedisTimelineStorage("consumer_reader", "user")
+    assert timeline.get_timeline() == []
+
+
+def test_consumer_rewinds_on_failure(redis, idempotent_writes):
+    class FailingManager(object):
+        def add_notifications(self, notes, raise_store_errors=False):
+            raise ActivityStorageError("Failed to store activities: nope")
+
+    broker = MemoryBroker([_notify("consumer_retry_key")])
+    consumer = NotificationConsumer(broker, batch_size=10, poll_timeout=0)
+    real_manager = consumer.manager
+    consumer.manager = FailingManager()
+    with pytest.raises(ActivityStorageError):
+        consumer.consume_batch()
+    assert broker.committed == 0
+    consumer.manager = real_manager
+    assert consumer.consume_batch() == 1
+    assert broker.committed == 1
+    found = get_activity_storage().get_by_external_key(["consumer_retry_key"], "groupsservice")
+    assert found["consumer_retry_key"] is not None
+
+
+def test_consumer_rewinds_when_a_note_isnt_stored(redis, idempotent_writes, monkeypatch):
+    storage = get_activity_storage()
+    real_add_many = type(storage).add_many_to_storage
+
+    def failing_add_many(self, activities):
+        errors = real_add_many(self, activities[:1])
+        return errors + ["Failed to store activity: nope"] * (len(activities) - 1)
+
+    broker = MemoryBroker([
+        _notify("consumer_partial_1", users=["consumer_partial_reader"]),
+        _notify("consumer_partial_2", users=["consumer_partial_reader"])
+    ])
+    consumer = NotificationConsumer(broker, batch_size=10, poll_timeout=0)
+    monkeypatch.setattr(type(storage), "add_many_to_storage", failing_add_many)
+    with pytest.raises(ActivityStorageError):
+        consumer.consume_batch()
+    assert broker.committed == 0
+    assert broker.position == 0
+    monkeypatch.undo()
+    assert consumer.consume_batch() == 2
+    assert broker.committed == 2
+    timeline = RedisTimelineStorage("consumer_partial_reader", "user")
+    found = get_activity_storage().get_by_external_key(
+        ["consumer_partial_1", "consumer_partial_2"], "groupsservice"
+    )
+    assert sorted(n["id"] for n in timeline.get_timeline()) == sorted(
+        found[k]["id"] for k in found
+    )
+
+
+def test_consumer_skips_bad_messages(redis, idempotent_writes):
+    broker = MemoryBroker([
+        _notify("consumer_poison_1"),
+        _notify("consumer_poison_2"),
+        _notify("consumer_poison_3", context="oops"),
+        _notify("consumer_poison_4", actor=["not", "an", "entity"]),
+        _notify("consumer_poison_5")
+    ])
+    consumer = NotificationConsumer(broker, batch_size=10, poll_timeout=0)
+    assert consumer.consume_batch() == 5
+    assert broker.committed == 5
+    found = get_activity_storage().get_by_external_key(
+        ["consumer_poison_{}".format(i) for i in range(1, 6)], "groupsservice"
+    )
+    assert [k for k in sorted(found) if found[k] is not None] == [
+        "consumer_poison_1", "consumer_poison_2", "consumer_poison_5"
+    ]
+
+
+def test_consumer_applies_messages_in_order(redis, idempotent_writes):
+    broker = MemoryBroker([
+        _notify("consumer_order_1", users=["consumer_order_reader"]),
+        _cancel(["consumer_order_1", "consumer_order_2"]),
+        _notify("consumer_order_2", users=["consumer_order_reader"])
+    ])
+    consumer = NotificationConsumer(broker, batch_size=10, poll_timeout=0)
+    assert consumer.consume_batch() == 3
+    timeline = RedisTimelineStorage("consumer_order_reader", "user")
+    found = get_activity_storage().get_by_external_key(["consumer_order_2"], "groupsservice")
+    assert [n["id"] for n in timeline.get_timeline()] == [found["consumer_order_2"]["id"]]
+
+
+def test_consumer_replays_without_duplicates(redis, idempotent_writes):
+    class FailingCancels(object):
+        def __init__(self, manager):
+            self.manager = manager
+
+        def add_notifications(self, notes, raise_store_errors=False):
+            return self.manager.add_notifications(notes, raise_store_errors=raise_store_errors)
+
+        def expire_notifications(self, *args, **kwargs):
+            raise ActivityStorageError("Failed to expire activities: nope")
+
+    broker = MemoryBroker([
+        _notify("consumer_replay_key", users=["consumer_replay_reader"]),
+        _cancel(["consumer_other_key"])
+    ])
+    consumer = NotificationConsumer(broker, batch_size=10, poll_timeout=0)
+    real_manager = consumer.manager
+    consumer.manager = FailingCancels(real_manager)
+    with pytest.raises(ActivityStorageError):
+        consumer.consume_batch()
+    assert broker.committed == 0
+    consumer.manager = real_manager
+    assert consumer.consume_batch() == 2
+    timeline = RedisTimelineStorage("consumer_replay_reader", "user")
+    found = get_activity_storage().get_by_external_key(["consumer_replay_key"], "groupsservice")
+    assert [n["id"] for n in timeline.get_timeline()] == [found["consumer_replay_key"]["id"]]
+
+
+def test_consumer_needs_idempotent_writes():
+    with pytest.raises(ConfigError) as e:
+        NotificationConsumer(MemoryBroker(), batch_size=10, poll_timeout=0)
+    assert "idempotent-writes" in str(e)
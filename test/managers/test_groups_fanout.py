@@ -0,0 +1,56 @@
+from feeds.managers.fanout_modules.groups import GroupsFanout
+from feeds.activity.notification import Notification
+from feeds.entity.entity import Entity
+
+
+def _make_note(users, verb="invite", object_id="other_group"):
+    return Notification(
+        Entity("g_actor", "user"), verb, Entity(object_id, "group"), "groupsservice",
+        users=users
+    )
+
+
+def test_groups_fanout(mock_group_members):
+    mocker = mock_group_members({
+        "fan_g1": {"owner": "g_actor", "admins": ["g_admin"], "members": ["g_member"]},
+        "fan_g2": {"owner": "g_owner2", "admins": [], "members": []}
+    })
+    notes = [
+        _make_note([Entity("fan_g1", "group"), Entity("g_user", "user")]),
+        _make_note([Entity("fan_g1", "group"), Entity("fan_g2", "group")]),
+        _make_note([Entity("g_user", "user")]),
+        _make_note([Entity("fan_missing", "group")])
+    ]
+    targets = GroupsFanout.get_all_target_users(notes)
+    assert mocker.call_count == 3
+    assert set(targets[0]) == {
+        Entity("fan_g1", "group"), Entity("g_user", "user"), Entity("g_admin", "user"),
+        Entity("g_member", "user")
+    }
+    assert set(targets[1]) == {
+        Entity("fan_g1", "group"), Entity("fan_g2", "group"), Entity("g_admin", "user"),
+        Entity("g_member", "user"), Entity("g_owner2", "user")
+    }
+    assert targets[2] == [Entity("g_user", "user")]
+    assert targets[3] == [Entity("fan_missing", "group")]
+    # the members are cached
+    assert set(GroupsFanout(notes[0]).get_target_users()) == set(targets[0])
+    assert mocker.call_count == 3
+
+
+def test_groups_fanout_membership_change(mock_group_members):
+    groups = {"fan_g3": {"owner": "g_owner", "admins": [], "members": []}}
+    mocker = mock_group_members(groups)
+    note = _make_note([Entity("fan_g3", "group")])
+    assert Entity("g_new", "user") not in GroupsFanout(note).get_target_users()
+    groups["fan_g3"]["members"].append("g_new")
+    joined = _make_note([Entity("fan_g3", "group")], verb="join", object_id="fan_g3")
+    assert Entity("g_new", "user") in GroupsFanout(joined).get_target_users()
+    assert mocker.call_count == 2
+
+
+def test_groups_fanout_unreachable(mock_network_error):
+    note = _make_note([Entity("fan_g4", "group"), Entity("g_user", "user")])
+    assert set(GroupsFanout(note).get_target_users()) == {
+        Entity("fan_g4", "group"), Entity("g_user", "user")
+    }
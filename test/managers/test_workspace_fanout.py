@@ -0,0 +1,38 @@
+from feeds.managers.fanout_modules.workspace import WorkspaceFanout
+from feeds.activity.notification import Notification
+from feeds.entity.entity import Entity
+
+
+def _make_note(object_id, object_type="workspace"):
+    return Notification(
+        Entity("ws_actor", "user"), "share", Entity(object_id, object_type), "ws",
+        target=[Entity("ws_target", "user")], users=[Entity("ws_user", "user")]
+    )
+
+
+def test_workspace_fanout(mock_workspace_permissions):
+    mocker = mock_workspace_permissions({
+        "401": {"ws_actor": "a", "ws_reader": "r", "ws_target": "w"},
+        "402": {"narr_owner": "a"}
+    })
+    notes = [_make_note("401"), _make_note("402", "narrative"), _make_note("1", "job")]
+    targets = WorkspaceFanout.get_all_target_users(notes)
+    assert mocker.call_count == 1
+    assert set(targets[0]) == {
+        Entity("ws_user", "user"), Entity("ws_target", "user"), Entity("ws_reader", "user")
+    }
+    assert set(targets[1]) == {
+        Entity("ws_user", "user"), Entity("ws_target", "user"), Entity("narr_owner", "user")
+    }
+    assert set(targets[2]) == {Entity("ws_user", "user"), Entity("ws_target", "user")}
+    # the permissions are cached
+    assert set(WorkspaceFanout(notes[0]).get_target_users()) == set(targets[0])
+    assert mocker.call_count == 1
+
+
+def test_workspace_fanout_unreachable(requests_mock):
+    from requests.exceptions import ConnectionError
+    from feeds.config import get_config
+    requests_mock.register_uri("POST", get_config().ws_url, exc=ConnectionError)
+    targets = WorkspaceFanout(_make_note("403")).get_target_users()
+    assert set(targets) == {Entity("ws_user", "user"), Entity("ws_target", "user")}
@@ -30,7 +30,8 @@ class MongoController:
         indexes, false otherwise.
     """
 
-    def __init__(self, mongoexe: Path, root_temp_dir: Path, use_wired_tiger: bool=False) -> None:
+    def __init__(self, mongoexe: Path, root_temp_dir: Path, use_wired_tiger: bool=False,
+                 replica_set: str=None) -> None:
         '''
         Create and start a new MongoDB database. An unused port will be selected for the server.
         :param mongoexe: The path to the MongoDB server executable (e.g. mongod) to run.
@@ -38,6 +39,8 @@ class MongoController:
             The files will be stored inside a child directory that is unique per invocation.
         :param use_wired_tiger: For MongoDB versions > 3.0, specify that the Wired Tiger storage
             engine should be used. Setting this to true for other versions will cause an error.
+        :param replica_set: If given, the server is started as the only member of a replica set
+            with this name, so features like change streams are available.
         '''
         if not mongoexe or not os.access(mongoexe, os.X_OK):
             raise test_util.TestException('mongod executable path {} does not exist or is not executable.'
@@ -63,18 +66,27 @@ class MongoController:
         if use_wired_tiger:
             command.extend(['--storageEngine', 'wiredTiger'])
 
+        if replica_set:
+            command.extend(['--replSet', replica_set])
+
         self._outfile = open(self.temp_dir.joinpath('mongo.log'), 'w')
 
         self._proc = subprocess.Popen(command, stdout=self._outfile, stderr=subprocess.STDOUT)
         time.sleep(1)  # wait for server to start up
 
         try:
-            self.client: MongoClient = MongoClient('localhost', self.port)
+            # an uninitiated replica set member can only be reached directly
+            self.client: MongoClient = MongoClient(
+                'localhost', self.port, directConnection=bool(replica_set)
+            )
             # This line will raise an exception if the server is down
             server_info = self.client.server_info()
         except Exception as e:
             raise ValueError("MongoDB server is down") from e
 
+        if replica_set:
+            self._initiate_replica_set(replica_set)
+
         # get some info about the db
         self.db_version = server_info['version']
         self.index_version = 2 if (semver.compare(self.db_version, '3.4.0') >= 0) else 1
@@ -82,6 +94,18 @@ class MongoController:
             semver.compare(self.db_version, '3.2.0') < 0 and not use_wired_tiger
         )
 
+    def _initiate_replica_set(self, replica_set: str) -> None:
+        self.client.admin.command('replSetInitiate', {
+            '_id': replica_set,
+            'members': [{'_id': 0, 'host': 'localhost:{}'.format(self.port)}]
+        })
+        # wait for this node to become the primary
+        for _ in range(30):
+            if self.client.admin.command('isMaster').get('ismaster'):
+                return
+            time.sleep(1)
+        raise ValueError("MongoDB replica set {} never elected a primary".format(replica_set))
+
     def get_mongodb_version(self, mongoexe: Path) -> str:
         try:
             process = subprocess.Popen(
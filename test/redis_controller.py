@@ -0,0 +1,75 @@
+"""
+A controller for Redis useful for running tests.
+Production use is not recommended.
+"""
+from pathlib import Path
+import os
+import tempfile
+import subprocess
+import time
+import shutil
+import redis
+import test.util as test_util
+
+
+class RedisController:
+    """
+    The main Redis controller class.
+    Attributes:
+    port - the port for the Redis server.
+    temp_dir - the location of the Redis log.
+    client - a redis client pointed at the server.
+    db_version - the version of the redis-server executable.
+    """
+
+    def __init__(self, redisexe: Path, root_temp_dir: Path) -> None:
+        '''
+        Create and start a new Redis server, with persistence turned off. An unused port will be
+        selected for the server.
+        :param redisexe: The path to the Redis server executable (e.g. redis-server) to run.
+        :param root_temp_dir: A temporary directory in which to store the Redis log file.
+            The file will be stored inside a child directory that is unique per invocation.
+        '''
+        if not redisexe or not os.access(redisexe, os.X_OK):
+            raise test_util.TestException('redis-server executable path {} does not exist or is not executable.'
+                                .format(redisexe))
+        if not root_temp_dir:
+            raise ValueError('root_temp_dir is None')
+
+        root_temp_dir = root_temp_dir.absolute()
+        os.makedirs(root_temp_dir, exist_ok=True)
+        self.temp_dir = Path(tempfile.mkdtemp(prefix='RedisController-', dir=str(root_temp_dir)))
+
+        self.port = test_util.find_free_port()
+        command = [
+            str(redisexe), '--port', str(self.port), '--dir', str(self.temp_dir),
+            '--save', '', '--appendonly', 'no'
+        ]
+        self._outfile = open(self.temp_dir.joinpath('redis.log'), 'w')
+        self._proc = subprocess.Popen(command, stdout=self._outfile, stderr=subprocess.STDOUT)
+        time.sleep(0.5)  # wait for server to start up
+
+        try:
+            self.client = redis.StrictRedis('localhost', self.port, decode_responses=True)
+            # This line will raise an exception if the server is down
+            self.db_version = self.client.info()['redis_version']
+        except Exception as e:
+            raise ValueError("Redis server is down") from e
+
+    def destroy(self, delete_temp_files: bool) -> None:
+        """
+        Shut down the Redis server.
+        :param delete_temp_files: delete the Redis log generated during the test.
+        """
+        if self._proc:
+            self._proc.terminate()
+        if self._outfile:
+            self._outfile.close()
+        if delete_temp_files and self.temp_dir:
+            shutil.rmtree(self.temp_dir)
+
+    def clear_database(self) -> None:
+        '''
+        Remove all data from the server.
+        '''
+        self.client.flushall()
@@ -0,0 +1,281 @@
+import time
+import pytest
+from feeds.storage.mongodb.activity_storage import MongoActivityStorage
+from feeds.storage.mongodb.unseen_count_storage import MongoUnseenCountStorage
+from feeds.storage.mongodb.lease_storage import MongoLeaseStorage
+from feeds.activity.notification import Notification
+from feeds.entity.entity import Entity
+from feeds.managers.archive_manager import (
+    ArchiveManager,
+    reconcile_unseen_counts
+)
+from feeds.storage.mongodb.connection import get_feeds_collection
+import feeds.storage.mongodb.connection as connection
+from feeds.storage.mongodb.timeline_storage import MongoTimelineStorage
+from feeds.util import epoch_ms
+from feeds.config import get_config
+
+
+def _make_note(external_key=None):
+    return Notification(
+        Entity("kbasetest", "user"), "invite", Entity("123", "workspace"), "ws",
+        external_key=external_key
+    )
+
+
+def test_unseen_counts_follow_writes(mongo):
+    storage = MongoActivityStorage()
+    counts = MongoUnseenCountStorage()
+    reader = Entity("count_reader", "user")
+    other = Entity("count_other", "user")
+    assert counts.get_counts([reader, other]) == [0, 0]
+
+    notes = [_make_note() for i in range(3)]
+    for n in notes:
+        storage.add_to_storage(n, [reader, other])
+    assert counts.get_counts([reader, other]) == [3, 3]
+
+    storage.set_seen([notes[0].id, notes[1].id], reader)
+    assert counts.get_counts([reader, other]) == [1, 3]
+    # seeing an already seen note doesn't change anything
+    storage.set_seen([notes[0].id], reader)
+    assert counts.get_counts([reader, other]) == [1, 3]
+
+    storage.set_unseen([notes[0].id], reader)
+    assert counts.get_counts([reader, other]) == [2, 3]
+
+    storage.expire_notifications([notes[0].id, notes[2].id])
+    assert counts.get_counts([reader, other]) == [0, 1]
+    assert counts.reconcile([reader, other]) == {str(reader): 0, str(other): 1}
+
+
+def test_set_all_seen(mongo):
+    from feeds.notification_level import translate_level
+    storage = MongoActivityStorage()
+    counts = MongoUnseenCountStorage()
+    reader = Entity("all_seen_reader", "user")
+    other = Entity("all_seen_other", "user")
+    notes = list()
+    for i in range(4):
+        note = _make_note()
+        note.created = note.created + i
+        note.level = translate_level("alert" if i % 2 == 0 else "request")
+        storage.add_to_storage(note, [reader, other])
+        notes.append(note)
+
+    assert storage.set_all_seen(reader, level=translate_level("request"),
+                                before=notes[3].created) == 1
+    assert counts.get_counts([reader, other]) == [3, 4]
+    assert storage.set_all_seen(reader, source="not_ws") == 0
+    assert storage.set_all_seen(reader) == 3
+    assert counts.get_counts([reader, other]) == [0, 4]
+    assert counts.reconcile([reader]) == {str(reader): 0}
+    timeline = MongoTimelineStorage(reader.id, reader.type).get_timeline(count=10)
+    assert timeline == []
+
+
+def test_expire_by_id_or_external_key(mongo):
+    storage = MongoActivityStorage()
+    counts = MongoUnseenCountStorage()
+    reader = Entity("expire_key_reader", "user")
+    notes = [_make_note(external_key="expire_key_{}".format(i)) for i in range(4)]
+    for n in notes:
+        storage.add_to_storage(n, [reader])
+    storage.set_seen([notes[1].id], reader)
+    assert counts.get_counts([reader]) == [3]
+
+    (ids, keys) = storage.expire_by_id_or_external_key(
+        [notes[0].id], ["expire_key_1"], source="not_ws"
+    )
+    assert ids == [] and keys == []
+    (ids, keys) = storage.expire_by_id_or_external_key(
+        [notes[0].id, "not_a_note"], ["expire_key_1", "expire_key_2", "missing_key"],
+        source="ws"
+    )
+    assert ids == [notes[0].id]
+    assert keys == ["expire_key_1", "expire_key_2"]
+    # only the unseen ones come off the count
+    assert counts.get_counts([reader]) == [1]
+    timeline = MongoTimelineStorage(reader.id, reader.type).get_timeline(count=10)
+    assert [n["id"] for n in timeline] == [notes[3].id]
+
+    # already expired notes are still found, and external keys need a source
+    (ids, keys) = storage.expire_by_id_or_external_key([notes[0].id], ["expire_key_3"])
+    assert ids == [notes[0].id] and keys == []
+    assert counts.get_counts([reader]) == [1]
+
+
+def test_unseen_counts_reconcile_drift(mongo):
+    counts = MongoUnseenCountStorage()
+    user = Entity("count_drift", "user")
+    assert counts.get_counts([user]) == [0]
+    MongoActivityStorage().add_to_storage(_make_note(), [user])
+    counts.increment([user], 10)
+    assert counts.get_counts([user]) == [11]
+    assert counts.reconcile([user]) == {str(user): 1}
+    assert counts.get_counts([user]) == [1]
+
+
+def test_unseen_counts_reconcile_stale(mongo):
+    counts = MongoUnseenCountStorage()
+    coll = connection.get_unseen_counts_collection()
+    user = Entity("count_stale", "user")
+    idle = Entity("count_stale_idle", "user")
+    assert counts.get_counts([user, idle]) == [0, 0]
+    counts.increment([user], 10)
+    # just reconciled, so reads don't fix it
+    assert counts.get_counts([user]) == [10]
+    coll.update_many({"_id": {"$in": [str(user), str(idle)]}}, {"$set": {"reconciled": 1}})
+    coll.update_one({"_id": str(idle)}, {"$set": {"count": 5}})
+    assert counts.get_counts([user]) == [10]
+    assert reconcile_unseen_counts() >= 1
+    assert counts.get_counts([user]) == [0]
+    assert "touched" not in coll.find_one({"_id": str(user)})
+    # nobody adjusted or read the idle count, so it's left alone until it gets read
+    assert coll.find_one({"_id": str(idle)})["count"] == 5
+    assert counts.get_counts([idle]) == [5]
+    assert reconcile_unseen_counts() >= 1
+    assert counts.get_counts([idle]) == [0]
+    assert counts.reconcile_stale(10) == 0
+
+
+def test_unseen_counts_start_from_the_notes(mongo):
+    counts = MongoUnseenCountStorage()
+    user = Entity("count_new", "user")
+    storage = MongoActivityStorage()
+    for i in range(2):
+        storage.add_to_storage(_make_note(), [user])
+    connection.get_unseen_counts_collection().delete_one({"_id": str(user)})
+    # a new count starts at the adjustment, but gets computed before it's read
+    counts.increment([user], 1)
+    assert counts.get_counts([user]) == [2]
+
+
+def test_archive_expired(mongo):
+    storage = MongoActivityStorage()
+    reader = Entity("archive_reader", "user")
+    notes = [_make_note(external_key="archive_{}".format(i)) for i in range(3)]
+    for n in notes:
+        storage.add_to_storage(n, [reader])
+    storage.expire_notifications([notes[0].id, notes[1].id])
+    # still in the grace period
+    assert ArchiveManager().archive_expired() == 0
+    assert storage.archive_expired(epoch_ms() + 1, 1) in [[notes[0].id], [notes[1].id]]
+    assert ArchiveManager(grace_days=0).archive_expired() == 1
+
+    assert storage.get_by_id([notes[0].id, notes[1].id]) == {notes[0].id: None, notes[1].id: None}
+    found = storage.get_by_id([notes[0].id, notes[2].id], include_archived=True)
+    assert found[notes[0].id]["id"] == notes[0].id
+    assert found[notes[2].id]["id"] == notes[2].id
+    found = storage.get_by_external_key(["archive_1", "archive_2"], "ws", include_archived=True)
+    assert found["archive_1"]["id"] == notes[1].id
+    assert found["archive_2"]["id"] == notes[2].id
+    assert storage.get_by_external_key(["archive_1"], "ws") == {"archive_1": None}
+
+
+def test_lease(mongo):
+    leases = MongoLeaseStorage()
+    assert leases.acquire("mongo_lease", "owner1", 100) is True
+    assert leases.acquire("mongo_lease", "owner2", 100) is False
+    # the owner can renew it
+    assert leases.acquire("mongo_lease", "owner1", 100) is True
+    time.sleep(0.2)
+    assert leases.acquire("mongo_lease", "owner2", 100) is True
+    assert leases.acquire("mongo_lease", "owner1", 100) is False
+
+
+def test_add_many_to_storage(mongo):
+    storage = MongoActivityStorage()
+    reader = Entity("bulk_reader", "user")
+    other = Entity("bulk_other", "user")
+    notes = [_make_note() for i in range(3)]
+    storage.add_to_storage(notes[1], [reader])
+    errors = storage.add_many_to_storage([(n, [reader, other]) for n in notes])
+    assert errors[0] is None and errors[2] is None
+    # notes[1] was already stored, the rest still go in
+    assert errors[1] is not None
+    stored = storage.get_by_id([n.id for n in notes])
+    assert all(stored[n.id] is not None for n in notes)
+    assert MongoUnseenCountStorage().get_counts([reader, other]) == [3, 2]
+    assert storage.add_many_to_storage([]) == []
+
+
+def test_idempotent_writes(mongo):
+    cfg = get_config()
+    storage = MongoActivityStorage()
+    reader = Entity("retry_reader", "user")
+    note = _make_note(external_key="retry_key")
+    retry = _make_note(external_key="retry_key")
+    bulk = [_make_note(external_key="retry_key"), _make_note(external_key="bulk_key"),
+            _make_note(external_key="bulk_key")]
+    cfg.idempotent_writes = True
+    # reconnecting leaves the sparse external key index in place, and migrating the indexes
+    # swaps it for the unique one
+    connection._connection = None
+    try:
+        assert "external_key_unique" not in get_feeds_collection().index_information()
+        assert connection.get_mongo_connection().migrate_indexes() == ["external_key_1_source_1"]
+        assert "external_key_unique" in get_feeds_collection().index_information()
+        storage.add_to_storage(note, [reader])
+        storage.add_to_storage(retry, [reader])
+        assert retry.id == note.id
+        assert storage.add_many_to_storage([(n, [reader]) for n in bulk]) == [None, None, None]
+    finally:
+        cfg.idempotent_writes = False
+        connection._connection = None
+    assert "external_key_unique" in get_feeds_collection().index_information()
+    assert connection.get_mongo_connection().migrate_indexes() == ["external_key_unique"]
+    assert "external_key_unique" not in get_feeds_collection().index_information()
+    assert bulk[0].id == note.id
+    assert bulk[2].id == bulk[1].id
+    assert get_feeds_collection().count_documents({"external_key": "retry_key"}) == 1
+    assert get_feeds_collection().count_documents({"external_key": "bulk_key"}) == 1
+    assert MongoUnseenCountStorage().get_counts([reader]) == [2]
+
+
+def test_sortable_ids_and_legacy_ids(mongo):
+    storage = MongoActivityStorage()
+    reader = Entity("id_reader", "user")
+    note = _make_note()
+    storage.add_to_storage(note, [reader])
+    assert get_feeds_collection().find_one({"_id": note.id})["id"] == note.id
+
+    # an older note, with a UUID id and an ObjectId _id
+    legacy = _make_note()
+    legacy.id = "ad0e9c2a-7b1f-4e5e-9a55-5d2b3b04d7c6"
+    legacy_doc = legacy.to_dict()
+    legacy_doc["users"] = [reader.to_dict()]
+    legacy_doc["unseen"] = [reader.to_dict()]
+    get_feeds_collection().insert_one(legacy_doc)
+
+    found = storage.get_by_id([note.id, legacy.id])
+    assert found[note.id]["id"] == note.id
+    assert found[legacy.id]["id"] == legacy.id
+    storage.set_seen([note.id, legacy.id], reader)
+    timeline = MongoTimelineStorage(reader.id, reader.type)
+    assert timeline.get_single_activity_from_timeline(legacy.id)["seen"] is True
+    assert timeline.get_single_activity_from_timeline(note.id)["seen"] is True
+    assert "id_1" not in get_feeds_collection().index_information()
+
+
+def test_indexes_are_only_dropped_by_migration(mongo):
+    cfg = get_config()
+    coll = get_feeds_collection()
+    coll.create_index([("id", 1), ("source", 1)])
+    cfg.db_engine = "mongodb-inbox"
+    connection._connection = None
+    try:
+        # the legacy id index stays until the indexes are migrated
+        indexes = coll.index_information()
+        assert "legacy_id" in indexes and "id_1" not in indexes
+        assert "id_1_source_1" in indexes
+        assert connection.get_mongo_connection().migrate_indexes() == [
+            "id_1_source_1", "legacy_id"
+        ]
+        assert "id_1" in coll.index_information()
+    finally:
+        cfg.db_engine = "mongodb"
+        connection._connection = None
+    assert "id_1" in coll.index_information()
+    assert connection.get_mongo_connection().migrate_indexes() == ["id_1"]
+    assert "legacy_id" in coll.index_information()
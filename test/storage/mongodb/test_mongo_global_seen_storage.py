@@ -0,0 +1,94 @@
+from feeds.storage.mongodb.activity_storage import MongoActivityStorage
+from feeds.storage.mongodb.global_seen_storage import MongoGlobalSeenStorage
+from feeds.storage.mongodb.connection import (
+    get_feeds_collection,
+    get_global_seen_collection
+)
+from feeds.activity.notification import Notification
+from feeds.entity.entity import Entity
+from feeds.util import epoch_ms
+
+GLOBAL_FEED = Entity("_global_seen_test_", "user")
+
+
+def _add_global_notes(num, start=None):
+    notes = list()
+    if start is None:
+        start = epoch_ms() - num
+    for i in range(num):
+        note = Notification(
+            Entity("kbasetest", "user"), "invite", Entity("123", "workspace"), "kbase"
+        )
+        note.created = start + i
+        MongoActivityStorage().add_to_storage(note, [GLOBAL_FEED])
+        notes.append(note)
+    return notes
+
+
+def test_global_seen_state(mongo):
+    storage = MongoGlobalSeenStorage(GLOBAL_FEED)
+    reader = Entity("global_reader", "user")
+    other = Entity("global_other", "user")
+    notes = _add_global_notes(4)
+    acts = [(n.id, n.created) for n in notes]
+    assert storage.get_unseen_count(reader) == 4
+    assert not any(storage.get_seen(reader, acts).values())
+
+    storage.set_seen([notes[0].id, notes[2].id], reader)
+    seen = storage.get_seen(reader, acts)
+    assert [seen[n.id] for n in notes] == [True, False, True, False]
+    assert storage.get_unseen_count(reader) == 2
+    assert storage.get_unseen_count(other) == 4
+
+    storage.set_unseen([notes[0].id], reader)
+    storage.set_seen([notes[1].id, notes[3].id], reader)
+    seen = storage.get_seen(reader, acts)
+    assert [seen[n.id] for n in notes] == [False, True, True, True]
+    assert storage.get_unseen_count(reader) == 1
+    # the global notes themselves are untouched
+    for doc in get_feeds_collection().find({"id": {"$in": [n.id for n in notes]}}):
+        assert doc["unseen"] == [GLOBAL_FEED.to_dict()]
+
+
+def test_global_seen_state_is_compact(mongo):
+    storage = MongoGlobalSeenStorage(GLOBAL_FEED)
+    reader = Entity("global_compact", "user")
+    notes = _add_global_notes(5)
+    storage.set_seen([n.id for n in notes], reader)
+    doc = get_global_seen_collection().find_one({"_id": str(reader)})
+    assert doc["hwm"] >= notes[-1].created
+    assert doc["seen"] == [] and doc["unseen"] == []
+
+    storage.set_unseen([notes[2].id], reader)
+    doc = get_global_seen_collection().find_one({"_id": str(reader)})
+    assert doc["seen"] == [] and doc["unseen"] == [notes[2].id]
+    assert storage.get_unseen_count(reader) == 1
+
+    # new global notes show up as unseen
+    new_note = _add_global_notes(1, start=notes[-1].created + 1)[0]
+    new_note_seen = storage.get_seen(reader, [(new_note.id, new_note.created)])
+    assert new_note_seen == {new_note.id: False}
+
+
+def test_global_seen_concurrent_updates(mongo):
+    storage = MongoGlobalSeenStorage(GLOBAL_FEED)
+    other = MongoGlobalSeenStorage(GLOBAL_FEED)
+    reader = Entity("global_racer", "user")
+    notes = _add_global_notes(3)
+    get_active = storage._get_active_activities
+    calls = list()
+
+    def interleaved():
+        # the other update lands after this one has read the state, but before it stores it
+        if len(calls) < 2:
+            other.set_seen([notes[len(calls)].id], reader)
+        calls.append(1)
+        return get_active()
+
+    storage._get_active_activities = interleaved
+    # the first race is over creating the state, the second over replacing it
+    storage.set_seen([notes[2].id], reader)
+    assert len(calls) == 3
+    seen = storage.get_seen(reader, [(n.id, n.created) for n in notes])
+    assert [seen[n.id] for n in notes] == [True, True, True]
+    assert get_global_seen_collection().find_one({"_id": str(reader)})["version"] == 3
@@ -0,0 +1,105 @@
+from feeds.storage.mongodb.inbox_storage import (
+    MongoInboxActivityStorage,
+    MongoInboxTimelineStorage,
+    MongoInboxUnseenCountStorage
+)
+from feeds.storage.mongodb.connection import (
+    get_feeds_collection,
+    get_inbox_collection
+)
+from feeds.activity.notification import Notification
+from feeds.entity.entity import Entity
+from feeds.util import epoch_ms
+from feeds.config import get_config
+
+
+def _make_note(external_key=None):
+    return Notification(
+        Entity("kbasetest", "user"), "invite", Entity("123", "workspace"), "ws",
+        context={"text": "inbox test"}, external_key=external_key
+    )
+
+
+def test_inbox_storage(mongo):
+    storage = MongoInboxActivityStorage()
+    counts = MongoInboxUnseenCountStorage()
+    reader = Entity("inbox_reader", "user")
+    other = Entity("inbox_other", "user")
+    notes = [_make_note() for i in range(3)]
+    for n in notes:
+        storage.add_to_storage(n, [reader, other])
+
+    # each note is stored once, with no recipients, and each recipient gets a row
+    stored = get_feeds_collection().find_one({"id": notes[0].id})
+    assert "users" not in stored and "unseen" not in stored
+    assert get_inbox_collection().count_documents({"id": notes[0].id}) == 2
+
+    timeline = MongoInboxTimelineStorage(reader.id, reader.type)
+    feed = timeline.get_timeline(count=10)
+    assert [n["id"] for n in feed] == [n.id for n in reversed(notes)]
+    for n in feed:
+        assert n["context"] == {"text": "inbox test"}
+        assert n["source"] == "ws"
+        assert n["seen"] is False
+        assert "users" not in n and "unseen" not in n
+    assert counts.get_counts([reader, other]) == [3, 3]
+
+    storage.set_seen([notes[0].id], reader)
+    assert timeline.get_single_activity_from_timeline(notes[0].id)["seen"] is True
+    (feed, unseen) = timeline.get_timeline_and_unseen_count(count=10)
+    assert [n["id"] for n in feed] == [notes[2].id, notes[1].id]
+    assert unseen == 2
+    assert counts.reconcile([reader, other]) == {str(reader): 2, str(other): 3}
+
+    storage.expire_notifications([notes[1].id])
+    assert [n["id"] for n in timeline.get_timeline(count=10)] == [notes[2].id]
+    assert counts.get_counts([reader, other]) == [1, 2]
+    assert storage.get_by_id([notes[1].id])[notes[1].id]["expires"] <= epoch_ms()
+
+    assert storage.expire_by_id_or_external_key([notes[2].id, "not_a_note"], [],
+                                                source="ws") == ([notes[2].id], [])
+    assert timeline.get_timeline(count=10) == []
+    assert counts.get_counts([reader, other]) == [0, 1]
+
+
+def test_inbox_add_many_to_storage(mongo):
+    storage = MongoInboxActivityStorage()
+    reader = Entity("inbox_bulk_reader", "user")
+    other = Entity("inbox_bulk_other", "user")
+    notes = [_make_note() for i in range(2)]
+    storage.add_to_storage(notes[0], [reader])
+    errors = storage.add_many_to_storage([(n, [reader, other]) for n in notes])
+    assert errors[0] is not None and errors[1] is None
+    # the duplicate's rows aren't added again
+    assert get_inbox_collection().count_documents({"id": notes[0].id}) == 1
+    assert get_inbox_collection().count_documents({"id": notes[1].id}) == 2
+    assert MongoInboxUnseenCountStorage().get_counts([reader, other]) == [2, 1]
+
+
+def test_inbox_retry_adds_missing_rows(mongo):
+    cfg = get_config()
+    storage = MongoInboxActivityStorage()
+    counts = MongoInboxUnseenCountStorage()
+    reader = Entity("inbox_retry_reader", "user")
+    other = Entity("inbox_retry_other", "user")
+    note = _make_note(external_key="inbox_retry_key")
+    cfg.idempotent_writes = True
+    try:
+        # the first try stored the note, and one row, then failed
+        doc = storage._note_doc(note, [reader, other])
+        assert storage._store_note(doc, note)
+        get_inbox_collection().insert_one(storage._row(doc, reader))
+        retry = _make_note(external_key="inbox_retry_key")
+        storage.add_to_storage(retry, [reader, other])
+        assert retry.id == note.id
+        assert get_inbox_collection().count_documents({"id": note.id}) == 2
+        assert counts.get_counts([reader, other]) == [0, 1]
+        bulk = _make_note(external_key="inbox_retry_key")
+        assert storage.add_many_to_storage([(bulk, [reader, other])]) == [None]
+        assert bulk.id == note.id
+    finally:
+        cfg.idempotent_writes = False
+    assert get_inbox_collection().count_documents({"id": note.id}) == 2
+    assert counts.get_counts([reader, other]) == [0, 1]
+    timeline = MongoInboxTimelineStorage(other.id, other.type)
+    assert [n["id"] for n in timeline.get_timeline(count=10)] == [note.id]
@@ -0,0 +1,65 @@
+import queue
+import time
+from feeds.storage.mongodb.activity_storage import MongoActivityStorage
+from feeds.storage.factory import get_notification_hub
+from feeds.activity.notification import Notification
+from feeds.entity.entity import Entity
+from feeds.config import get_config
+
+
+def _make_note():
+    return Notification(
+        Entity("kbasetest", "user"), "invite", Entity("123", "workspace"), "ws"
+    )
+
+
+def _wait_for_stream(hub):
+    # the change stream is opened in the background, give it a moment.
+    for _ in range(100):
+        if hub._resume_token is not None:
+            return
+        time.sleep(0.1)
+    assert False, "change stream never opened"
+
+
+def test_hub_fans_out_changes(mongo_replset):
+    cfg = get_config()
+    hub = get_notification_hub()
+    reader = Entity("hub_reader", "user")
+    other = Entity("hub_other", "user")
+    reader_q = hub.subscribe(reader)
+    other_q = hub.subscribe(other)
+    _wait_for_stream(hub)
+
+    storage = MongoActivityStorage()
+    note = _make_note()
+    storage.add_to_storage(note, [reader])
+    event = reader_q.get(timeout=10)
+    (change, doc) = (event.change, event.doc)
+    assert change == "insert" and doc["id"] == note.id
+
+    storage.set_seen([note.id], reader)
+    event = reader_q.get(timeout=10)
+    (change, doc) = (event.change, event.doc)
+    assert change == "update" and doc["id"] == note.id and doc["unseen"] == []
+
+    global_note = _make_note()
+    storage.add_to_storage(global_note, [Entity(cfg.global_feed, cfg.global_feed_type)])
+    events = [q.get(timeout=10) for q in [reader_q, other_q]]
+    for event in events:
+        assert event.change == "insert" and event.doc["id"] == global_note.id
+        assert event.is_global
+    # everyone gets the same event, so they can share the work of showing it
+    assert events[0] is events[1]
+    assert events[0].shared(lambda doc: doc["id"]) == global_note.id
+    # the other user never heard about the first note
+    assert other_q.empty()
+
+    hub.unsubscribe(other, other_q)
+    storage.add_to_storage(_make_note(), [other])
+    hub.unsubscribe(reader, reader_q)
+    try:
+        other_q.get(timeout=2)
+        assert False, "unsubscribed queue got an event"
+    except queue.Empty:
+        pass
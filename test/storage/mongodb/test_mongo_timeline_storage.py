@@ -0,0 +1,102 @@
+import pytest
+from feeds.storage.mongodb.timeline_storage import MongoTimelineStorage
+from feeds.storage.mongodb.unseen_count_storage import MongoUnseenCountStorage
+from feeds.entity.entity import Entity
+
+USER = "test_user"
+USER_TYPE = "user"
+
+
+def test_get_timeline_entity_filter(mongo_notes):
+    storage = MongoTimelineStorage(USER, USER_TYPE)
+    # every note references workspace 123 as its object, and test_user as a target
+    for entity in [Entity("123", "workspace"), Entity("test_user", "user"),
+                   Entity("kbasetest", "user")]:
+        timeline = storage.get_timeline(count=20, include_seen=True, entity=entity)
+        assert [n["id"] for n in timeline] == [str(i) for i in range(10, 0, -1)]
+    assert storage.get_timeline(entity=Entity("123", "narrative")) == []
+    assert storage.get_timeline(entity=Entity("some_group", "group")) == []
+
+
+def test_get_timeline_and_unseen_count_entity_filter(mongo_notes):
+    storage = MongoTimelineStorage("test_group_user", USER_TYPE)
+    (timeline, unseen) = storage.get_timeline_and_unseen_count(
+        entity=Entity("some_group", "group")
+    )
+    assert [n["id"] for n in timeline] == ["group-feed-test"]
+    assert unseen == 1
+    (timeline, unseen) = storage.get_timeline_and_unseen_count(entity=Entity("nope", "group"))
+    assert timeline == [] and unseen == 0
+
+
+def test_get_timeline_and_unseen_count_uses_stored_count(mongo_notes):
+    storage = MongoTimelineStorage(USER, USER_TYPE)
+    (timeline, unseen) = storage.get_timeline_and_unseen_count(count=3, include_seen=True)
+    assert timeline == storage.get_timeline(count=3, include_seen=True)
+    assert unseen == storage.get_unseen_count()
+    MongoUnseenCountStorage().increment([Entity(USER, USER_TYPE)], 2)
+    assert storage.get_timeline_and_unseen_count(count=3)[1] == unseen + 2
+    MongoUnseenCountStorage().increment([Entity(USER, USER_TYPE)], -2)
+
+
+def test_get_group_timelines(mongo_notes):
+    storage = MongoTimelineStorage("test_group_user", USER_TYPE)
+    timelines = storage.get_group_timelines(["some_group", "nope"])
+    assert [n["id"] for n in timelines["some_group"][0]] == ["group-feed-test"]
+    assert timelines["some_group"][1] == 1
+    assert timelines["nope"] == ([], 0)
+
+
+def test_timeline_reads_strip_recipients(mongo_notes):
+    storage = MongoTimelineStorage(USER, USER_TYPE)
+    timeline = storage.get_timeline(count=20, include_seen=True)
+    (faceted, _) = storage.get_timeline_and_unseen_count(count=20, include_seen=True)
+    single = storage.get_single_activity_from_timeline("8")
+    for note in timeline + faceted + [single]:
+        assert "users" not in note
+        assert "unseen" not in note
+    # 8-10 have been seen by test_user
+    assert {n["id"]: n["seen"] for n in timeline} == {
+        str(i): i >= 8 for i in range(1, 11)
+    }
+    assert faceted == timeline
+    assert single["seen"] is True
+    assert storage.get_single_activity_from_timeline("global-1") is None
+
+
+def test_get_ids_in_timeline(mongo_notes):
+    storage = MongoTimelineStorage(USER, USER_TYPE)
+    found = storage.get_ids_in_timeline(["8", "global-1", "not_a_note", "2"])
+    assert sorted(found) == ["2", "8"]
+    assert storage.get_ids_in_timeline([]) == []
+
+
+def test_timeline_read_through_cache(mongo, timeline_cache):
+    from feeds.storage.mongodb.activity_storage import MongoActivityStorage
+    from feeds.storage.redis.timeline_cache import get_timeline_cache
+    from feeds.activity.notification import Notification
+    reader = Entity("cached_reader", USER_TYPE)
+    storage = MongoActivityStorage()
+    notes = list()
+    for i in range(3):
+        note = Notification(Entity("kbasetest", "user"), "invite", Entity("123", "workspace"),
+                            "ws")
+        note.created = note.created + i
+        storage.add_to_storage(note, [reader])
+        notes.append(note)
+    timeline = MongoTimelineStorage(reader.id, reader.type)
+    cache = get_timeline_cache(reader)
+    assert cache.is_filled() is False
+
+    # the first read fills the cache, later writes go to both
+    (feed, unseen) = timeline.get_timeline_and_unseen_count(count=10)
+    assert [n["id"] for n in feed] == [n.id for n in reversed(notes)] and unseen == 3
+    assert cache.is_filled() is True
+    storage.set_seen([notes[2].id], reader)
+    storage.expire_notifications([notes[0].id])
+    (feed, unseen) = timeline.get_timeline_and_unseen_count(count=10, include_seen=True)
+    assert [(n["id"], n["seen"]) for n in feed] == [(notes[2].id, True), (notes[1].id, False)]
+    assert unseen == 1
+    from_db = timeline._query_timeline(10, True, None, None, False, None, None, None)
+    assert [(n["id"], n["seen"]) for n in feed] == [(n["id"], n["seen"]) for n in from_db]
+    assert cache.get_unseen_count() == 1
@@ -0,0 +1,84 @@
+from feeds.storage.mongodb.util import (
+    encode_activity,
+    decode_activity,
+    entity_forms,
+    migrate_entity_encoding
+)
+from feeds.storage.mongodb.activity_storage import MongoActivityStorage
+from feeds.storage.mongodb.timeline_storage import MongoTimelineStorage
+from feeds.storage.mongodb.unseen_count_storage import MongoUnseenCountStorage
+from feeds.storage.mongodb.connection import get_feeds_collection
+from feeds.activity.notification import Notification
+from feeds.entity.entity import Entity
+from feeds.config import get_config
+
+
+def _make_note(object_id="123"):
+    return Notification(
+        Entity("kbasetest", "user"), "invite", Entity(object_id, "workspace"), "ws",
+        target=[Entity("a_group", "group")]
+    )
+
+
+def _set_encoding(encoding):
+    cfg = get_config()
+    old = cfg.entity_encoding
+    cfg.entity_encoding = encoding
+    return old
+
+
+def test_encode_decode_activity():
+    note = _make_note()
+    old = _set_encoding("compact")
+    try:
+        doc = encode_activity(note.to_dict())
+        assert doc["actor"] == "user::kbasetest"
+        assert doc["object"] == "workspace::123"
+        assert doc["target"] == ["group::a_group"]
+        assert decode_activity(dict(doc)) == note.to_dict()
+        assert Notification.from_dict(doc).to_dict() == note.to_dict()
+        _set_encoding("document")
+        assert encode_activity(note.to_dict()) == note.to_dict()
+    finally:
+        _set_encoding(old)
+    assert entity_forms([Entity("foo", "user")]) == [{"id": "foo", "type": "user"}, "user::foo"]
+
+
+def test_compact_storage_and_migration(mongo):
+    storage = MongoActivityStorage()
+    reader = Entity("compact_reader", "user")
+    timeline = MongoTimelineStorage(reader.id, reader.type)
+    old_note = _make_note()
+    storage.add_to_storage(old_note, [reader])
+    old = _set_encoding("compact")
+    try:
+        new_note = _make_note(object_id="456")
+        storage.add_to_storage(new_note, [reader])
+        stored = get_feeds_collection().find_one({"id": new_note.id})
+        assert stored["users"] == [str(reader)]
+        assert stored["actor"] == "user::kbasetest"
+
+        # both forms are readable side by side
+        feed = timeline.get_timeline(count=10)
+        assert sorted(n["id"] for n in feed) == sorted([old_note.id, new_note.id])
+        storage.set_seen([old_note.id, new_note.id], reader)
+        assert timeline.get_timeline(count=10) == []
+        storage.set_unseen([old_note.id, new_note.id], reader)
+        assert MongoUnseenCountStorage().reconcile([reader]) == {str(reader): 2}
+        (feed, unseen) = timeline.get_timeline_and_unseen_count(
+            entity=Entity("456", "workspace")
+        )
+        assert [n["id"] for n in feed] == [new_note.id]
+        assert unseen == 1
+        assert storage.get_by_id([new_note.id])[new_note.id]["actor"] == \
+            {"id": "kbasetest", "type": "user"}
+
+        assert migrate_entity_encoding(get_feeds_collection(), batch_size=1) >= 1
+        stored = get_feeds_collection().find_one({"id": old_note.id})
+        assert stored["users"] == [str(reader)]
+        assert stored["unseen"] == [str(reader)]
+        assert stored["target"] == ["group::a_group"]
+        assert migrate_entity_encoding(get_feeds_collection()) == 0
+        assert len(timeline.get_timeline(count=10)) == 2
+    finally:
+        _set_encoding(old)
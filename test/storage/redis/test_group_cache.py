@@ -0,0 +1,17 @@
+from feeds.storage.redis.group_cache import (
+    get_cached_group_members,
+    cache_group_members,
+    invalidate_group_members
+)
+
+
+def test_no_cache_configured():
+    cache_group_members({"cg1": ["u1"]})
+    assert get_cached_group_members(["cg1"]) == {}
+
+
+def test_group_cache(timeline_cache):
+    cache_group_members({"cg1": ["u1", "u2"], "cg2": None})
+    assert get_cached_group_members(["cg1", "cg2", "cg3"]) == {"cg1": ["u1", "u2"], "cg2": None}
+    invalidate_group_members(["cg1"])
+    assert get_cached_group_members(["cg1", "cg2"]) == {"cg2": None}
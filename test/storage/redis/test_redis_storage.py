@@ -0,0 +1,408 @@
+import time
+import pytest
+from feeds.storage.redis.activity_storage import RedisActivityStorage
+from feeds.storage.redis.timeline_storage import RedisTimelineStorage
+from feeds.storage.redis.unseen_count_storage import RedisUnseenCountStorage
+from feeds.storage.redis.feed_version_storage import RedisFeedVersionStorage
+from feeds.storage.redis.global_seen_storage import RedisGlobalSeenStorage
+from feeds.storage.redis.lease_storage import RedisLeaseStorage
+from feeds.storage.redis import (
+    activity_storage as redis_activity_storage,
+    timeline_storage as redis_timeline_storage
+)
+from feeds.storage.factory import get_notification_hub
+from feeds.activity.notification import Notification
+from feeds.entity.entity import Entity
+from feeds.notification_level import translate_level
+from feeds.config import get_config
+from feeds.util import epoch_ms
+
+
+def _make_note(object_id="123", level="alert", external_key=None):
+    note = Notification(
+        Entity("kbasetest", "user"), "invite", Entity(object_id, "workspace"), "ws",
+        level=level, context={"text": "redis test"}, external_key=external_key
+    )
+    time.sleep(0.002)  # keep the creation times apart, so the order's easy to check
+    return note
+
+
+def test_redis_storage(redis):
+    storage = RedisActivityStorage()
+    versions = RedisFeedVersionStorage()
+    reader = Entity("redis_reader", "user")
+    other = Entity("redis_other", "user")
+    notes = [_make_note() for i in range(3)]
+    for n in notes:
+        storage.add_to_storage(n, [reader, other])
+    assert versions.get_versions([reader, other, Entity("nobody", "user")]) == [3, 3, 0]
+
+    timeline = RedisTimelineStorage(reader.id, reader.type)
+    feed = timeline.get_timeline(count=10)
+    assert [n["id"] for n in feed] == [n.id for n in reversed(notes)]
+    for n in feed:
+        assert n["context"] == {"text": "redis test"}
+        assert n["seen"] is False
+        assert "users" not in n
+    assert RedisUnseenCountStorage().get_counts([reader, other]) == [3, 3]
+
+    storage.set_seen([notes[0].id], reader)
+    assert timeline.get_single_activity_from_timeline(notes[0].id)["seen"] is True
+    assert timeline.get_single_activity_from_timeline("not_a_note") is None
+    assert timeline.get_ids_in_timeline([notes[1].id, "not_a_note", notes[0].id]) == [
+        notes[1].id, notes[0].id
+    ]
+    assert timeline.get_ids_in_timeline([]) == []
+    (feed, unseen) = timeline.get_timeline_and_unseen_count(count=10)
+    assert [n["id"] for n in feed] == [notes[2].id, notes[1].id]
+    assert unseen == 2
+    feed = timeline.get_timeline(count=10, include_seen=True, reverse=True)
+    assert [(n["id"], n["seen"]) for n in feed] == [
+        (notes[0].id, True), (notes[1].id, False), (notes[2].id, False)
+    ]
+    assert timeline.get_unseen_counts([other]) == [2, 3]
+    assert versions.get_versions([reader, other]) == [4, 3]
+
+    storage.set_unseen([notes[0].id], reader)
+    storage.set_unseen([notes[0].id], other)  # already unseen, nothing changes
+    assert versions.get_versions([reader, other]) == [5, 3]
+    assert timeline.get_unseen_count() == 3
+
+    storage.expire_notifications([notes[1].id])
+    assert [n["id"] for n in timeline.get_timeline(count=10)] == [notes[2].id, notes[0].id]
+    assert RedisUnseenCountStorage().get_counts([reader, other]) == [2, 2]
+    assert storage.get_by_id([notes[1].id])[notes[1].id]["expires"] <= epoch_ms()
+    assert storage.get_by_id([notes[1].id], source="not_ws") == {notes[1].id: None}
+
+
+def test_redis_timeline_filters(redis):
+    storage = RedisActivityStorage()
+    reader = Entity("redis_filter_reader", "user")
+    notes = [
+        _make_note(object_id=str(i % 2), level="alert" if i % 3 == 0 else "request")
+        for i in range(7)
+    ]
+    for n in notes:
+        storage.add_to_storage(n, [reader])
+    newest_first = list(reversed(notes))
+    timeline = RedisTimelineStorage(reader.id, reader.type)
+
+    page = timeline.get_timeline(count=3)
+    assert [n["id"] for n in page] == [n.id for n in newest_first[:3]]
+    before = (page[-1]["created"], page[-1]["id"])
+    page = timeline.get_timeline(count=3, before=before)
+    assert [n["id"] for n in page] == [n.id for n in newest_first[3:6]]
+    page = timeline.get_timeline(count=10, after=(notes[4].created, notes[4].id), reverse=True)
+    assert [n["id"] for n in page] == [notes[5].id, notes[6].id]
+
+    alerts = timeline.get_timeline(count=10, level=notes[0].level)
+    assert [n["id"] for n in alerts] == [notes[6].id, notes[3].id, notes[0].id]
+
+    ws = Entity("1", "workspace")
+    (feed, unseen) = timeline.get_timeline_and_unseen_count(count=2, entity=ws)
+    assert [n["id"] for n in feed] == [notes[5].id, notes[3].id]
+    assert unseen == 3
+
+
+def test_redis_external_keys(redis):
+    storage = RedisActivityStorage()
+    note = _make_note(external_key="redis_key")
+    storage.add_to_storage(note, [Entity("redis_key_reader", "user")])
+    found = storage.get_by_external_key(["redis_key", "missing_key"], "ws")
+    assert found["redis_key"]["id"] == note.id
+    assert found["missing_key"] is None
+
+
+def test_redis_expire_by_id_or_external_key(redis):
+    storage = RedisActivityStorage()
+    reader = Entity("redis_expire_reader", "user")
+    notes = [_make_note(external_key="redis_expire_{}".format(i)) for i in range(3)]
+    for n in notes:
+        storage.add_to_storage(n, [reader])
+    (ids, keys) = storage.expire_by_id_or_external_key(
+        [notes[0].id, "not_a_note"], ["redis_expire_1", "missing_key"], source="not_ws"
+    )
+    assert ids == [] and keys == []
+    (ids, keys) = storage.expire_by_id_or_external_key(
+        [notes[0].id, "not_a_note"], ["redis_expire_1", "missing_key"], source="ws"
+    )
+    assert ids == [notes[0].id] and keys == ["redis_expire_1"]
+    timeline = RedisTimelineStorage(reader.id, reader.type)
+    assert [n["id"] for n in timeline.get_timeline(count=10)] == [notes[2].id]
+    # without a source, external keys aren't looked up
+    (ids, keys) = storage.expire_by_id_or_external_key([], ["redis_expire_2"])
+    assert ids == [] and keys == []
+    assert timeline.get_unseen_count() == 1
+
+
+def test_redis_idempotent_writes(redis):
+    cfg = get_config()
+    storage = RedisActivityStorage()
+    reader = Entity("redis_retry_reader", "user")
+    note = _make_note(external_key="redis_retry_key")
+    retry = _make_note(external_key="redis_retry_key")
+    cfg.idempotent_writes = True
+    try:
+        storage.add_to_storage(note, [reader])
+        storage.add_to_storage(retry, [reader])
+        other = _make_note(external_key="redis_other_key")
+        storage.add_to_storage(other, [reader])
+    finally:
+        cfg.idempotent_writes = False
+    assert retry.id == note.id
+    assert RedisUnseenCountStorage().get_counts([reader]) == [2]
+    feed = RedisTimelineStorage(reader.id, reader.type).get_timeline(count=10)
+    assert [n["id"] for n in feed] == [other.id, note.id]
+
+
+
+def test_redis_idempotent_writes_after_failure(redis, monkeypatch):
+    from redis.client import StrictPipeline
+    from redis.exceptions import RedisError
+    from feeds.exceptions import ActivityStorageError
+    from feeds.storage.redis.connection import get_redis_connection
+    from feeds.storage.redis.util import get_external_key_key
+    cfg = get_config()
+    storage = RedisActivityStorage()
+    reader = Entity("redis_failed_reader", "user")
+    note = _make_note(external_key="redis_failed_key")
+    retry = _make_note(external_key="redis_failed_key")
+
+    def fail(self, *args, **kwargs):
+        raise RedisError("nope")
+
+    cfg.idempotent_writes = True
+    try:
+        with monkeypatch.context() as m:
+            m.setattr(StrictPipeline, "execute", fail)
+            with pytest.raises(ActivityStorageError):
+                storage.add_to_storage(note, [reader])
+        storage.add_to_storage(retry, [reader])
+        # a claim left behind by a write that died gets taken over
+        stale = _make_note(external_key="redis_stale_key")
+        get_redis_connection().hset(get_external_key_key(stale.source), "redis_stale_key",
+                                    "not_a_note")
+        storage.add_to_storage(stale, [reader])
+    finally:
+        cfg.idempotent_writes = False
+    assert retry.id != note.id
+    assert stale.id != "not_a_note"
+    feed = RedisTimelineStorage(reader.id, reader.type).get_timeline(count=10)
+    assert [n["id"] for n in feed] == [stale.id, retry.id]
+
+def test_redis_global_seen(redis):
+    cfg = get_config()
+    global_feed = Entity(cfg.global_feed, cfg.global_feed_type)
+    reader = Entity("redis_global_reader", "user")
+    storage = RedisActivityStorage()
+    notes = [_make_note() for i in range(3)]
+    for n in notes:
+        storage.add_to_storage(n, [global_feed])
+    seen = RedisGlobalSeenStorage(global_feed)
+    assert seen.get_unseen_count(reader) == 3
+    seen.set_seen([notes[0].id, notes[2].id], reader)
+    assert seen.get_unseen_count(reader) == 1
+    assert seen.get_seen(reader, [(n.id, n.created) for n in notes]) == {
+        notes[0].id: True, notes[1].id: False, notes[2].id: True
+    }
+    seen.set_unseen([notes[0].id], reader)
+    assert seen.get_unseen_count(reader) == 2
+
+
+def test_redis_global_seen_concurrent_updates(redis):
+    cfg = get_config()
+    global_feed = Entity(cfg.global_feed, cfg.global_feed_type)
+    reader = Entity("redis_global_racer", "user")
+    storage = RedisActivityStorage()
+    notes = [_make_note() for i in range(3)]
+    for n in notes:
+        storage.add_to_storage(n, [global_feed])
+    seen = RedisGlobalSeenStorage(global_feed)
+    other = RedisGlobalSeenStorage(global_feed)
+    get_active = seen._get_active_activities
+    calls = list()
+
+    def interleaved():
+        # the other update lands after this one has read the state, but before it stores it
+        if not calls:
+            other.set_seen([notes[0].id], reader)
+        calls.append(1)
+        return get_active()
+
+    seen._get_active_activities = interleaved
+    seen.set_seen([notes[2].id], reader)
+    assert len(calls) == 2
+    assert seen.get_seen(reader, [(n.id, n.created) for n in notes]) == {
+        notes[0].id: True, notes[1].id: False, notes[2].id: True
+    }
+
+
+def test_redis_set_all_seen(redis):
+    storage = RedisActivityStorage()
+    reader = Entity("redis_all_seen_reader", "user")
+    notes = [_make_note(level="alert" if i % 2 == 0 else "request") for i in range(4)]
+    for n in notes:
+        storage.add_to_storage(n, [reader])
+    timeline = RedisTimelineStorage(reader.id, reader.type)
+
+    assert storage.set_all_seen(reader, level=translate_level("request"),
+                                before=notes[3].created) == 1
+    assert [n["id"] for n in timeline.get_timeline(count=10)] == [
+        notes[3].id, notes[2].id, notes[0].id
+    ]
+    assert storage.set_all_seen(reader, source="not_ws") == 0
+    assert storage.set_all_seen(reader) == 3
+    assert timeline.get_unseen_count() == 0
+
+
+def test_redis_global_set_all_seen(redis):
+    cfg = get_config()
+    global_feed = Entity(cfg.global_feed, cfg.global_feed_type)
+    reader = Entity("redis_global_all_reader", "user")
+    storage = RedisActivityStorage()
+    notes = [_make_note(level=level) for level in ["alert", "request"]]
+    for n in notes:
+        storage.add_to_storage(n, [global_feed])
+    seen = RedisGlobalSeenStorage(global_feed)
+    unseen = seen.get_unseen_count(reader)
+    seen.set_all_seen(reader, level=translate_level("request"))
+    assert seen.get_unseen_count(reader) == unseen - 1
+    seen.set_all_seen(reader)
+    assert seen.get_unseen_count(reader) == 0
+    assert seen.get_seen(reader, [(n.id, n.created) for n in notes]) == {
+        notes[0].id: True, notes[1].id: True
+    }
+
+
+def test_redis_hub(redis):
+    hub = get_notification_hub()
+    reader = Entity("redis_hub_reader", "user")
+    reader_q = hub.subscribe(reader)
+    time.sleep(0.5)  # the listener subscribes in the background
+    try:
+        storage = RedisActivityStorage()
+        note = _make_note()
+        storage.add_to_storage(note, [reader])
+        event = reader_q.get(timeout=10)
+        (change, doc) = (event.change, event.doc)
+        assert change == "insert" and doc["id"] == note.id and doc["source"] == "ws"
+        storage.set_seen([note.id], reader)
+        event = reader_q.get(timeout=10)
+        (change, doc) = (event.change, event.doc)
+        assert change == "update" and doc["id"] == note.id
+    finally:
+        hub.unsubscribe(reader, reader_q)
+
+
+def test_redis_archive(redis):
+    storage = RedisActivityStorage()
+    reader = Entity("redis_archive_reader", "user")
+    notes = [_make_note(external_key="archive_key_{}".format(i)) for i in range(3)]
+    for n in notes:
+        storage.add_to_storage(n, [reader])
+    storage.expire_notifications([notes[0].id, notes[1].id])
+    # other tests might have left expired notes behind, so archive in batches until done
+    archived = storage.archive_expired(epoch_ms() + 1, 1)
+    assert len(archived) == 1
+    while True:
+        batch = storage.archive_expired(epoch_ms() + 1, 10)
+        archived += batch
+        if len(batch) < 10:
+            break
+    assert {notes[0].id, notes[1].id} <= set(archived)
+    assert notes[2].id not in archived
+    assert storage.archive_expired(epoch_ms() + 1, 10) == []
+
+    assert storage.get_by_id([notes[0].id, notes[2].id]) == {
+        notes[0].id: None, notes[2].id: storage.get_by_id([notes[2].id])[notes[2].id]
+    }
+    found = storage.get_by_id([notes[0].id, notes[2].id], include_archived=True)
+    assert found[notes[0].id]["id"] == notes[0].id
+    assert found[notes[2].id]["id"] == notes[2].id
+    assert storage.get_by_external_key(["archive_key_1"], "ws") == {"archive_key_1": None}
+    found = storage.get_by_external_key(["archive_key_1", "archive_key_2"], "ws",
+                                        include_archived=True)
+    assert found["archive_key_1"]["id"] == notes[1].id
+    assert found["archive_key_2"]["id"] == notes[2].id
+    timeline = RedisTimelineStorage(reader.id, reader.type)
+    assert [n["id"] for n in timeline.get_timeline(count=10)] == [notes[2].id]
+
+
+def test_redis_lease(redis):
+    leases = RedisLeaseStorage()
+    assert leases.acquire("redis_lease", "owner1", 100) is True
+    assert leases.acquire("redis_lease", "owner2", 100) is False
+    # the owner can renew it
+    assert leases.acquire("redis_lease", "owner1", 100) is True
+    time.sleep(0.2)
+    assert leases.acquire("redis_lease", "owner2", 100) is True
+    assert leases.acquire("redis_lease", "owner1", 100) is False
+
+
+def test_redis_reads_skip_unswept(redis):
+    storage = RedisActivityStorage()
+    counts = RedisUnseenCountStorage()
+    reader = Entity("redis_unswept_reader", "user")
+    other = Entity("redis_unswept_other", "user")
+    notes = [_make_note() for i in range(2)]
+    notes[0].expires = notes[0].created + 50
+    for n in notes:
+        storage.add_to_storage(n, [reader, other])
+    storage.set_seen([notes[1].id], other)
+    assert counts.get_counts([reader, other]) == [2, 1]
+    time.sleep(0.1)
+    # expired, but not swept yet
+    timeline = RedisTimelineStorage(reader.id, reader.type)
+    assert [n["id"] for n in timeline.get_timeline(count=10)] == [notes[1].id]
+    assert counts.get_counts([reader, other]) == [1, 0]
+    storage.sweep_expired()
+    assert counts.get_counts([reader, other]) == [1, 0]
+    assert timeline.get_ids_in_timeline([n.id for n in notes]) == [notes[1].id]
+
+
+def test_redis_sweep_in_batches(redis, monkeypatch):
+    monkeypatch.setattr(redis_activity_storage, "SWEEP_BATCH_SIZE", 2)
+    storage = RedisActivityStorage()
+    counts = RedisUnseenCountStorage()
+    reader = Entity("redis_sweep_batch_reader", "user")
+    notes = [_make_note() for i in range(5)]
+    for n in notes[:3]:
+        n.expires = n.created + 50
+    for n in notes:
+        storage.add_to_storage(n, [reader])
+    time.sleep(0.1)
+    assert counts.get_counts([reader]) == [2]
+    storage.sweep_expired()
+    assert redis_activity_storage.get_unswept_expired() == []
+    assert counts.get_counts([reader]) == [2]
+    timeline = RedisTimelineStorage(reader.id, reader.type)
+    assert timeline.get_ids_in_timeline([n.id for n in notes]) == [n.id for n in notes[3:]]
+
+
+def test_redis_group_timelines(redis, monkeypatch):
+    storage = RedisActivityStorage()
+    reader = Entity("redis_group_reader", "user")
+    notes = list()
+    for g_id in ["g1", "g2", "g1", "other", "other", "other"]:
+        notes.append(Notification(
+            Entity("kbasetest", "user"), "invite", Entity(g_id, "group"), "groups"
+        ))
+        time.sleep(0.002)
+    for n in notes:
+        storage.add_to_storage(n, [reader])
+    storage.set_seen([notes[0].id], reader)
+    timeline = RedisTimelineStorage(reader.id, reader.type)
+    timelines = timeline.get_group_timelines(["g1", "g2", "nope"], count=10, include_seen=True)
+    assert [n["id"] for n in timelines["g1"][0]] == [notes[2].id, notes[0].id]
+    assert timelines["g1"][1] == 1
+    assert [n["id"] for n in timelines["g2"][0]] == [notes[1].id]
+    assert timelines["g2"][1] == 1
+    assert timelines["nope"] == ([], 0)
+    assert timeline.get_timeline_and_unseen_count(entity=Entity("g1", "group")) == (
+        [timelines["g1"][0][0]], 1
+    )
+    # only the newest entries get looked through
+    monkeypatch.setattr(redis_timeline_storage, "ENTITY_SCAN_LIMIT", 3)
+    timelines = timeline.get_group_timelines(["g1", "g2"], count=10, include_seen=True)
+    assert timelines["g1"] == ([], 0) and timelines["g2"] == ([], 0)
+    assert timeline.get_timeline(count=10, entity=Entity("g1", "group")) == []
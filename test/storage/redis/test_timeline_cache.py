@@ -0,0 +1,121 @@
+import time
+from feeds.storage.redis.connection import (
+    get_redis_connection,
+    CACHE_SERVER
+)
+from feeds.storage.redis.timeline_cache import (
+    get_timeline_cache,
+    add_to_timeline_caches,
+    set_seen_in_timeline_cache,
+    expire_from_timeline_caches,
+    CACHE_SIZE
+)
+from feeds.activity.notification import Notification
+from feeds.entity.entity import Entity
+from feeds.notification_level import get_level
+
+
+def _make_note(level="alert"):
+    note = Notification(
+        Entity("kbasetest", "user"), "invite", Entity("123", "workspace"), "ws",
+        level=level, context={"text": "cache test"}
+    )
+    time.sleep(0.002)  # keep the creation times apart, so the order's easy to check
+    return note
+
+
+def _timeline_doc(note, seen=False):
+    doc = note.to_dict()
+    doc.pop("users")
+    doc["seen"] = seen
+    return doc
+
+
+def test_no_cache_configured():
+    assert get_timeline_cache(Entity("cache_reader", "user")) is None
+
+
+def test_timeline_cache(timeline_cache):
+    reader = Entity("cache_reader", "user")
+    other = Entity("cache_other", "user")
+    cache = get_timeline_cache(reader)
+    notes = [_make_note(level="alert" if i % 2 else "request") for i in range(4)]
+    newest_first = list(reversed(notes))
+
+    # nothing's cached until it's filled, and writes leave uncached users alone
+    assert cache.get_timeline(10, True, None, None, None) is None
+    add_to_timeline_caches(notes[0], [reader, other])
+    assert cache.is_filled() is False
+
+    cache.fill([_timeline_doc(n, seen=(n == notes[2])) for n in newest_first[1:]], True, 2)
+    assert cache.get_unseen_count() == 2
+    feed = cache.get_timeline(10, True, None, None, None)
+    assert [(n["id"], n["seen"]) for n in feed] == [
+        (notes[2].id, True), (notes[1].id, False), (notes[0].id, False)
+    ]
+    assert feed[0]["context"] == {"text": "cache test"}
+    assert "users" not in feed[0]
+
+    add_to_timeline_caches(notes[3], [reader, other])
+    assert get_timeline_cache(other).is_filled() is False
+    assert cache.get_unseen_count() == 3
+    feed = cache.get_timeline(2, False, None, None, None)
+    assert [n["id"] for n in feed] == [notes[3].id, notes[1].id]
+    feed = cache.get_timeline(10, True, get_level("alert"), None,
+                              (notes[3].created, notes[3].id))
+    assert [n["id"] for n in feed] == [notes[1].id]
+
+    set_seen_in_timeline_cache([notes[3].id, notes[1].id], reader, True, 2)
+    assert cache.get_unseen_count() == 1
+    assert [n["id"] for n in cache.get_timeline(10, False, None, None, None)] == [notes[0].id]
+    set_seen_in_timeline_cache([notes[3].id, "not_cached"], reader, False, 1)
+    assert cache.get_unseen_count() == 2
+
+    expire_from_timeline_caches([notes[0].id], [reader, other], {reader: -1})
+    assert cache.get_unseen_count() == 1
+    feed = cache.get_timeline(10, True, None, None, None)
+    assert [n["id"] for n in feed] == [notes[3].id, notes[2].id, notes[1].id]
+
+
+def test_timeline_cache_trimming(timeline_cache):
+    reader = Entity("cache_trim_reader", "user")
+    cache = get_timeline_cache(reader)
+    old_note = _make_note()
+    cache.fill([_timeline_doc(old_note)], True, 1)
+    new_notes = list()
+    for i in range(CACHE_SIZE):
+        note = Notification(
+            Entity("kbasetest", "user"), "invite", Entity("123", "workspace"), "ws"
+        )
+        note.created = old_note.created + i + 1
+        new_notes.append(note)
+        add_to_timeline_caches(note, [reader])
+    feed = cache.get_timeline(CACHE_SIZE, True, None, None, None)
+    assert len(feed) == CACHE_SIZE
+    assert old_note.id not in [n["id"] for n in feed]
+    # the oldest one was trimmed, so the cache can't tell what comes after the newest ones
+    assert cache.get_timeline(10, True, None, None, (new_notes[0].created, new_notes[0].id)) \
+        is None
+    assert cache.get_unseen_count() == CACHE_SIZE + 1
+    cache.clear()
+    assert cache.is_filled() is False
+
+
+def test_timeline_cache_writes_after_expiring(timeline_cache):
+    reader = Entity("cache_expired_reader", "user")
+    cache = get_timeline_cache(reader)
+    note = _make_note()
+    cache.fill([_timeline_doc(note)], True, 1)
+    # as if the cache ran out after a write checked it was filled
+    r = get_redis_connection(CACHE_SERVER)
+    r.delete(cache.meta_key)
+    add_to_timeline_caches(_make_note(), [reader])
+    set_seen_in_timeline_cache([note.id], reader, True, 1)
+    expire_from_timeline_caches([note.id], [reader], {reader: -1})
+    cache.set_unseen_count(5)
+    assert r.exists(cache.meta_key) is False
+    assert cache.is_filled() is False
+    # nothing got left behind without an expiration
+    for key in (cache.timeline_key, cache.notes_key, cache.unseen_key):
+        assert r.ttl(key) > 0
+    assert r.zcard(cache.timeline_key) == 1
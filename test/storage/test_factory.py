@@ -0,0 +1,57 @@
+import pytest
+from feeds.config import get_config
+from feeds.exceptions import ConfigError
+from feeds.storage import factory
+from feeds.storage.mongodb.activity_storage import MongoActivityStorage
+from feeds.storage.mongodb.timeline_storage import MongoTimelineStorage
+from feeds.storage.mongodb.inbox_storage import (
+    MongoInboxActivityStorage,
+    MongoInboxTimelineStorage,
+    MongoInboxGlobalSeenStorage
+)
+from feeds.storage.redis.activity_storage import RedisActivityStorage
+from feeds.storage.redis.timeline_storage import RedisTimelineStorage
+from feeds.storage.redis.feed_version_storage import RedisFeedVersionStorage
+
+
+@pytest.fixture
+def db_engine():
+    cfg = get_config()
+    engine = cfg.db_engine
+
+    def set_engine(new_engine):
+        cfg.db_engine = new_engine
+    yield set_engine
+    cfg.db_engine = engine
+
+
+def test_default_engine():
+    assert type(factory.get_activity_storage()) == MongoActivityStorage
+    assert type(factory.get_timeline_storage("some_user", "user")) == MongoTimelineStorage
+
+
+def test_inbox_engine(db_engine):
+    db_engine("mongodb-inbox")
+    assert isinstance(factory.get_activity_storage(), MongoInboxActivityStorage)
+    timeline = factory.get_timeline_storage("some_user", "user")
+    assert isinstance(timeline, MongoInboxTimelineStorage)
+    assert timeline.user_id == "some_user"
+    global_seen = factory.get_global_seen_storage()
+    assert isinstance(global_seen, MongoInboxGlobalSeenStorage)
+    assert global_seen.global_feed.id == get_config().global_feed
+
+
+def test_redis_engine(db_engine):
+    db_engine("redis")
+    assert isinstance(factory.get_activity_storage(), RedisActivityStorage)
+    timeline = factory.get_timeline_storage("some_user", "user")
+    assert isinstance(timeline, RedisTimelineStorage)
+    assert timeline.user_id == "some_user"
+    assert isinstance(factory.get_feed_version_storage(), RedisFeedVersionStorage)
+
+
+def test_unknown_engine(db_engine):
+    db_engine("not_an_engine")
+    with pytest.raises(ConfigError) as e:
+        factory.get_activity_storage()
+    assert "Unknown db-engine 'not_an_engine'" in str(e.value)
@@ -0,0 +1,42 @@
+from feeds.storage.global_seen import (
+    EMPTY_STATE,
+    is_seen,
+    update_state
+)
+
+
+def test_update_state_moves_hwm():
+    active = [("a", 1), ("b", 2), ("c", 3), ("d", 4)]
+    state = update_state(EMPTY_STATE, active, ["a", "b", "c"], True)
+    assert state == (3, set(), set())
+    state = update_state(state, active, ["b"], False)
+    assert state == (3, set(), {"b"})
+    assert [is_seen(state, act_id, created) for act_id, created in active] == \
+        [True, False, True, False]
+
+
+def test_update_state_keeps_hwm_on_ties():
+    active = [("a", 1), ("b", 3)]
+    # a mark at 1 or 2 needs no exceptions, so the current one stays
+    state = update_state((2, set(), set()), active, ["b"], False)
+    assert state == (2, set(), set())
+    state = update_state((0, set(), set()), active, ["a"], True)
+    assert state == (1, set(), set())
+
+
+def test_update_state_unsorted_and_tied_times():
+    active = [("c", 5), ("a", 1), ("b", 5), ("d", 7)]
+    state = update_state(EMPTY_STATE, active, ["a", "b", "c"], True)
+    assert state == (5, set(), set())
+    state = update_state(state, active, ["d"], True)
+    assert state == (7, set(), set())
+
+
+def test_update_state_many():
+    active = [("note_{}".format(i), i) for i in range(1, 50001)]
+    marked = [act_id for act_id, created in active if created % 2 == 0]
+    state = update_state(EMPTY_STATE, active, marked, True)
+    (hwm, seen, unseen) = state
+    assert len(seen) + len(unseen) == 25000
+    for act_id, created in active[:100]:
+        assert is_seen(state, act_id, created) is (created % 2 == 0)
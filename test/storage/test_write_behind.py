@@ -0,0 +1,107 @@
+import threading
+import time
+import pytest
+from feeds.storage.write_behind import (
+    WriteBehindQueue,
+    get_write_queue
+)
+from feeds.storage.factory import get_activity_storage
+from feeds.activity.notification import Notification
+from feeds.entity.entity import Entity
+from feeds.config import get_config
+from feeds.exceptions import ActivityStorageError
+
+
+def _make_note():
+    return Notification(
+        Entity("kbasetest", "user"), "invite", Entity("123", "workspace"), "ws"
+    )
+
+
+class _CountingQueue(WriteBehindQueue):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.batches = list()
+
+    def _write(self, batch):
+        self.batches.append(len(batch))
+        super()._write(batch)
+
+
+def test_no_write_queue():
+    assert get_write_queue() is None
+
+
+def test_durable_writes_are_batched(redis):
+    queue = _CountingQueue(10, 200, 100, True)
+    reader = Entity("write_behind_reader", "user")
+    notes = [_make_note() for i in range(10)]
+    threads = [threading.Thread(target=queue.add, args=(n, [reader])) for n in notes]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    # each add only returns once its note's stored
+    stored = get_activity_storage().get_by_id([n.id for n in notes])
+    assert all(stored[n.id] is not None for n in notes)
+    assert sum(queue.batches) == 10
+    assert len(queue.batches) < 10
+
+
+def test_async_writes_and_backpressure(redis):
+    queue = _CountingQueue(10, 5000, 2, False, put_timeout=0.05)
+    notes = [_make_note() for i in range(3)]
+    start = time.time()
+    queue.add(notes[0], [Entity("write_behind_reader", "user")])
+    queue.add(notes[1], [Entity("write_behind_reader", "user")])
+    assert time.time() - start < 1
+    # the first two are waiting for a batch to fill up, so there's no room for the third
+    with pytest.raises(ActivityStorageError) as e:
+        queue.add(notes[2], [Entity("write_behind_reader", "user")])
+    assert "the write queue is full" in str(e.value)
+    assert queue.flush(timeout=5) is True
+    assert queue.batches == [2]
+    stored = get_activity_storage().get_by_id([n.id for n in notes])
+    assert stored[notes[0].id] is not None and stored[notes[1].id] is not None
+    assert stored[notes[2].id] is None
+
+
+def test_durable_write_failure(redis):
+    class FailingQueue(WriteBehindQueue):
+        def _write(self, batch):
+            for entry in batch:
+                entry.error = "Failed to store activity: nope"
+                entry.done.set()
+
+    queue = FailingQueue(10, 10, 10, True)
+    with pytest.raises(ActivityStorageError) as e:
+        queue.add(_make_note(), [Entity("write_behind_reader", "user")])
+    assert str(e.value) == "Failed to store activity: nope"
+
+
+def test_durable_write_timeout(redis):
+    class SlowQueue(WriteBehindQueue):
+        def _write(self, batch):
+            time.sleep(0.5)
+            super()._write(batch)
+
+    queue = SlowQueue(10, 10, 10, True, write_timeout=0.05)
+    note = _make_note()
+    with pytest.raises(ActivityStorageError) as e:
+        queue.add(note, [Entity("write_behind_reader", "user")])
+    assert "timed out" in str(e.value)
+    # it still gets stored, a bit later
+    assert queue.flush(timeout=5) is True
+    assert get_activity_storage().get_by_id([note.id])[note.id] is not None
+
+
+def test_get_write_queue(redis):
+    cfg = get_config()
+    cfg.write_behind = "durable"
+    try:
+        queue = get_write_queue()
+        assert queue is get_write_queue()
+        assert queue.durable is True
+        assert queue.batch_size == cfg.write_batch_size
+    finally:
+        cfg.write_behind = "off"
@@ -67,6 +67,152 @@ def test_config_bad_port(dummy_config, dummy_auth_token, bad_val):
         os.environ['FEEDS_CONFIG'] = feeds_config_backup
 
 
+def test_config_cache(dummy_config, dummy_auth_token):
+    cfg_text = GOOD_CONFIG + ['cache-host=cachehost', 'cache-port=wrong']
+    cfg_path = dummy_config(cfg_text)
+    feeds_config_backup = os.environ.get('FEEDS_CONFIG')
+    os.environ['FEEDS_CONFIG'] = cfg_path
+    with pytest.raises(ConfigError) as e:
+        config.FeedsConfig()
+    assert "cache-port must be an int > 0! Got wrong" == str(e.value)
+    cfg_text[-1] = 'cache-port=6380'
+    dummy_config(cfg_text)
+    cfg = config.FeedsConfig()
+    assert cfg.cache_host == 'cachehost'
+    assert cfg.cache_port == 6380
+    dummy_config(GOOD_CONFIG)
+    assert config.FeedsConfig().cache_host is None
+    del os.environ['FEEDS_CONFIG']
+    if feeds_config_backup is not None:
+        os.environ['FEEDS_CONFIG'] = feeds_config_backup
+
+
+def test_config_entity_encoding(dummy_config, dummy_auth_token):
+    cfg_path = dummy_config(GOOD_CONFIG)
+    feeds_config_backup = os.environ.get('FEEDS_CONFIG')
+    os.environ['FEEDS_CONFIG'] = cfg_path
+    assert config.FeedsConfig().entity_encoding == 'document'
+    dummy_config(GOOD_CONFIG + ['entity-encoding=compact'])
+    assert config.FeedsConfig().entity_encoding == 'compact'
+    dummy_config(GOOD_CONFIG + ['entity-encoding=tiny'])
+    with pytest.raises(ConfigError) as e:
+        config.FeedsConfig()
+    assert "entity-encoding must be one of document, compact! Got tiny" == str(e.value)
+    del os.environ['FEEDS_CONFIG']
+    if feeds_config_backup is not None:
+        os.environ['FEEDS_CONFIG'] = feeds_config_backup
+
+
+def test_config_consumer(dummy_config, dummy_auth_token):
+    cfg_path = dummy_config(GOOD_CONFIG)
+    feeds_config_backup = os.environ.get('FEEDS_CONFIG')
+    os.environ['FEEDS_CONFIG'] = cfg_path
+    cfg = config.FeedsConfig()
+    assert cfg.consumer_broker == 'kafka'
+    assert cfg.consumer_topic == 'feeds'
+    assert cfg.consumer_group == 'feeds'
+    assert cfg.consumer_batch_size == 500
+    dummy_config(GOOD_CONFIG + ['consumer-broker=file', 'consumer-file=notes.ndjson',
+                                'consumer-batch-size=50'])
+    cfg = config.FeedsConfig()
+    assert cfg.consumer_broker == 'file'
+    assert cfg.consumer_file == 'notes.ndjson'
+    assert cfg.consumer_batch_size == 50
+    dummy_config(GOOD_CONFIG + ['consumer-broker=pigeon'])
+    with pytest.raises(ConfigError) as e:
+        config.FeedsConfig()
+    assert "consumer-broker must be one of kafka, file! Got pigeon" == str(e.value)
+    del os.environ['FEEDS_CONFIG']
+    if feeds_config_backup is not None:
+        os.environ['FEEDS_CONFIG'] = feeds_config_backup
+
+
+def test_config_db_engine(dummy_config, dummy_auth_token):
+    cfg_path = dummy_config(GOOD_CONFIG)
+    feeds_config_backup = os.environ.get('FEEDS_CONFIG')
+    os.environ['FEEDS_CONFIG'] = cfg_path
+    assert config.FeedsConfig().db_engine == 'redis'
+    dummy_config(['db-engine=mongodb-inbox' if line.startswith('db-engine') else line
+                  for line in GOOD_CONFIG])
+    assert config.FeedsConfig().db_engine == 'mongodb-inbox'
+    dummy_config(['db-engine=cassandra' if line.startswith('db-engine') else line
+                  for line in GOOD_CONFIG])
+    with pytest.raises(ConfigError) as e:
+        config.FeedsConfig()
+    assert "db-engine must be one of mongodb, mongodb-inbox, redis! Got cassandra" == str(e.value)
+    del os.environ['FEEDS_CONFIG']
+    if feeds_config_backup is not None:
+        os.environ['FEEDS_CONFIG'] = feeds_config_backup
+
+
+def test_config_write_behind(dummy_config, dummy_auth_token):
+    cfg_path = dummy_config(GOOD_CONFIG)
+    feeds_config_backup = os.environ.get('FEEDS_CONFIG')
+    os.environ['FEEDS_CONFIG'] = cfg_path
+    cfg = config.FeedsConfig()
+    assert cfg.write_behind == 'off'
+    assert cfg.write_batch_size == 100
+    assert cfg.write_batch_wait == 10
+    assert cfg.write_queue_size == 10000
+    dummy_config(GOOD_CONFIG + ['write-behind=durable', 'write-batch-wait=0'])
+    cfg = config.FeedsConfig()
+    assert cfg.write_behind == 'durable'
+    assert cfg.write_batch_wait == 0
+    dummy_config(GOOD_CONFIG + ['write-behind=sometimes'])
+    with pytest.raises(ConfigError) as e:
+        config.FeedsConfig()
+    assert "write-behind must be one of off, async, durable! Got sometimes" == str(e.value)
+    dummy_config(GOOD_CONFIG + ['write-queue-size=0'])
+    with pytest.raises(ConfigError) as e:
+        config.FeedsConfig()
+    assert "write-queue-size must be an int > 0! Got 0" == str(e.value)
+    dummy_config(GOOD_CONFIG + ['write-behind=async', 'idempotent-writes=true'])
+    with pytest.raises(ConfigError) as e:
+        config.FeedsConfig()
+    assert "write-behind=async can't be used with idempotent-writes! Use durable instead" == \
+        str(e.value)
+    dummy_config(GOOD_CONFIG + ['write-behind=durable', 'idempotent-writes=true'])
+    assert config.FeedsConfig().write_behind == 'durable'
+    del os.environ['FEEDS_CONFIG']
+    if feeds_config_backup is not None:
+        os.environ['FEEDS_CONFIG'] = feeds_config_backup
+
+
+def test_config_idempotent_writes(dummy_config, dummy_auth_token):
+    cfg_path = dummy_config(GOOD_CONFIG)
+    feeds_config_backup = os.environ.get('FEEDS_CONFIG')
+    os.environ['FEEDS_CONFIG'] = cfg_path
+    assert config.FeedsConfig().idempotent_writes is False
+    dummy_config(GOOD_CONFIG + ['idempotent-writes=true'])
+    assert config.FeedsConfig().idempotent_writes is True
+    del os.environ['FEEDS_CONFIG']
+    if feeds_config_backup is not None:
+        os.environ['FEEDS_CONFIG'] = feeds_config_backup
+
+
+def test_config_archive(dummy_config, dummy_auth_token):
+    cfg_path = dummy_config(GOOD_CONFIG)
+    feeds_config_backup = os.environ.get('FEEDS_CONFIG')
+    os.environ['FEEDS_CONFIG'] = cfg_path
+    cfg = config.FeedsConfig()
+    assert cfg.archive_grace == 30
+    assert cfg.archive_interval == 0
+    assert cfg.maintenance_interval == 30
+    dummy_config(GOOD_CONFIG + ['archive-grace=0', 'archive-interval=600',
+                                'maintenance-interval=0'])
+    cfg = config.FeedsConfig()
+    assert cfg.archive_grace == 0
+    assert cfg.archive_interval == 600
+    assert cfg.maintenance_interval == 0
+    dummy_config(GOOD_CONFIG + ['archive-interval=-1'])
+    with pytest.raises(ConfigError) as e:
+        config.FeedsConfig()
+    assert "archive-interval must be an int >= 0! Got -1" == str(e.value)
+    del os.environ['FEEDS_CONFIG']
+    if feeds_config_backup is not None:
+        os.environ['FEEDS_CONFIG'] = feeds_config_backup
+
+
 @pytest.mark.parametrize("bad_val", [("foo"), (-100), (0), (0.5)])
 def test_config_bad_lifespan(dummy_config, dummy_auth_token, bad_val):
     cfg_text = GOOD_CONFIG.copy()
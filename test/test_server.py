@@ -30,6 +30,7 @@ def test_server_get_paths_noauth(client, path):
     '/api/V1/notification',
     '/api/V1/notifications/see',
     '/api/V1/notifications/unsee',
+    '/api/V1/notifications/see_all',
     '/admin/api/V1/notification/global'
 ))
 def test_server_post_paths_noauth(client, path):
@@ -70,7 +71,8 @@ def test_permissions_user(client, requests_mock, mock_valid_user_token):
     assert 'GET' in data['permissions']
     valid_gets = set(['/api/V1/notifications/global', '/api/V1/notifications', '/api/V1/notification/<note_id>'])
     assert valid_gets == set(data['permissions']['GET'])
-    valid_posts = set(['/api/V1/notifications/see', '/api/V1/notifications/unsee'])
+    valid_posts = set(['/api/V1/notifications/see', '/api/V1/notifications/unsee',
+                       '/api/V1/notifications/see_all'])
     assert valid_posts == set(data['permissions']['POST'])
 
 
@@ -95,6 +97,7 @@ def test_permissions_service(client, requests_mock, mock_valid_service_token):
     valid_posts = set([
         '/api/V1/notifications/see',
         '/api/V1/notifications/unsee',
+        '/api/V1/notifications/see_all',
         '/api/V1/notification',
         '/api/V1/notifications/expire'
     ])
@@ -120,6 +123,7 @@ def test_permissions_admin(client, requests_mock, mock_valid_admin_token):
     valid_posts = set([
         '/api/V1/notifications/see',
         '/api/V1/notifications/unsee',
+        '/api/V1/notifications/see_all',
         '/admin/api/V1/notification/global',
         '/admin/api/V1/notifications/expire'
     ])
@@ -1,9 +1,39 @@
 import pytest
-from feeds.util import epoch_ms
+from feeds.util import (
+    epoch_ms,
+    encode_cursor,
+    decode_cursor,
+    sortable_id,
+    is_sortable_id
+)
+from feeds.exceptions import IllegalParameterError
 
 def test_epoch_ms():
     '''
     Just make sure it's an int with 13 digits. Be more rigorous later. At least, before year 2287.
     '''
     t = epoch_ms()
-    assert len(str(t)) == 13
\ No newline at end of file
+    assert len(str(t)) == 13
+
+def test_cursor_round_trip():
+    cursor = encode_cursor(1540877025814, "some-note-id")
+    assert isinstance(cursor, str)
+    assert decode_cursor(cursor) == (1540877025814, "some-note-id")
+
+
+@pytest.mark.parametrize("bad_cursor", ["not a cursor", "", "WzEsMl0=", "WyJhIiwiYiJd", "W3RydWUsImEiXQ=="])
+def test_decode_cursor_fail(bad_cursor):
+    with pytest.raises(IllegalParameterError) as e:
+        decode_cursor(bad_cursor)
+    assert "Invalid cursor" in str(e.value)
+
+
+def test_sortable_id():
+    t = 1540877025814
+    ids = [sortable_id(t), sortable_id(t + 1), sortable_id(t + 1000), sortable_id(t * 2)]
+    assert ids == sorted(ids)
+    assert sortable_id(t)[:10] == ids[0][:10]
+    assert sortable_id(t) != ids[0]
+    assert all(len(i) == 26 and is_sortable_id(i) for i in ids)
+    assert not is_sortable_id("ad0e9c2a-7b1f-4e5e-9a55-5d2b3b04d7c6")
+    assert not is_sortable_id("0" * 25 + "U")
@@ -5,8 +5,10 @@ from pathlib import Path
 import os
 import tempfile
 import configparser
+from feeds.util import is_sortable_id
 
 MONGO_EXE = "mongo-exe"
+REDIS_EXE = "redis-exe"
 TEMP_DIR = "test-temp-dir"
 DELETE_TEMP_FILES = "delete-temp-files"
 
@@ -15,6 +17,9 @@ def assert_is_uuid(s):
     # raises a ValueError if not. Good enough for testing.
     uuid.UUID(s)
 
+def assert_is_sortable_id(s):
+    assert is_sortable_id(s), "{} is not a sortable id".format(s)
+
 class TestException(Exception):
     pass
 
@@ -22,6 +27,10 @@ def get_mongo_exe() -> Path:
     cfg = test_config()
     return Path(os.path.abspath(cfg.get('test', MONGO_EXE)))
 
+def get_redis_exe() -> Path:
+    cfg = test_config()
+    return Path(os.path.abspath(cfg.get('test', REDIS_EXE)))
+
 def find_free_port() -> int:
     with closing(socket.socket(socket.AF_INET, socket.SOCK_STREAM)) as s:
         s.bind(('', 0))